@@ -0,0 +1,109 @@
+"""
+Local analytics over the files written by export.py
+
+Nothing here connects to MongoDB. Arrow files are memory-mapped: a query
+reads only the columns and dates it asks for, straight from the page cache,
+and several queries (or processes) share the same memory.
+
+    from analytics import events, dimension
+    watches = events("watch_history", start="2024-01-01", columns=["movie_id", "watch_duration"])
+
+Usage:
+    python analytics.py duration-by-genre [--start 2024-01-01] [--end 2024-12-31]
+    python analytics.py duration-by-subscription
+"""
+import argparse
+import os
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.fs
+import pyarrow.parquet as pq
+
+from export import ANALYTICS_PATH, EXTENSIONS, read_watermark
+
+# Partition directories are date=YYYY-MM-DD
+# Why strings? ISO dates compare correctly as text
+PARTITIONING = ds.partitioning(pa.schema([("date", pa.string())]), flavor="hive")
+
+
+def export_format(path=ANALYTICS_PATH):
+    file_format = read_watermark(path).get("format")
+    if file_format is None:
+        raise FileNotFoundError(f"No export in {path}, run `python export.py` first")
+    return file_format
+
+
+def events(name, start=None, end=None, columns=None, path=ANALYTICS_PATH):
+    """
+    Events ("watch_history" or "reviews") of the dates start..end (inclusive,
+    "YYYY-MM-DD"), as an Arrow table; only the partitions in range are opened
+    """
+    file_format = export_format(path)
+    dataset = ds.dataset(
+        os.path.join(path, name),
+        format="ipc" if file_format == "arrow" else "parquet",
+        partitioning=PARTITIONING,
+        filesystem=pyarrow.fs.LocalFileSystem(use_mmap=True)
+    )
+    condition = None
+    for bound in [ds.field("date") >= start if start else None, ds.field("date") <= end if end else None]:
+        if bound is not None:
+            condition = bound if condition is None else condition & bound
+    return dataset.to_table(columns=columns, filter=condition)
+
+
+def dimension(name, path=ANALYTICS_PATH):
+    """The "movies" or "users" snapshot as an Arrow table"""
+    file_format = export_format(path)
+    file_path = os.path.join(path, f"{name}.{EXTENSIONS[file_format]}")
+    if file_format == "parquet":
+        return pq.read_table(file_path, memory_map=True)
+    # Why read_all on a memory map? The table's buffers point into the file
+    return pa.ipc.open_file(pa.memory_map(file_path)).read_all()
+
+
+def watch_duration_by(table, key):
+    """Total, count and average watch_duration per value of `key`, biggest total first"""
+    totals = table.group_by(key).aggregate([
+        ("watch_duration", "sum"), ("watch_duration", "count"), ("watch_duration", "mean")
+    ])
+    return totals.sort_by([("watch_duration_sum", "descending")])
+
+
+def watch_duration_by_genre(start=None, end=None, path=ANALYTICS_PATH):
+    watches = events("watch_history", start, end, ["movie_id", "watch_duration"], path)
+    movies = dimension("movies", path)
+    # One row per (movie, genre): a movie with several genres counts towards each
+    # Why flatten before the join? Joins can't carry list columns
+    genres = movies["genres"]
+    movie_genres = pa.table({
+        "_id": pc.take(movies["_id"], pc.list_parent_indices(genres)),
+        "genre": pc.list_flatten(genres)
+    })
+    return watch_duration_by(watches.join(movie_genres, "movie_id", "_id"), "genre")
+
+
+def watch_duration_by_subscription(start=None, end=None, path=ANALYTICS_PATH):
+    watches = events("watch_history", start, end, ["user_id", "watch_duration"], path)
+    users = dimension("users", path).select(["_id", "subscription_type"])
+    return watch_duration_by(watches.join(users, "user_id", "_id"), "subscription_type")
+
+
+QUERIES = {
+    "duration-by-genre": watch_duration_by_genre,
+    "duration-by-subscription": watch_duration_by_subscription
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the analytics export")
+    parser.add_argument("query", choices=sorted(QUERIES))
+    parser.add_argument("--start", help="First date, YYYY-MM-DD")
+    parser.add_argument("--end", help="Last date, YYYY-MM-DD")
+    parser.add_argument("--path", default=ANALYTICS_PATH)
+    args = parser.parse_args()
+
+    for row in QUERIES[args.query](args.start, args.end, args.path).to_pylist():
+        print(row)
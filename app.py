@@ -1,57 +1,175 @@
-from fastapi import FastAPI, HTTPException, Query
-from database import get_db, create_indexes
+from fastapi import FastAPI, HTTPException, Path, Query, Request
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from database import get_async_db, get_db
+from pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, decode_cursor, keyset_stages, next_page, ndjson_stream
+from cache import CACHE_TTLS, response_cache, make_key, movie_tag, normalize, reviews_tag, invalidate_for_review
+from models import OBJECT_ID_PATTERN, Movie, MovieIds, NewReview, WatchHistory
+from existence import known_movies, known_users
+from indexes import index_reconciler
+from profiling import ProfiledRoute, ProfilingMiddleware, phase, render_metrics
+from search_engine import SEARCH_BACKEND, search_engine
+from facets import browse_filter, facet_cache
+from suggest import DEFAULT_SUGGESTIONS, MAX_PREFIX_LENGTH, MAX_SUGGESTIONS, suggest_index
+from serialization import BSONResponse, dumps
+from scoring import DEFAULT_WEIGHTS, hybrid_scores, normalize_weights, score_fields, top_page
+from ingest import INGEST_MAX_LINES, QueueFullError, StagingError, WatchEventBuffer
+from startup import warmup
+from pydantic import ValidationError
+from pymongo import ReturnDocument
+from ratings import average_rating, effective_rating, review_stats_update
+from archive import archived_count, archived_history, archived_months, watch_archiver
+from recommendations import DEFAULT_RECOMMENDATIONS, MAX_RECOMMENDATIONS, RECENT_HISTORY, recommender
+from trending import DEFAULT_DAYS, MAX_DAYS, DEFAULT_TOP_K, MAX_TOP_K, top_movie_counts
+from views import ViewMaintainer
 from bson import ObjectId
-from datetime import datetime, timedelta
+from contextlib import asynccontextmanager
+from datetime import datetime
 from typing import Optional
+import asyncio
+import numpy as np
+import os
 
-app = FastAPI(title="Movie Streaming Backend")
+# Database connection, created in lifespan
+# Why async? Every handler awaits its queries so one slow aggregation
+# doesn't block the event loop for all other requests
+# Why not at import? Importing the app opens no client (see database.py)
+db = None
 
-# Get database connection
-db = get_db()
+# Queue + background writer for POST /events/watch (see ingest.py)
+watch_buffer = None
 
-# Create indexes when app starts
-# Why here? Run once when server starts
-@app.on_event("startup")
-async def startup_event():
-    create_indexes()
+# With several workers (serve.py), jobs that must run once per database
+# (view updates, index builds, archiving, model rebuilds) run in worker 0
+PRIMARY_WORKER = os.environ.get('API_WORKER_INDEX', '0') == '0'
 
+# Background worker keeping trending, popularity and ratings current (see views.py)
+# Other workers follow it to keep their own search index current
+view_maintainer = None
 
-# Helper function to convert MongoDB ObjectId to string
-# Why? ObjectId is not JSON serializable, need to convert to string
-def convert_objectid(data):
-    """Convert MongoDB ObjectId to string for JSON response"""
-    if isinstance(data, list):
-        for item in data:
-            if '_id' in item:
-                item['_id'] = str(item['_id'])
-    elif isinstance(data, dict):
-        if '_id' in data:
-            data['_id'] = str(data['_id'])
-    return data
+# Deepest search result a client can page to
+# Why a cap? Every skipped result still has to be ranked
+MAX_SEARCH_OFFSET = 1000
+
+# Deepest browse page a client can ask for
+# Why a cap? Skipped movies are still walked in the index
+MAX_BROWSE_OFFSET = 1000
+
+# Browse sort orders; each is served by a browse_* index (see indexes.py)
+# Why _id too? Movies with the same rating keep a stable order across pages
+BROWSE_SORTS = {
+    "rating": [("rating", -1), ("_id", -1)],
+    "popularity": [("watch_count", -1), ("_id", -1)]
+}
+
+# Movie fields fetched for search results
+# Why a projection? Long fields like the full cast are never sent over
+# the wire; review_count/rating_sum are needed for effective_rating
+SEARCH_RESULT_FIELDS = {
+    "title": 1, "release_year": 1, "genres": 1, "director": 1, "rating": 1,
+    "review_count": 1, "rating_sum": 1, "watch_count": 1
+}
+
+
+# Start background work when the server starts, stop it when it exits
+# Why lifespan? Startup and shutdown live in one place, in order
+@asynccontextmanager
+async def lifespan(app):
+    global db, watch_buffer, view_maintainer
+    # Why nothing slow here? The server only accepts connections once this
+    # part is done, so it only creates clients and starts tasks
+    db = get_async_db()
+    watch_buffer = WatchEventBuffer(db)
+    view_maintainer = ViewMaintainer(db, follower=not PRIMARY_WORKER)
+    
+    # Map the co-watch model (built by `python recommendations.py --build`)
+    await run_in_threadpool(recommender.load)
+    recommender.start(get_db(), rebuild=PRIMARY_WORKER)
+    # Move months older than the hot window to the archive (see archive.py)
+    if PRIMARY_WORKER:
+        watch_archiver.start(get_db())
+    # Worker 0 also writes events left staged by a crashed worker
+    watch_buffer.start(recover=PRIMARY_WORKER)
+    
+    # Loaded in the background once MongoDB answers; /ready says when done
+    # (see startup.py)
+    steps = []
+    if PRIMARY_WORKER:
+        # Compare declared and existing indexes; missing ones are built in
+        # the background (see indexes.py), nothing happens when they match
+        steps.append(("indexes", lambda: index_reconciler.start(get_db())))
+    if SEARCH_BACKEND == "memory":
+        # In-memory search index (only when it serves search)
+        steps.append(("search", lambda: search_engine.load(db)))
+    steps += [
+        # Typeahead index over titles and names (see suggest.py)
+        ("suggestions", lambda: suggest_index.load(db)),
+        # Bloom filters of existing ids (see existence.py)
+        ("user_ids", lambda: known_users.load(db)),
+        ("movie_ids", lambda: known_movies.load(db))
+    ]
+    # Why start the view worker after? It updates the indexes loaded above
+    warmup.start(db, steps, then=view_maintainer.start)
+    
+    yield
+    
+    # Flush queued watch events before the server exits
+    await watch_buffer.stop()
+    await warmup.stop()
+    await view_maintainer.stop()
+    await recommender.stop()
+    await watch_archiver.stop()
+    await index_reconciler.stop()
+    await known_users.stop()
+    await known_movies.stop()
+
+app = FastAPI(title="Movie Streaming Backend", lifespan=lifespan)
+
+# Per-request timings: Server-Timing header + /metrics (see profiling.py)
+# Why set route_class here? It only applies to routes declared after it
+app.router.route_class = ProfiledRoute
+app.add_middleware(ProfilingMiddleware)
 
 
 # API 1: Get user's watch history
 @app.get("/users/{user_id}/history")
-async def get_user_watch_history(user_id: str):
+async def get_user_watch_history(
+    user_id: str = Path(..., pattern=OBJECT_ID_PATTERN),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's next_cursor"),
+    stream: bool = Query(False, description="Stream all remaining records as NDJSON"),
+    include_archive: bool = Query(False, description="Also read months older than the hot window")
+):
     """
-    Get all movies watched by a specific user
+    Get movies watched by a specific user, newest first, one page at a time
     Why this API? Users want to see their viewing history
+    Why pages? A heavy user's full history should never be loaded at once
+    Why opt-in archive? Old months are compressed in another collection
+    (see archive.py), most clients only look at recent history
     """
     
     # Check if user exists
-    user = db.users.find_one({"_id": ObjectId(user_id)})
-    if not user:
+    # Why known_users? The name is usually in memory and an unknown id is
+    # usually ruled out by a Bloom filter, no round trip (see existence.py)
+    user_oid = ObjectId(user_id)
+    user_name = await known_users.name_of(db, user_oid)
+    if user_name is None:
         raise HTTPException(status_code=404, detail="User not found")
     
+    # Streaming has no page size unless one is asked for
+    if not stream:
+        limit = limit or DEFAULT_PAGE_SIZE
+    
     # Get watch history for this user
     # Why aggregate? Need to join watch_history with movies collection
-    pipeline = [
-        # Step 1: Filter watch history for this user
-        {"$match": {"user_id": user_id}},
-        
-        # Step 2: Sort by timestamp (newest first)
-        {"$sort": {"timestamp": -1}},
-        
+    try:
+        # Step 1 & 2: Filter this user's records after the cursor, newest first
+        pipeline = keyset_stages({"user_id": user_oid}, after, limit)
+        position = decode_cursor(after) if after else None
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    pipeline += [
         # Step 3: Join with movies collection to get movie details
         # Why lookup? Like SQL JOIN - get movie info for each watch record
         {"$lookup": {
@@ -62,7 +180,9 @@ async def get_user_watch_history(user_id: str):
         }},
         
         # Step 4: Unwind movie_details array (convert array to object)
-        {"$unwind": "$movie_details"},
+        # Why keep events without a movie? The look-ahead event and the
+        # cursor must not depend on the join (see next_page)
+        {"$unwind": {"path": "$movie_details", "preserveNullAndEmptyArrays": True}},
         
         # Step 5: Format output - select which fields to show
         {"$project": {
@@ -75,38 +195,119 @@ async def get_user_watch_history(user_id: str):
         }}
     ]
     
-    history = list(db.watch_history.aggregate(pipeline))
-    history = convert_objectid(history)
+    if stream:
+        # No cursor when streaming, events of deleted movies are skipped here
+        docs = db.watch_history.aggregate(pipeline + [{"$match": {"movie_title": {"$exists": True}}}])
+        if include_archive:
+            docs = with_archived_history(docs, user_oid, position)
+        return StreamingResponse(ndjson_stream(docs), media_type="application/x-ndjson")
     
-    return {
+    history = await db.watch_history.aggregate(pipeline).to_list(length=limit + 1)
+    if include_archive:
+        # Why newer_than? With a full hot page, only archived events newer
+        # than its last one can make the page (usually none, no read at all)
+        newer_than = None
+        if len(history) > limit:
+            newer_than = (history[-1]['watched_on'], history[-1]['_id'])
+        archived = await archived_history(db, user_oid, position, newer_than, limit + 1)
+        history += await history_entries(archived)
+        history.sort(key=lambda entry: (entry['watched_on'], entry['_id']), reverse=True)
+        history = history[:limit + 1]
+    history, next_cursor = next_page(history, limit, "watched_on", "movie_title")
+    
+    # Count on the server instead of len() of a fully loaded list
+    total_watched = await db.watch_history.count_documents({"user_id": user_oid})
+    if include_archive:
+        total_watched += await archived_count(db, user_oid)
+    
+    # Why BSONResponse? ObjectIds and datetimes are encoded directly
+    # (see serialization.py)
+    return BSONResponse({
         "user_id": user_id,
-        "user_name": user['name'],
-        "total_movies_watched": len(history),
-        "watch_history": history
-    }
+        "user_name": user_name,
+        "total_movies_watched": total_watched,
+        "watch_history": history,
+        "next_cursor": next_cursor
+    })
+
+
+# Helpers for archived watch history
+async def history_entries(events):
+    """Archived events in the same shape as the history pipeline's output"""
+    movies = {}
+    cursor = db.movies.find(
+        {"_id": {"$in": list({event['movie_id'] for event in events})}},
+        {"title": 1, "genres": 1, "rating": 1}
+    )
+    async for movie in cursor:
+        movies[movie['_id']] = movie
+    
+    entries = []
+    for event in events:
+        entry = {
+            "_id": event['_id'],
+            "movie_id": event['movie_id'],
+            "watched_on": event['timestamp'],
+            "watch_duration": event['watch_duration']
+        }
+        # Movie was deleted: no movie fields, like the pipeline's entries
+        # (dropped by next_page after the cursor is taken)
+        movie = movies.get(event['movie_id'])
+        if movie:
+            entry.update(movie_title=movie['title'], genres=movie.get('genres'), rating=movie.get('rating'))
+        entries.append(entry)
+    return entries
+
+
+async def with_archived_history(hot_docs, user_id, position):
+    """Hot history first, then the archived months, newest first"""
+    async for doc in hot_docs:
+        yield doc
+    async for events in archived_months(db, user_id, position):
+        for entry in await history_entries(events):
+            if "movie_title" in entry:
+                yield entry
 
 
 # API 2: Get movie reviews
 @app.get("/movies/{movie_id}/reviews")
-async def get_movie_reviews(movie_id: str):
+async def get_movie_reviews(
+    movie_id: str = Path(..., pattern=OBJECT_ID_PATTERN),
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    after: Optional[str] = Query(None, description="Cursor from the previous page's next_cursor"),
+    stream: bool = Query(False, description="Stream all remaining reviews as NDJSON")
+):
     """
-    Get all reviews for a specific movie
+    Get reviews for a specific movie, newest first, one page at a time
     Why this API? Users want to read reviews before watching
     """
     
-    # Check if movie exists
-    movie = db.movies.find_one({"_id": ObjectId(movie_id)})
-    if not movie:
+    # Serve repeated requests from the cache (streams are never cached)
+    # Why str(ObjectId)? Hex case is the only freedom in a valid id
+    cache_key = make_key("reviews", movie_id=str(ObjectId(movie_id)), limit=limit, after=after)
+    if not stream:
+        cached = await response_cache.get(cache_key)
+        if cached is not None:
+            return BSONResponse(cached)
+    
+    # Check if movie exists (usually answered from memory, see existence.py)
+    movie_oid = ObjectId(movie_id)
+    movie_title = await known_movies.name_of(db, movie_oid)
+    if movie_title is None:
         raise HTTPException(status_code=404, detail="Movie not found")
     
-    # Get all reviews for this movie
-    pipeline = [
-        # Step 1: Filter reviews for this movie
-        {"$match": {"movie_id": movie_id}},
-        
-        # Step 2: Sort by timestamp (newest first)
-        {"$sort": {"timestamp": -1}},
-        
+    # Streaming has no page size unless one is asked for
+    if not stream:
+        limit = limit or DEFAULT_PAGE_SIZE
+    
+    # Get reviews for this movie
+    try:
+        # Step 1 & 2: Filter this movie's reviews after the cursor, newest first
+        pipeline = keyset_stages({"movie_id": movie_oid}, after, limit)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    pipeline += [
         # Step 3: Join with users collection to get reviewer name
         {"$lookup": {
             "from": "users",
@@ -115,8 +316,9 @@ async def get_movie_reviews(movie_id: str):
             "as": "user_details"
         }},
         
-        # Step 4: Unwind user_details
-        {"$unwind": "$user_details"},
+        # Step 4: Unwind user_details, keeping reviews of deleted users
+        # until the page is cut (see next_page)
+        {"$unwind": {"path": "$user_details", "preserveNullAndEmptyArrays": True}},
         
         # Step 5: Format output
         {"$project": {
@@ -127,161 +329,609 @@ async def get_movie_reviews(movie_id: str):
         }}
     ]
     
-    reviews = list(db.reviews.aggregate(pipeline))
-    reviews = convert_objectid(reviews)
+    if stream:
+        return StreamingResponse(
+            ndjson_stream(db.reviews.aggregate(pipeline + [{"$match": {"user_name": {"$exists": True}}}])),
+            media_type="application/x-ndjson"
+        )
     
-    # Calculate average rating
-    # Why? Give users quick overview of movie quality
-    avg_rating = sum(r['rating'] for r in reviews) / len(reviews) if reviews else 0
+    # Why gather? The rating aggregates change with every review, so they are
+    # read each time, but alongside the page instead of before it
+    reviews, movie = await asyncio.gather(
+        db.reviews.aggregate(pipeline).to_list(length=limit + 1),
+        db.movies.find_one({"_id": movie_oid}, {"review_count": 1, "rating_sum": 1, "rating_histogram": 1})
+    )
+    movie = movie or {}
+    reviews, next_cursor = next_page(reviews, limit, "posted_on", "user_name")
     
-    return {
+    # Average rating over ALL reviews, not just this page
+    # Why from the movie document? review_count/rating_sum are kept up to date
+    # on every new review (see ratings.py), so no scan of reviews is needed
+    result = {
         "movie_id": movie_id,
-        "movie_title": movie['title'],
-        "average_rating": round(avg_rating, 2),
-        "total_reviews": len(reviews),
-        "reviews": reviews
+        "movie_title": movie_title,
+        "average_rating": round(average_rating(movie), 2),
+        "total_reviews": movie.get('review_count', 0),
+        "rating_histogram": movie.get('rating_histogram', {}),
+        "reviews": reviews,
+        "next_cursor": next_cursor
+    }
+    # Tagged so a new review for this movie drops it (see add_movie_review)
+    # Why str(movie_oid)? The path may be upper-case hex, the tag must be the
+    # same for every spelling of the id
+    body = dumps(result)
+    await response_cache.set(cache_key, body, CACHE_TTLS["reviews"], tags=[reviews_tag(str(movie_oid))])
+    return BSONResponse(body)
+
+
+# Post a review for a movie
+@app.post("/movies/{movie_id}/reviews", status_code=201)
+async def add_movie_review(review: NewReview, movie_id: str = Path(..., pattern=OBJECT_ID_PATTERN)):
+    """
+    Add a user's review to a movie
+    Why update the aggregates here? The next read (this client's too) must
+    include the new rating; the view worker only refreshes other processes
+    Why invalidate? Cached reviews pages for this movie are now stale
+    """
+    
+    movie_oid = ObjectId(movie_id)
+    if not await known_movies.exists(db, movie_oid):
+        raise HTTPException(status_code=404, detail="Movie not found")
+    if not await known_users.exists(db, review.user_id):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    doc = {
+        "user_id": review.user_id,
+        "movie_id": movie_oid,
+        "rating": review.rating,
+        "review_text": review.review_text,
+        "timestamp": datetime.now()
     }
+    result = await db.reviews.insert_one(doc)
+    
+    # Add the rating to the movie's running aggregates in one atomic $inc
+    # Why before invalidating? A read in between would cache the old average
+    movie = await db.movies.find_one_and_update(
+        {"_id": movie_oid},
+        review_stats_update([review.rating]),
+        projection={"rating": 1, "review_count": 1, "rating_sum": 1},
+        return_document=ReturnDocument.AFTER
+    )
+    await invalidate_for_review(str(movie_oid))
+    if movie and search_engine.loaded:
+        search_engine.set_rating(movie_oid, effective_rating(movie))
+    
+    return {"review_id": str(result.inserted_id), "movie_id": movie_id}
 
 
 # API 3: Hybrid search for movies
 @app.get("/movies/search")
-async def search_movies(query: str = Query(..., description="Search query")):
+async def search_movies(
+    query: str = Query(..., description="Search query"),
+    limit: int = Query(20, ge=1, le=100, description="Number of results to return"),
+    offset: int = Query(0, ge=0, le=MAX_SEARCH_OFFSET, description="Number of ranked results to skip"),
+    w_similarity: float = Query(DEFAULT_WEIGHTS[0], ge=0, description="Weight of text match"),
+    w_rating: float = Query(DEFAULT_WEIGHTS[1], ge=0, description="Weight of rating"),
+    w_popularity: float = Query(DEFAULT_WEIGHTS[2], ge=0, description="Weight of popularity")
+):
     """
     Search movies with hybrid ranking
     Why hybrid? Combines text search + rating + popularity for best results
+    Why weights as parameters? Ranking can be A/B tested without a deploy
     """
+    try:
+        weights = normalize_weights(w_similarity, w_rating, w_popularity)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    # Serve repeated queries from the cache ("Nolan" and " nolan" share a key)
+    cache_key = make_key("search", query=normalize(query), limit=limit, offset=offset, weights=weights)
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        return BSONResponse(cached)
+    
+    # In-memory engine: BM25 + prefix/typo matching, ranked inside the engine
+    if SEARCH_BACKEND == "memory" and search_engine.loaded:
+        result = await search_with_engine(query, limit, offset, weights)
+        tags = [movie_tag(movie['_id']) for movie in result['results']]
+        body = dumps(result)
+        await response_cache.set(cache_key, body, CACHE_TTLS["search"], tags=tags)
+        return BSONResponse(body)
     
     # Step 1: Text search using MongoDB text index
     # Why $text? Uses the text index we created for fast search
-    search_results = list(db.movies.find(
+    search_results = await db.movies.find(
         {"$text": {"$search": query}},
-        {"score": {"$meta": "textScore"}}  # Get relevance score
-    ).sort([("score", {"$meta": "textScore"})]))
+        dict(SEARCH_RESULT_FIELDS, score={"$meta": "textScore"})  # Get relevance score
+    ).sort([("score", {"$meta": "textScore"})]).to_list(length=None)
     
     if not search_results:
-        return {
+        result = {
             "query": query,
             "total_results": 0,
+            "weights": weights,
             "results": []
         }
+        body = dumps(result)
+        await response_cache.set(cache_key, body, CACHE_TTLS["search"])
+        return BSONResponse(body)
     
-    # Step 2: Calculate popularity (watch count) for each movie
+    # Step 2: Popularity (watch count) of each movie
     # Why? Popular movies should rank higher
-    movie_ids = [str(movie['_id']) for movie in search_results]
-    
-    # Count how many times each movie was watched
-    watch_counts = {}
-    for movie_id in movie_ids:
-        count = db.watch_history.count_documents({"movie_id": movie_id})
-        watch_counts[movie_id] = count
-    
-    # Find max watch count for normalization
-    # Why normalize? Convert all scores to 0-1 range for fair comparison
-    max_watch_count = max(watch_counts.values()) if watch_counts else 1
-    
-    # Step 3: Calculate hybrid score for each movie
-    # Formula: 50% similarity + 30% rating + 20% popularity
-    for movie in search_results:
-        movie_id = str(movie['_id'])
-        
-        # Normalize text similarity score (0-1)
-        # Why divide by 10? MongoDB text scores are usually 0-10
-        similarity_score = min(movie.get('score', 0) / 10, 1.0)
-        
-        # Normalize rating (0-1)
-        # Why divide by 5? Ratings are out of 5
-        rating_score = movie.get('rating', 0) / 5.0
-        
-        # Normalize popularity (0-1)
-        popularity_score = watch_counts.get(movie_id, 0) / max_watch_count
+    # Why read it from the movie? The view worker keeps watch_count current,
+    # so no aggregation over watch_history per search
+    counts = np.array([movie.get('watch_count', 0) for movie in search_results], dtype=float)
+    
+    with phase("scoring"):
+        # Step 3: Gather the score components into arrays, normalized to 0-1
+        # Why arrays? One vectorized pass instead of Python arithmetic per movie
+        # Why divide the text score by 10? MongoDB text scores are usually 0-10
+        similarity = np.minimum(np.array([movie.get('score', 0) for movie in search_results], dtype=float) / 10, 1.0)
+        # Why effective_rating? Uses real user reviews once a movie has any
+        rating = np.array([effective_rating(movie) for movie in search_results], dtype=float) / 5.0
+        # Why 'or 1'? Avoid dividing by zero when no candidate was ever watched
+        popularity = counts / (counts.max() or 1)
         
-        # Calculate final hybrid score
-        hybrid_score = (
-            0.5 * similarity_score +  # 50% weight to text match
-            0.3 * rating_score +      # 30% weight to rating
-            0.2 * popularity_score    # 20% weight to popularity
-        )
+        # Step 4: Hybrid score (default: 50% similarity + 30% rating + 20% popularity)
+        # and only the requested page is sorted
+        hybrid = hybrid_scores(similarity, rating, popularity, weights)
+        page = top_page(hybrid, offset, limit)
         
-        movie['hybrid_score'] = round(hybrid_score, 3)
-        movie['similarity_score'] = round(similarity_score, 3)
-        movie['rating_score'] = round(rating_score, 3)
-        movie['popularity_score'] = round(popularity_score, 3)
-        movie['watch_count'] = watch_counts.get(movie_id, 0)
+        results = []
+        for position, scores in zip(page.tolist(), score_fields(hybrid, similarity, rating, popularity, page)):
+            movie = search_results[position]
+            movie.update(scores, watch_count=movie.get('watch_count', 0))
+            results.append(movie)
+    
+    result = {
+        "query": query,
+        "total_results": len(search_results),
+        "weights": weights,
+        "results": results
+    }
+    # Tagged with every movie in the results so a write to any of them drops it
+    tags = [movie_tag(movie['_id']) for movie in results]
+    body = dumps(result)
+    await response_cache.set(cache_key, body, CACHE_TTLS["search"], tags=tags)
+    return BSONResponse(body)
+
+
+# Helper for search with the in-memory engine
+async def search_with_engine(query, limit, offset, weights):
+    """Rank with search_engine, then fetch only the movies of the page"""
+    with phase("scoring"):
+        total, ranked = search_engine.search(query, limit, offset, weights)
     
-    # Step 4: Sort by hybrid score (highest first)
-    search_results.sort(key=lambda x: x['hybrid_score'], reverse=True)
+    # One $in query for the page, put back in ranking order
+    movies = {}
+    cursor = db.movies.find({"_id": {"$in": [movie_id for movie_id, _ in ranked]}}, SEARCH_RESULT_FIELDS)
+    async for movie in cursor:
+        movies[movie['_id']] = movie
     
-    # Convert ObjectId to string for JSON response
-    search_results = convert_objectid(search_results)
+    results = []
+    for movie_id, scores in ranked:
+        movie = movies.get(movie_id)
+        if movie:
+            movie.update(scores)
+            results.append(movie)
     
     return {
         "query": query,
-        "total_results": len(search_results),
-        "results": search_results
+        "total_results": total,
+        "weights": weights,
+        "results": results
     }
 
 
+# Browse the catalog by genre, year and rating
+@app.get("/movies/browse")
+async def browse_movies(
+    genre: Optional[str] = Query(None, description="Only movies of this genre"),
+    year_from: Optional[int] = Query(None, description="Released in or after this year"),
+    year_to: Optional[int] = Query(None, description="Released in or before this year"),
+    min_rating: Optional[float] = Query(None, ge=0, le=5, description="Minimum catalog rating"),
+    sort: str = Query("rating", pattern="^(rating|popularity)$", description="rating or popularity"),
+    limit: int = Query(20, ge=1, le=100, description="Number of movies to return"),
+    offset: int = Query(0, ge=0, le=MAX_BROWSE_OFFSET, description="Number of movies to skip")
+):
+    """
+    Filtered, sorted page of the catalog with facet counts per genre and decade
+    Why is it fast on a big catalog? The page is read in order from a
+    compound index, and facet counts come from facet_cache (see facets.py)
+    """
+    if year_from is not None and year_to is not None and year_from > year_to:
+        raise HTTPException(status_code=400, detail="year_from is after year_to")
+    
+    # Step 1: One page, in index order
+    movies = await db.movies.find(
+        browse_filter(genre, year_from, year_to, min_rating), SEARCH_RESULT_FIELDS
+    ).sort(BROWSE_SORTS[sort]).skip(offset).limit(limit).to_list(length=limit)
+    for movie in movies:
+        movie['watch_count'] = movie.get('watch_count', 0)
+    
+    # Step 2: Facet counts (the total is the selected genre's count)
+    with phase("facets"):
+        genre_counts = await facet_cache.genre_counts(db, year_from, year_to, min_rating)
+        decade_counts = await facet_cache.decade_counts(db, genre, min_rating)
+    total = genre_counts['genres'].get(genre, 0) if genre else genre_counts['total']
+    
+    return BSONResponse({
+        "total_results": total,
+        "sort": sort,
+        "results": movies,
+        "facets": {
+            "genres": [{"genre": name, "count": count} for name, count in genre_counts['genres'].most_common()],
+            "decades": [{"decade": decade, "count": count} for decade, count in sorted(decade_counts.items()) if count]
+        }
+    })
+
+
+# Helper for the batch endpoints
+def batch_object_ids(ids):
+    """ObjectId of each requested id, None where it isn't a valid one"""
+    return [ObjectId(movie_id) if ObjectId.is_valid(movie_id) else None for movie_id in ids]
+
+
+# Several movies in one request
+@app.post("/movies/batch")
+async def get_movies_batch(body: MovieIds):
+    """
+    Get up to MAX_BATCH_IDS movies at once, in the order asked for
+    Why? A grid of 50 titles is one request and one $in query instead of 50
+    Missing (or malformed) ids come back as {"movie_id": ..., "found": false}
+    """
+    object_ids = batch_object_ids(body.ids)
+    movies = {}
+    cursor = db.movies.find({"_id": {"$in": [oid for oid in object_ids if oid]}}, SEARCH_RESULT_FIELDS)
+    async for movie in cursor:
+        movie['average_rating'] = round(average_rating(movie), 2)
+        movies[movie['_id']] = movie
+    
+    return BSONResponse({
+        "results": [
+            {"movie_id": movie_id, "found": True, "movie": movies[oid]} if oid in movies
+            else {"movie_id": movie_id, "found": False}
+            for movie_id, oid in zip(body.ids, object_ids)
+        ]
+    })
+
+
+# Review summaries of several movies in one request
+@app.post("/movies/reviews/summary:batch")
+async def get_review_summaries_batch(body: MovieIds):
+    """
+    Rating aggregates and newest review of up to MAX_BATCH_IDS movies, in
+    the order asked for
+    Why two queries for any number of movies? The aggregates are read from
+    the movie documents with one $in query, the newest reviews come from one
+    $group over the (movie_id, timestamp) index
+    """
+    object_ids = batch_object_ids(body.ids)
+    wanted = [oid for oid in object_ids if oid]
+    movies = {}
+    cursor = db.movies.find(
+        {"_id": {"$in": wanted}},
+        {"title": 1, "review_count": 1, "rating_sum": 1, "rating_histogram": 1}
+    )
+    async for movie in cursor:
+        movies[movie['_id']] = movie
+    
+    # Newest review of each movie
+    # Why $sort before $group? $first then takes each movie's newest review
+    # straight from the index order
+    latest = {}
+    if movies:
+        cursor = db.reviews.aggregate([
+            {"$match": {"movie_id": {"$in": list(movies)}}},
+            {"$sort": {"movie_id": 1, "timestamp": -1}},
+            {"$group": {
+                "_id": "$movie_id",
+                "user_id": {"$first": "$user_id"},
+                "rating": {"$first": "$rating"},
+                "review_text": {"$first": "$review_text"},
+                "posted_on": {"$first": "$timestamp"}
+            }},
+            {"$lookup": {
+                "from": "users",
+                "localField": "user_id",
+                "foreignField": "_id",
+                "as": "user_details"
+            }},
+            {"$project": {
+                "user_name": {"$arrayElemAt": ["$user_details.name", 0]},
+                "rating": 1,
+                "review_text": 1,
+                "posted_on": 1
+            }}
+        ])
+        async for review in cursor:
+            latest[review.pop('_id')] = review
+    
+    results = []
+    for movie_id, oid in zip(body.ids, object_ids):
+        movie = movies.get(oid)
+        if movie is None:
+            results.append({"movie_id": movie_id, "found": False})
+            continue
+        results.append({
+            "movie_id": movie_id,
+            "found": True,
+            "movie_title": movie['title'],
+            "average_rating": round(average_rating(movie), 2),
+            "total_reviews": movie.get('review_count', 0),
+            "rating_histogram": movie.get('rating_histogram', {}),
+            "latest_review": latest.get(oid)
+        })
+    return BSONResponse({"results": results})
+
+
+# Typeahead suggestions
+@app.get("/movies/suggest")
+async def suggest_movies(
+    prefix: str = Query(..., min_length=1, max_length=MAX_PREFIX_LENGTH, description="What the user typed so far"),
+    k: int = Query(DEFAULT_SUGGESTIONS, ge=1, le=MAX_SUGGESTIONS, description="Number of suggestions")
+):
+    """
+    Titles, directors and actors starting with `prefix`, most watched first
+    Why not /movies/search? Called on every keystroke: this is a binary
+    search over an in-memory sorted list, no database query (see suggest.py)
+    """
+    return BSONResponse({
+        "prefix": prefix,
+        "suggestions": suggest_index.suggest(prefix, k)
+    })
+
+
+# Add a movie to the catalog
+@app.post("/movies", status_code=201)
+async def add_movie(movie: Movie):
+    """
+    Insert a movie and make it searchable right away
+    Why here? The in-memory search index is updated on writes, not rebuilt
+    """
+    doc = movie.model_dump()
+    # Views always start empty, whatever the client sent
+    doc.update(review_count=0, rating_sum=0, rating_histogram={}, watch_count=0)
+    result = await db.movies.insert_one(doc)
+    # Why check loading? A movie added during a load is replayed onto the new
+    # index; otherwise (mongo backend, failed load) there is nothing to update
+    if search_engine.loaded or search_engine.loading:
+        search_engine.add_movie(doc)
+    if suggest_index.loaded or suggest_index.loading:
+        suggest_index.add_movie(doc)
+    facet_cache.add_movie(doc)
+    known_movies.remember(result.inserted_id, doc['title'])
+    
+    return {"movie_id": str(result.inserted_id)}
+
+
 # Aggregation Query: Top 5 most-watched movies in last month
 @app.get("/movies/top-watched")
-async def get_top_watched_movies():
+async def get_top_watched_movies(
+    days: int = Query(DEFAULT_DAYS, ge=1, le=MAX_DAYS, description="Window length in days"),
+    k: int = Query(DEFAULT_TOP_K, ge=1, le=MAX_TOP_K, description="Number of movies to return")
+):
     """
-    Get top 5 most-watched movies in the last 30 days
+    Get top k most-watched movies in the last `days` days (default: top 5, 30 days)
     Why this query? Show trending/popular movies to users
+    Why buckets? Reads one small counter per movie per day (see trending.py)
+    instead of re-scanning every raw watch event in the window
     """
     
-    # Calculate date 30 days ago
-    thirty_days_ago = datetime.now() - timedelta(days=30)
+    # Serve repeated requests from the cache
+    cache_key = make_key("top_watched", days=days, k=k)
+    cached = await response_cache.get(cache_key)
+    if cached is not None:
+        return BSONResponse(cached)
     
-    # Aggregation pipeline
-    pipeline = [
-        # Step 1: Filter watch history from last 30 days
-        {"$match": {
-            "timestamp": {"$gte": thirty_days_ago}
-        }},
-        
-        # Step 2: Group by movie_id and count watches
-        # Why group? Count how many times each movie was watched
-        {"$group": {
-            "_id": "$movie_id",
-            "watch_count": {"$sum": 1}
-        }},
-        
-        # Step 3: Sort by watch count (descending)
-        {"$sort": {"watch_count": -1}},
-        
-        # Step 4: Limit to top 5
-        {"$limit": 5},
-        
-        # Step 5: Join with movies collection to get movie details
-        {"$lookup": {
-            "from": "movies",
-            "localField": "_id",
-            "foreignField": "_id",
-            "as": "movie_details"
-        }},
-        
-        # Step 6: Unwind movie_details
-        {"$unwind": "$movie_details"},
-        
-        # Step 7: Format output
-        {"$project": {
-            "movie_id": "$_id",
-            "title": "$movie_details.title",
-            "director": "$movie_details.director",
-            "rating": "$movie_details.rating",
-            "genres": "$movie_details.genres",
-            "watch_count": "$watch_count"
-        }}
-    ]
+    # Step 1: Sum daily buckets and pick the top k, in one aggregation
+    top_counts = await top_movie_counts(db.movie_daily_watches, days, k)
     
-    top_movies = list(db.watch_history.aggregate(pipeline))
-    top_movies = convert_objectid(top_movies)
+    # Step 2: Fetch details of only the winning movies
+    movie_ids = [movie_id for movie_id, _ in top_counts]
+    movies = {}
+    cursor = db.movies.find(
+        {"_id": {"$in": movie_ids}},
+        {"title": 1, "director": 1, "rating": 1, "genres": 1}
+    )
+    async for movie in cursor:
+        movies[movie['_id']] = movie
     
-    return {
-        "period": "Last 30 days",
+    # Step 3: Format output, keeping the ranking order
+    top_movies = []
+    for movie_id, watch_count in top_counts:
+        movie = movies.get(movie_id)
+        if not movie:
+            continue  # Movie was deleted, skip it like $unwind did
+        top_movies.append({
+            "_id": movie_id,
+            "movie_id": movie_id,
+            "title": movie['title'],
+            "director": movie.get('director'),
+            "rating": movie.get('rating'),
+            "genres": movie.get('genres'),
+            "watch_count": watch_count
+        })
+    
+    result = {
+        "period": f"Last {days} days",
         "total_movies": len(top_movies),
         "top_movies": top_movies
     }
+    # Any new watch event can change the ranking, so all variants share one tag
+    body = dumps(result)
+    await response_cache.set(cache_key, body, CACHE_TTLS["top_watched"], tags=["top_watched"])
+    return BSONResponse(body)
+
+
+# Personalized recommendations
+@app.get("/users/{user_id}/recommendations")
+async def get_recommendations(
+    user_id: str = Path(..., pattern=OBJECT_ID_PATTERN),
+    k: int = Query(DEFAULT_RECOMMENDATIONS, ge=1, le=MAX_RECOMMENDATIONS, description="Number of movies to return")
+):
+    """
+    Recommend movies watched by people who watched what this user watched
+    Why precomputed? Scoring is a sparse dot product over the memory-mapped
+    co-watch matrix (see recommendations.py), no aggregation per request
+    """
+    
+    user_oid = ObjectId(user_id)
+    if not await known_users.exists(db, user_oid):
+        raise HTTPException(status_code=404, detail="User not found")
+    
+    # Step 1: The user's most recent watches (newest first)
+    cursor = db.watch_history.find(
+        {"user_id": user_oid},
+        {"_id": 0, "movie_id": 1}
+    ).sort("timestamp", -1).limit(RECENT_HISTORY)
+    recent = [event['movie_id'] async for event in cursor]
+    
+    # Step 2: Score neighbors of those movies
+    # Why trending as fallback? New users (or no model yet) still get something
+    with phase("scoring"):
+        ranked = recommender.recommend(recent, k)
+    source = "co_watch"
+    if not ranked:
+        source = "trending"
+        watched = set(recent)
+        top_counts = await top_movie_counts(db.movie_daily_watches, DEFAULT_DAYS, k + len(watched))
+        ranked = [(movie_id, count) for movie_id, count in top_counts if movie_id not in watched][:k]
+    
+    # Step 3: Fetch details of only the recommended movies
+    movies = {}
+    cursor = db.movies.find(
+        {"_id": {"$in": [movie_id for movie_id, _ in ranked]}},
+        {"title": 1, "director": 1, "rating": 1, "genres": 1}
+    )
+    async for movie in cursor:
+        movies[movie['_id']] = movie
+    
+    recommendations = []
+    for movie_id, score in ranked:
+        movie = movies.get(movie_id)
+        if not movie:
+            continue  # Deleted since the model was built
+        movie['score'] = score
+        recommendations.append(movie)
+    
+    return BSONResponse({
+        "user_id": user_id,
+        "source": source,
+        "recommendations": recommendations
+    })
+
+
+# Recommendation model info
+@app.get("/recommendations/stats")
+async def get_recommendation_stats():
+    """When the co-watch model was built and how big it is"""
+    return recommender.stats()
+
+
+# Bulk ingestion of watch events
+@app.post("/events/watch", status_code=202)
+async def ingest_watch_events(request: Request):
+    """
+    Accept a batch of watch events as NDJSON (one WatchHistory object per line)
+    Why 202? Events are staged (one insert for the whole request, so they
+    survive a crash) and written to watch_history in batches shortly after
+    """
+    
+    body = await request.body()
+    lines = [line for line in body.splitlines() if line.strip()]
+    if not lines:
+        raise HTTPException(status_code=400, detail="Body must contain at least one NDJSON line")
+    if len(lines) > INGEST_MAX_LINES:
+        raise HTTPException(status_code=413, detail=f"At most {INGEST_MAX_LINES} events per request")
+    
+    # Validate every line first: the batch is queued all or nothing
+    events = []
+    errors = []
+    for line_number, line in enumerate(lines, start=1):
+        try:
+            events.append(WatchHistory.model_validate_json(line).model_dump())
+        except ValidationError as e:
+            errors.append({"line": line_number, "errors": e.errors(include_url=False, include_context=False)})
+    if errors:
+        raise HTTPException(status_code=422, detail=errors[:20])
+    
+    try:
+        queued = await watch_buffer.enqueue(events)
+    except (QueueFullError, StagingError) as e:
+        # Why 503 + Retry-After? Tells players to back off and resend
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    
+    return {"received": len(events), "queued": queued}
+
+
+# Ingestion statistics
+@app.get("/events/stats")
+async def get_ingest_stats():
+    """Queue depth and accepted/written/dropped counters of the ingest buffer"""
+    return watch_buffer.stats()
+
+
+# View worker statistics
+@app.get("/views/stats")
+async def get_view_stats():
+    """
+    Source (change stream or polling) and counters of the view worker
+    Why? Shows whether trending, popularity and ratings are keeping up
+    """
+    return view_maintainer.stats()
+
+
+# Prometheus metrics
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    """
+    Request latency, per-phase time and round-trip histograms (Prometheus format)
+    Why? Lets us alert on slow endpoints and spot queries doing too many trips
+    """
+    return render_metrics()
+
+
+# Index status
+@app.get("/indexes/stats")
+async def get_index_stats():
+    """
+    Index builds in progress, redundant indexes and queries no index covers
+    Why? Shows if a slow endpoint is waiting for an index build
+    """
+    return index_reconciler.stats()
+
+
+# Readiness for load balancers and rolling restarts
+@app.get("/ready")
+async def get_readiness():
+    """
+    200 once MongoDB answers and every in-memory index is loaded, 503 before
+    Why not just "the process is up"? A worker still warming up serves
+    search and existence checks from MongoDB, much slower (see startup.py)
+    """
+    ready, details = await warmup.check(db)
+    return BSONResponse({"ready": ready, **details}, status_code=200 if ready else 503)
+
+
+# Existence check statistics
+@app.get("/existence/stats")
+async def get_existence_stats():
+    """
+    Bloom filter and name cache of user and movie ids
+    Why? database_lookups should stay low next to name_hits + filter_negatives
+    """
+    return {"users": known_users.stats(), "movies": known_movies.stats()}
+
+
+# Cache statistics
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """
+    Hit/miss/eviction counters of the response cache
+    Why? Tells us if CACHE_MAX_ENTRIES and the TTLs are sized well
+    """
+    return await response_cache.stats()
 
 
 # Root endpoint
@@ -292,8 +942,23 @@ async def root():
         "message": "Movie Streaming Backend API",
         "endpoints": [
             "/users/{user_id}/history - Get user watch history",
-            "/movies/{movie_id}/reviews - Get movie reviews",
-            "/movies/search?query=... - Search movies",
-            "/movies/top-watched - Top 5 watched movies (last month)"
+            "/movies/{movie_id}/reviews - Get movie reviews (POST to add one)",
+            "/movies/search?query=...&limit=20&offset=0&w_similarity=0.5&w_rating=0.3&w_popularity=0.2 - Search movies",
+            "/movies/suggest?prefix=...&k=10 - Typeahead suggestions",
+            "/movies - POST a new movie",
+            "/movies/browse?genre=Drama&year_from=1990&year_to=1999&min_rating=4&sort=rating - Browse with facet counts",
+            "/movies/batch - POST {ids: [...]} to get several movies",
+            "/movies/reviews/summary:batch - POST {ids: [...]} for several review summaries",
+            "/movies/top-watched?days=30&k=5 - Top watched movies (default: top 5, last month)",
+            "/users/{user_id}/recommendations?k=10 - Personalized recommendations",
+            "/recommendations/stats - Recommendation model info",
+            "/events/watch - POST a batch of watch events (NDJSON)",
+            "/events/stats - Ingest queue counters",
+            "/views/stats - View worker counters",
+            "/indexes/stats - Index builds and uncovered queries",
+            "/ready - 200 once warmed up, 503 before",
+            "/existence/stats - Id existence check statistics",
+            "/cache/stats - Response cache counters",
+            "/metrics - Prometheus metrics"
         ]
     }
\ No newline at end of file
@@ -0,0 +1,296 @@
+"""
+Hot/archive split of watch_history
+
+watch_history only keeps the last WATCH_HOT_MONTHS months ("hot" window),
+so its indexes stay the size of that window instead of growing forever.
+Older months are moved to watch_history_archive, one compressed document
+per user and month:
+
+    {user_id, month, count, events: Binary}
+
+`events` holds the month's events column by column (ids, movie ids,
+timestamps, durations), newest first, compressed with zlib. A user's whole
+month is one small read, and the archive only needs a (user_id, month)
+index.
+
+The history endpoint reads the archive only when asked
+(include_archive=true). Derived views (trending buckets, watch counts) are
+not touched by archiving; `python views.py --rebuild` counts archived events
+too.
+
+Why not a time-series collection? They have no change streams (the view
+worker tails watch_history) and no secondary index on _id order.
+
+Usage:
+    python archive.py --archive [--hot-months 6]
+"""
+import argparse
+import asyncio
+import os
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+from bson import Binary, ObjectId
+from starlette.concurrency import run_in_threadpool
+
+WATCH_HOT_MONTHS = int(os.environ.get('WATCH_HOT_MONTHS', 6))
+# Archive old months inside the API every N minutes (0 = only via the CLI)
+WATCH_ARCHIVE_INTERVAL_MINUTES = float(os.environ.get('WATCH_ARCHIVE_INTERVAL_MINUTES', 0))
+
+ARCHIVE = "watch_history_archive"
+# Hot events moved per round (read, compress, insert, delete)
+ARCHIVE_CHUNK = 100_000
+# Format of the `events` blob, bumped if the layout changes
+FORMAT_VERSION = 1
+
+# Timestamps are stored as milliseconds since the epoch
+# Why milliseconds? BSON dates have millisecond precision
+EPOCH = datetime(1970, 1, 1)
+MILLISECOND = timedelta(milliseconds=1)
+
+
+# ----- Months -----
+
+def month_of(timestamp):
+    """First instant of the timestamp's month"""
+    return datetime(timestamp.year, timestamp.month, 1)
+
+
+def add_months(month, count):
+    """`month` moved by `count` months (negative = back)"""
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def hot_cutoff(now=None, hot_months=WATCH_HOT_MONTHS):
+    """Events before this instant belong in the archive"""
+    return add_months(month_of(now or datetime.now()), -(hot_months - 1))
+
+
+# ----- Compression -----
+
+def position(event):
+    """(timestamp, _id) of an event, the order of history pages"""
+    return event['timestamp'], event['_id']
+
+
+def pack_events(events):
+    """Compress one user's events of one month (sorted newest first)"""
+    events = sorted(events, key=position, reverse=True)
+    timestamps = np.array([(event['timestamp'] - EPOCH) // MILLISECOND for event in events], dtype=np.int64)
+    # Why deltas? Small, similar numbers compress much better than timestamps
+    deltas = np.diff(timestamps, prepend=0)
+    columns = [
+        np.array([FORMAT_VERSION, len(events)], dtype=np.int64).tobytes(),
+        b"".join(event['_id'].binary for event in events),
+        b"".join(event['movie_id'].binary for event in events),
+        deltas.tobytes(),
+        np.array([event.get('watch_duration', 0) for event in events], dtype=np.int32).tobytes()
+    ]
+    return Binary(zlib.compress(b"".join(columns)))
+
+
+def unpack_events(blob, user_id):
+    """Events of a compressed archive document, newest first"""
+    raw = zlib.decompress(blob)
+    version, count = np.frombuffer(raw, dtype=np.int64, count=2)
+    if version != FORMAT_VERSION:
+        raise ValueError(f"Unknown archive format {version}")
+    offset = 16
+    ids = raw[offset:offset + 12 * count]
+    offset += 12 * count
+    movie_ids = raw[offset:offset + 12 * count]
+    offset += 12 * count
+    timestamps = np.cumsum(np.frombuffer(raw, dtype=np.int64, count=count, offset=offset))
+    offset += 8 * count
+    durations = np.frombuffer(raw, dtype=np.int32, count=count, offset=offset)
+
+    return [
+        {
+            "_id": ObjectId(ids[12 * i:12 * i + 12]),
+            "user_id": user_id,
+            "movie_id": ObjectId(movie_ids[12 * i:12 * i + 12]),
+            "timestamp": EPOCH + int(timestamps[i]) * MILLISECOND,
+            "watch_duration": int(durations[i])
+        }
+        for i in range(count)
+    ]
+
+
+def archive_document(user_id, month, events):
+    return {
+        "user_id": user_id,
+        "month": month,
+        "count": len(events),
+        "events": pack_events(events)
+    }
+
+
+# ----- Archiving (blocking client) -----
+
+def archive_month(db, month):
+    """
+    Move one month of hot events into the archive, return how many moved
+    Why is a rerun safe? Events whose archive document was written before a
+    crash are found and removed from watch_history first
+    """
+    window = {"timestamp": {"$gte": month, "$lt": add_months(month, 1)}}
+    if not db.watch_history.find_one(window, {"_id": 1}):
+        return 0
+
+    # Finish a run that stopped between writing the archive and deleting
+    for document in db[ARCHIVE].find({"month": month}):
+        archived_ids = [event['_id'] for event in unpack_events(document['events'], document['user_id'])]
+        db.watch_history.delete_many({"_id": {"$in": archived_ids}})
+
+    moved = 0
+    while True:
+        events = list(db.watch_history.find(window).limit(ARCHIVE_CHUNK))
+        if not events:
+            return moved
+        by_user = {}
+        for event in events:
+            by_user.setdefault(event['user_id'], []).append(event)
+        # A user can get several documents for one month (one per round,
+        # or late events); readers merge them
+        db[ARCHIVE].insert_many(
+            [archive_document(user_id, month, user_events) for user_id, user_events in by_user.items()],
+            ordered=False
+        )
+        db.watch_history.delete_many({"_id": {"$in": [event['_id'] for event in events]}})
+        moved += len(events)
+
+
+def archive_old_months(db, hot_months=WATCH_HOT_MONTHS, now=None):
+    """Archive every month older than the hot window, return {month: events moved}"""
+    cutoff = hot_cutoff(now, hot_months)
+    oldest = db.watch_history.find_one(
+        {"timestamp": {"$lt": cutoff}}, {"timestamp": 1}, sort=[("timestamp", 1)]
+    )
+    moved = {}
+    if oldest is None:
+        return moved
+    month = month_of(oldest['timestamp'])
+    while month < cutoff:
+        moved[month] = archive_month(db, month)
+        month = add_months(month, 1)
+    return moved
+
+
+def iter_archived_events(db, batch_size=ARCHIVE_CHUNK):
+    """Every archived event, in batches (for rebuilding views)"""
+    batch = []
+    for document in db[ARCHIVE].find({}, {"user_id": 1, "events": 1}):
+        batch.extend(unpack_events(document['events'], document['user_id']))
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+# ----- Reading (API) -----
+
+async def archived_months(db, user_id, after=None, newer_than=None):
+    """
+    A user's archived events month by month, newest first, that come after
+    the `after` (timestamp, _id) position and before the `newer_than` one
+    """
+    months = {}
+    if after:
+        months["$lte"] = month_of(after[0])
+    if newer_than:
+        months["$gte"] = month_of(newer_than[0])
+    query = {"user_id": user_id}
+    if months:
+        query["month"] = months
+
+    def keep(event):
+        return (not after or position(event) < after) and (not newer_than or position(event) > newer_than)
+
+    events = []
+    current_month = None
+    cursor = db[ARCHIVE].find(query, {"month": 1, "events": 1}).sort("month", -1)
+    async for document in cursor:
+        # Documents of one month aren't ordered, so a month is sorted once complete
+        if document['month'] != current_month and events:
+            yield sorted(events, key=position, reverse=True)
+            events = []
+        current_month = document['month']
+        events.extend(event for event in unpack_events(document['events'], user_id) if keep(event))
+    if events:
+        yield sorted(events, key=position, reverse=True)
+
+
+async def archived_history(db, user_id, after=None, newer_than=None, limit=None):
+    """Up to `limit` archived events (see archived_months), newest first"""
+    events = []
+    months = archived_months(db, user_id, after, newer_than)
+    async for month_events in months:
+        events.extend(month_events)
+        if limit and len(events) >= limit:
+            await months.aclose()
+            break
+    return events[:limit] if limit else events
+
+
+async def archived_count(db, user_id):
+    """Number of archived events of one user"""
+    cursor = db[ARCHIVE].aggregate([
+        {"$match": {"user_id": user_id}},
+        {"$group": {"_id": None, "count": {"$sum": "$count"}}}
+    ])
+    async for row in cursor:
+        return row['count']
+    return 0
+
+
+class WatchArchiver:
+    """Moves old months to the archive every WATCH_ARCHIVE_INTERVAL_MINUTES"""
+
+    def __init__(self):
+        self.task = None
+
+    def start(self, sync_db):
+        if WATCH_ARCHIVE_INTERVAL_MINUTES > 0:
+            self.task = asyncio.create_task(self._archive_periodically(sync_db))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _archive_periodically(self, sync_db):
+        while True:
+            try:
+                # Why threadpool? Archiving uses the blocking client
+                moved = await run_in_threadpool(archive_old_months, sync_db)
+                if any(moved.values()):
+                    print(f"Archived {sum(moved.values()):,} watch events")
+            except Exception as e:
+                print(f"Archiving watch history failed: {e}")
+            await asyncio.sleep(WATCH_ARCHIVE_INTERVAL_MINUTES * 60)
+
+
+# Shared archiver used by the API
+watch_archiver = WatchArchiver()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move old watch history to the compressed archive")
+    parser.add_argument("--archive", action="store_true", help="Archive months older than the hot window")
+    parser.add_argument("--hot-months", type=int, default=WATCH_HOT_MONTHS)
+    args = parser.parse_args()
+
+    if args.archive:
+        from database import create_indexes, get_db
+
+        create_indexes()
+        moved = archive_old_months(get_db(), args.hot_months)
+        for month, count in moved.items():
+            if count:
+                print(f"{month:%Y-%m}: {count:,} events archived")
+        print(f"Archived {sum(moved.values()):,} events")
+    else:
+        parser.print_help()
@@ -0,0 +1,448 @@
+"""
+Endpoint benchmark suite with regression thresholds
+
+Runs the FastAPI app in-process (no uvicorn, no network) and measures
+throughput and p50/p95/p99 latency of every read endpoint at several dataset
+sizes. Results are written to JSON and compared against a stored baseline.
+The run fails (exit code 1) when any metric regresses by more than
+--threshold.
+
+Startup is measured too: how long the app's lifespan takes before it
+accepts requests (must stay under --startup-target-ms) and how long until
+/ready answers 200 (compared with the baseline like the endpoints).
+
+Backends:
+    --backend mongo   a real MongoDB at MONGO_URI (database: movie_streaming_bench)
+    --backend mock    mongomock in memory: hermetic, no server needed, but no
+                      $text support, so search uses the in-memory engine
+                      (SEARCH_BACKEND=memory)
+
+Usage:
+    python benchmark.py --backend mock                      # compare with baseline
+    python benchmark.py --backend mock --update-baseline    # store a new baseline
+    python benchmark.py --backend mongo --sizes small medium large --threshold 0.1
+
+Why in-process? Takes the HTTP server and network out of the numbers, so a
+change in the handlers shows up clearly
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import random
+import sys
+import time
+from collections import Counter, defaultdict
+from datetime import datetime
+
+# Keep benchmark data away from the real database
+os.environ.setdefault('MONGO_DB_NAME', 'movie_streaming_bench')
+os.environ.setdefault('RECOMMENDATIONS_PATH', 'recommendations_model_bench')
+
+DEFAULT_BASELINE = "benchmark_baseline.json"
+
+# Dataset presets: documents per collection
+SIZES = {
+    "small": {"movies": 200, "users": 500, "events": 5000, "reviews": 500},
+    "medium": {"movies": 2000, "users": 5000, "events": 50000, "reviews": 5000},
+    "large": {"movies": 100000, "users": 1000000, "events": 10000000, "reviews": 500000}
+}
+
+ENDPOINTS = ["history", "reviews", "search", "top_watched", "recommendations"]
+
+# Metrics compared with the baseline: (name, True if higher is worse)
+METRICS = [("p50_ms", True), ("p95_ms", True), ("p99_ms", True), ("throughput_rps", False)]
+# Requests both runs need before a tail percentile is compared
+# Why? A percentile resting on a handful of samples moves run to run with no
+# code change: at 200 requests p99 is about the 2 slowest ones
+MIN_REQUESTS = {"p95_ms": 100, "p99_ms": 1000}
+# Run details that must match the baseline's for numbers to be comparable
+BASELINE_MUST_MATCH = ("backend", "machine")
+
+# Longest acceptable lifespan startup, before the app accepts requests
+# Why a fixed target? Rolling restarts wait this long per worker, whatever
+# the dataset size; loading happens after it (see startup.py)
+STARTUP_TARGET_MS = 500
+# Give up waiting for /ready after this long
+READY_TIMEOUT_SECONDS = 300
+# ready_ms changes smaller than this are not regressions
+# Why? A small dataset warms up in ~100 ms, which background task scheduling
+# alone moves by more than the threshold
+READY_NOISE_MS = 500
+
+
+def use_mock_backend():
+    """
+    Swap the MongoDB drivers for mongomock before the app is imported
+    Why one shared client? The sync client (seeding, create_indexes) and the
+    async client (handlers) must see the same in-memory data
+    """
+    from unittest import mock
+
+    import mongomock
+    from mongomock_motor import AsyncMongoMockClient
+
+    # mongomock has no change streams and no $text
+    os.environ.setdefault('VIEWS_SOURCE', 'polling')
+    os.environ.setdefault('ID_FILTER_FOLLOW', 'off')
+    os.environ.setdefault('SEARCH_BACKEND', 'memory')
+    shared = mongomock.MongoClient()
+    mock.patch("pymongo.MongoClient", lambda *args, **kwargs: shared).start()
+    mock.patch("motor.motor_asyncio.AsyncIOMotorClient",
+               lambda *args, **kwargs: AsyncMongoMockClient(mock_mongo_client=shared)).start()
+
+
+def seed(db, size, seed_value):
+    """
+    Fill the benchmark database with one dataset preset
+    Derived data (daily buckets, watch counts, review aggregates) is computed
+    while generating, so seeding needs no server-side aggregation
+    """
+    import generate_data as gen
+    from ratings import star_bucket
+    from trending import day_of
+
+    counts = SIZES[size]
+    for name in ["movies", "users", "watch_history", "watch_history_archive", "reviews",
+                 "movie_daily_watches", "view_checkpoints"]:
+        db[name].drop()
+
+    gen.init_samplers({
+        "movies": counts["movies"],
+        "users": counts["users"],
+        "zipf": 1.1,
+        "days": 60,
+        "seed": seed_value,
+        "now": datetime.now().replace(microsecond=0).isoformat()
+    })
+    rng = random.Random(f"{seed_value}:{size}")
+    batch_size = 10000
+
+    def insert(collection_name, generate, total, on_batch=None):
+        for start in range(0, total, batch_size):
+            batch = [generate(rng, index) for index in range(start, min(total, start + batch_size))]
+            db[collection_name].insert_many(batch, ordered=False)
+            if on_batch:
+                on_batch(batch)
+
+    insert("users", gen.generate_user, counts["users"])
+
+    buckets = Counter()
+    watch_counts = Counter()
+
+    def add_watch_counts(batch):
+        buckets.update((event['movie_id'], day_of(event['timestamp'])) for event in batch)
+        watch_counts.update(event['movie_id'] for event in batch)
+
+    insert("watch_history", gen.generate_watch, counts["events"], add_watch_counts)
+
+    review_stats = defaultdict(lambda: {"review_count": 0, "rating_sum": 0, "rating_histogram": Counter()})
+
+    def add_review_stats(batch):
+        for review in batch:
+            stats = review_stats[review['movie_id']]
+            stats["review_count"] += 1
+            stats["rating_sum"] += review['rating']
+            stats["rating_histogram"][star_bucket(review['rating'])] += 1
+
+    insert("reviews", gen.generate_review, counts["reviews"], add_review_stats)
+
+    def generate_movie(rng, index):
+        movie = gen.generate_movie(rng, index)
+        movie["watch_count"] = watch_counts[movie['_id']]
+        stats = review_stats.get(movie['_id'])
+        if stats:
+            movie.update(stats, rating_histogram=dict(stats["rating_histogram"]))
+        return movie
+
+    insert("movies", generate_movie, counts["movies"])
+
+    db.movie_daily_watches.insert_many([
+        {"movie_id": movie_id, "day": day, "watch_count": count}
+        for (movie_id, day), count in buckets.items()
+    ])
+
+    # Why a checkpoint? The derived data already counts every seeded event;
+    # a polling view worker would apply them all again while endpoints are
+    # being measured
+    from views import CHECKPOINT_ID, REVIEWS, SEQUENCE_FIELD, WATCHES
+    for name in (WATCHES, REVIEWS):
+        db[name].update_many({}, {"$set": {SEQUENCE_FIELD: 0}})
+    db.view_checkpoints.insert_one({"_id": CHECKPOINT_ID, "sequence": 0})
+
+
+def request_paths(size, count, seed_value):
+    """Random but reproducible request paths for each endpoint"""
+    import generate_data as gen
+
+    counts = SIZES[size]
+    rng = random.Random(f"{seed_value}:{size}:paths")
+    users = [gen.make_id(gen.USER_KIND, rng.randrange(counts["users"])) for _ in range(count)]
+    movies = [gen.make_id(gen.MOVIE_KIND, rng.randrange(counts["movies"])) for _ in range(count)]
+    return {
+        "history": [f"/users/{user_id}/history" for user_id in users],
+        "recommendations": [f"/users/{user_id}/recommendations" for user_id in users],
+        "reviews": [f"/movies/{movie_id}/reviews" for movie_id in movies],
+        "search": [f"/movies/search?query={rng.choice(gen.TITLE_WORDS)}" for _ in range(count)],
+        "top_watched": [
+            f"/movies/top-watched?days={rng.choice([1, 7, 30])}&k={rng.choice([5, 20])}"
+            for _ in range(count)
+        ]
+    }
+
+
+async def measure(client, paths, concurrency):
+    """Send every path with `concurrency` requests in flight, return stats"""
+    from load_test import percentile
+
+    latencies = []
+    errors = 0
+    queue = list(reversed(paths))
+
+    async def worker():
+        nonlocal errors
+        while queue:
+            path = queue.pop()
+            start = time.perf_counter()
+            response = await client.get(path)
+            latencies.append((time.perf_counter() - start) * 1000)
+            if response.status_code >= 400:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    result = {
+        "requests": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3)
+    }
+    # An endpoint that only errors isn't measuring anything useful
+    if errors == len(latencies):
+        result["failed"] = True
+    return result
+
+
+async def run_all(args):
+    """Benchmark every requested size in one event loop (the async client is tied to it)"""
+    results = {}
+    startup = {}
+    for size in args.sizes:
+        results[size], startup[size] = await run_size(size, args)
+    return results, startup
+
+
+async def wait_until_ready(client):
+    """Poll /ready until it answers 200"""
+    deadline = time.perf_counter() + READY_TIMEOUT_SECONDS
+    while time.perf_counter() < deadline:
+        if (await client.get("/ready")).status_code == 200:
+            return
+        await asyncio.sleep(0.01)
+    raise TimeoutError(f"/ready didn't answer 200 within {READY_TIMEOUT_SECONDS}s")
+
+
+async def run_size(size, args):
+    """Seed one dataset size and benchmark every endpoint against it"""
+    import httpx
+
+    import app
+    from cache import response_cache
+    from database import create_indexes, get_db
+    from recommendations import build_model, recommender, save_model
+
+    print(f"Seeding '{size}' dataset: {SIZES[size]}")
+    seed(get_db(), size, args.seed)
+    # Why build indexes now? Seeding dropped them, and the app would build
+    # them in the background while the first endpoint is measured
+    create_indexes()
+    # The API maps the model at startup, so build it for this dataset first
+    save_model(build_model(get_db()), recommender.path)
+
+    # Why no cache by default? Measure the query path, not dictionary lookups
+    if not args.cache:
+        response_cache.max_entries = 0
+    await response_cache.clear()
+
+    paths = request_paths(size, args.requests, args.seed)
+    transport = httpx.ASGITransport(app=app.app, raise_app_exceptions=False)
+    results = {}
+
+    # Runs the app's startup and shutdown (ASGITransport doesn't)
+    start = time.perf_counter()
+    async with app.app.router.lifespan_context(app.app):
+        startup_ms = (time.perf_counter() - start) * 1000
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            # Why wait? Until then search and id checks fall back to MongoDB
+            await wait_until_ready(client)
+            startup = {"startup_ms": round(startup_ms, 3),
+                       "ready_ms": round((time.perf_counter() - start) * 1000, 3)}
+            print(f"  {size:<7} startup {startup['startup_ms']:>8.2f} ms  ready {startup['ready_ms']:>8.2f} ms")
+            for endpoint in args.endpoints:
+                # A few warm-up requests so first-call costs don't skew p99
+                await measure(client, paths[endpoint][:args.concurrency], args.concurrency)
+                results[endpoint] = await measure(client, paths[endpoint], args.concurrency)
+                print_row(size, endpoint, results[endpoint])
+    return results, startup
+
+
+def print_row(size, endpoint, result):
+    status = " FAILED" if result.get("failed") else ""
+    print(f"  {size:<7} {endpoint:<12} {result['throughput_rps']:>10.1f} req/s "
+          f"p50 {result['p50_ms']:>8.2f} ms  p95 {result['p95_ms']:>8.2f} ms  "
+          f"p99 {result['p99_ms']:>8.2f} ms  errors {result['errors']}{status}")
+
+
+def compare(current, baseline, threshold):
+    """Return a list of human-readable regressions beyond the threshold"""
+    regressions = []
+    for size, endpoints in current["results"].items():
+        for endpoint, result in endpoints.items():
+            base = baseline["results"].get(size, {}).get(endpoint)
+            # Missing or failed baselines are reported by missing_from_baseline
+            if not base or base.get("failed"):
+                continue
+            if result.get("failed"):
+                regressions.append(f"{size}/{endpoint}: every request failed")
+                continue
+            if result["errors"] > base["errors"]:
+                regressions.append(f"{size}/{endpoint} errors: {base['errors']} -> {result['errors']}")
+            for metric, higher_is_worse in METRICS:
+                if not base[metric] or min(result["requests"], base["requests"]) < MIN_REQUESTS.get(metric, 0):
+                    continue
+                change = (result[metric] - base[metric]) / base[metric]
+                if (higher_is_worse and change > threshold) or (not higher_is_worse and change < -threshold):
+                    regressions.append(
+                        f"{size}/{endpoint} {metric}: {base[metric]} -> {result[metric]} ({change:+.0%})"
+                    )
+    for size, startup in current.get("startup", {}).items():
+        base = baseline.get("startup", {}).get(size)
+        if not base or not base["ready_ms"]:
+            continue
+        slower_ms = startup["ready_ms"] - base["ready_ms"]
+        if slower_ms > READY_NOISE_MS and slower_ms / base["ready_ms"] > threshold:
+            regressions.append(f"{size}/startup ready_ms: {base['ready_ms']} -> {startup['ready_ms']}")
+    return regressions
+
+
+def missing_from_baseline(current, baseline):
+    """
+    What this run measured that the baseline can't be compared with
+    Why fail on these? Skipping them would pass a run whose new endpoints or
+    startup were never checked; the fix is --update-baseline
+    """
+    missing = []
+    for size, endpoints in current["results"].items():
+        for endpoint in endpoints:
+            base = baseline["results"].get(size, {}).get(endpoint)
+            if not base:
+                missing.append(f"{size}/{endpoint}: not in the baseline")
+            elif base.get("failed"):
+                missing.append(f"{size}/{endpoint}: failed in the baseline")
+    for size in current.get("startup", {}):
+        if size not in baseline.get("startup", {}):
+            missing.append(f"{size}/startup: not in the baseline")
+    return missing
+
+
+def startup_failures(current, target_ms):
+    """Sizes whose lifespan startup took longer than the target"""
+    return [
+        f"{size}/startup startup_ms: {startup['startup_ms']} > target {target_ms}"
+        for size, startup in current["startup"].items()
+        if startup["startup_ms"] > target_ms
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API endpoints and check for regressions")
+    parser.add_argument("--backend", choices=["mongo", "mock"], default="mongo")
+    parser.add_argument("--sizes", nargs="+", choices=list(SIZES),
+                        help="Default: small medium (mongo), small (mock, which scans collections)")
+    parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=ENDPOINTS)
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and size")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--cache", action="store_true", help="Keep the response cache enabled")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25,
+                        help="Allowed relative regression, e.g. 0.25 = 25%%")
+    parser.add_argument("--update-baseline", action="store_true", help="Save this run as the new baseline")
+    parser.add_argument("--startup-target-ms", type=float, default=STARTUP_TARGET_MS,
+                        help="Fail when the app takes longer to start accepting requests")
+    args = parser.parse_args()
+
+    if args.sizes is None:
+        args.sizes = ["small"] if args.backend == "mock" else ["small", "medium"]
+    if args.backend == "mock":
+        use_mock_backend()
+
+    current = {
+        "backend": args.backend,
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": platform.platform(),
+        "python": platform.python_version(),
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "cache": args.cache,
+        "results": {}
+    }
+    current["results"], current["startup"] = asyncio.run(run_all(args))
+
+    with open(args.output, "w") as f:
+        json.dump(current, f, indent=2)
+    print(f"Results written to {args.output}")
+
+    # Checked against a fixed target, so with or without a baseline
+    failures = startup_failures(current, args.startup_target_ms)
+    for failure in failures:
+        print(f"Startup too slow: {failure}")
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"Baseline updated: {args.baseline}")
+        sys.exit(1 if failures else 0)
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --update-baseline to create one")
+        sys.exit(1 if failures else 0)
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    mismatched = [field for field in BASELINE_MUST_MATCH if baseline.get(field) != current[field]]
+    if mismatched:
+        for field in mismatched:
+            print(f"Baseline {field} is '{baseline.get(field)}', this run's is '{current[field]}'")
+        print("Not comparable with the baseline, run with --update-baseline here to create one")
+        sys.exit(1)
+    if baseline.get("requests") != current["requests"]:
+        print(f"Warning: baseline sent {baseline.get('requests')} requests per endpoint, this run "
+              f"{current['requests']}; the mix of requests differs")
+
+    missing = missing_from_baseline(current, baseline)
+    if missing:
+        print("Not comparable with the baseline (run with --update-baseline):")
+        for entry in missing:
+            print(f"  {entry}")
+
+    regressions = compare(current, baseline, args.threshold)
+    if regressions:
+        print(f"Regressions beyond {args.threshold:.0%}:")
+        for regression in regressions:
+            print(f"  {regression}")
+        sys.exit(1)
+    if missing:
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold:.0%}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
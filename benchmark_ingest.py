@@ -0,0 +1,99 @@
+"""
+Benchmark for POST /events/watch
+
+Several simulated players send NDJSON batches of watch events to a running
+server for a fixed time. Reports how many events per second were accepted
+by the API and how many the background writer actually stored.
+
+Usage:
+    uvicorn app:app            # in another terminal
+    python benchmark_ingest.py [--url http://localhost:8000] [--seconds 30]
+
+Why both rates? The API can accept faster than MongoDB writes for a while;
+only the written rate is sustainable
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from datetime import datetime, timedelta
+
+import httpx
+
+from database import get_db
+
+
+def load_ids():
+    """Use real ids so the events join with movies and users"""
+    db = get_db()
+    user_ids = [str(u['_id']) for u in db.users.find({}, {"_id": 1}).limit(1000)]
+    movie_ids = [str(m['_id']) for m in db.movies.find({}, {"_id": 1}).limit(1000)]
+    if not user_ids or not movie_ids:
+        raise SystemExit("No users/movies found, run sample_data.py first")
+    return user_ids, movie_ids
+
+
+def make_batch(user_ids, movie_ids, size):
+    """One NDJSON body of random watch events"""
+    lines = []
+    for _ in range(size):
+        lines.append(json.dumps({
+            "user_id": random.choice(user_ids),
+            "movie_id": random.choice(movie_ids),
+            "timestamp": (datetime.now() - timedelta(minutes=random.randint(0, 600))).isoformat(),
+            "watch_duration": random.randint(1, 180)
+        }))
+    return "\n".join(lines)
+
+
+async def player(client, bodies, stop_at, totals):
+    """Send batches until time runs out; back off when the server says 503"""
+    while time.perf_counter() < stop_at:
+        response = await client.post("/events/watch", content=random.choice(bodies),
+                                     headers={"Content-Type": "application/x-ndjson"})
+        if response.status_code == 202:
+            totals["accepted"] += response.json()["queued"]
+        elif response.status_code == 503:
+            totals["backpressure"] += 1
+            await asyncio.sleep(float(response.headers.get("Retry-After", 1)))
+        else:
+            totals["errors"] += 1
+
+
+async def main(args):
+    user_ids, movie_ids = load_ids()
+    # Why pre-build bodies? Measure the server, not JSON encoding here
+    bodies = [make_batch(user_ids, movie_ids, args.batch_size) for _ in range(20)]
+    totals = {"accepted": 0, "backpressure": 0, "errors": 0}
+
+    async with httpx.AsyncClient(base_url=args.url, timeout=30) as client:
+        before = (await client.get("/events/stats")).json()
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            player(client, bodies, start + args.seconds, totals)
+            for _ in range(args.clients)
+        ])
+        elapsed = time.perf_counter() - start
+
+        # Give the writer a moment to drain, then read how much it stored
+        await asyncio.sleep(1)
+        after = (await client.get("/events/stats")).json()
+
+    written = after["written"] - before["written"]
+    dropped = after["dropped"] - before["dropped"]
+    print(f"clients={args.clients} batch_size={args.batch_size} seconds={elapsed:.1f}")
+    print(f"accepted: {totals['accepted']:>10} events  ({totals['accepted'] / elapsed:,.0f} events/s)")
+    print(f"written:  {written:>10} events  ({written / elapsed:,.0f} events/s)")
+    print(f"dropped:  {dropped:>10} events")
+    print(f"503 backpressure responses: {totals['backpressure']}, other errors: {totals['errors']}")
+    print(f"still queued: {after['queued']}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark watch event ingestion")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--seconds", type=float, default=30)
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--batch-size", type=int, default=500)
+    asyncio.run(main(parser.parse_args()))
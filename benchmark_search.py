@@ -0,0 +1,191 @@
+"""
+Benchmark for /movies/search popularity lookup
+
+Seeds a synthetic catalog of 100k movies into a separate database and
+measures search latency and database round trips for queries that match
+10, 100, 1000 and 10000 movies.
+
+Usage:
+    python benchmark_search.py [--movies 100000] [--events 500000] [--compare-legacy]
+
+The "$group ms" column times counting watches with one aggregation, which
+search used before popularity moved to movies.watch_count (see views.py).
+
+Why a separate database? So the benchmark never touches real sample data
+"""
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import monitoring
+
+# Point the app at the benchmark database before it is imported
+os.environ.setdefault('MONGO_DB_NAME', 'movie_streaming_bench')
+
+HIT_COUNTS = [10, 100, 1000, 10000]
+
+
+class RoundTripCounter(monitoring.CommandListener):
+    """Count commands sent to MongoDB (one command = one round trip)"""
+
+    def __init__(self):
+        self.count = 0
+
+    def started(self, event):
+        self.count += 1
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+# Why register before importing app? Listeners only attach to new clients
+counter = RoundTripCounter()
+monitoring.register(counter)
+
+import app  # noqa: E402
+from cache import response_cache  # noqa: E402
+from database import create_indexes, get_db, get_async_db  # noqa: E402
+from startup import warmup  # noqa: E402
+from views import rebuild_watch_counts  # noqa: E402
+
+
+def seed(db, num_movies, num_events, batch_size=10000):
+    """Fill the benchmark database with synthetic movies and watch events"""
+    db.movies.delete_many({})
+    db.watch_history.delete_many({})
+
+    print(f"Inserting {num_movies} movies...")
+    movie_ids = []
+    batch = []
+    for i in range(num_movies):
+        # Tag words like 'hits100' let a query match exactly that many movies
+        tags = [f"hits{n}" for n in HIT_COUNTS if i < n]
+        batch.append({
+            "title": f"Synthetic Movie {i}",
+            "release_year": random.randint(1950, 2024),
+            "genres": [random.choice(["Action", "Drama", "Comedy", "Sci-Fi"])],
+            "cast": [f"Actor {random.randint(0, 5000)}"] + tags,
+            "director": f"Director {i % 500}",
+            "rating": round(random.uniform(1.0, 5.0), 1)
+        })
+        if len(batch) == batch_size:
+            movie_ids.extend(db.movies.insert_many(batch).inserted_ids)
+            batch = []
+    if batch:
+        movie_ids.extend(db.movies.insert_many(batch).inserted_ids)
+
+    print(f"Inserting {num_events} watch events...")
+    user_ids = [ObjectId() for _ in range(10000)]
+    batch = []
+    for _ in range(num_events):
+        batch.append({
+            "user_id": random.choice(user_ids),
+            "movie_id": random.choice(movie_ids),
+            "timestamp": datetime.now() - timedelta(days=random.randint(0, 60)),
+            "watch_duration": random.randint(30, 180)
+        })
+        if len(batch) == batch_size:
+            db.watch_history.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.watch_history.insert_many(batch, ordered=False)
+
+    create_indexes()
+    # Search reads popularity from movies.watch_count
+    rebuild_watch_counts(db)
+
+
+async def aggregated_watch_counts(db, movie_ids):
+    """Previous behaviour: one $group over watch_history for all candidates"""
+    watch_counts = {movie_id: 0 for movie_id in movie_ids}
+    cursor = db.watch_history.aggregate([
+        {"$match": {"movie_id": {"$in": movie_ids}}},
+        {"$group": {"_id": "$movie_id", "watch_count": {"$sum": 1}}}
+    ])
+    async for row in cursor:
+        watch_counts[row['_id']] = row['watch_count']
+    return watch_counts
+
+
+async def legacy_watch_counts(db, movie_ids):
+    """Oldest behaviour: one count_documents call per movie"""
+    return {
+        movie_id: await db.watch_history.count_documents({"movie_id": movie_id})
+        for movie_id in movie_ids
+    }
+
+
+async def measure(func, repeat):
+    """Await func() `repeat` times, return (median ms, round trips per call)"""
+    timings = []
+    counter.count = 0
+    for _ in range(repeat):
+        start = time.perf_counter()
+        await func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return statistics.median(timings), counter.count / repeat
+
+
+async def run_benchmark(args):
+    """Time search and popularity lookup for each hit count"""
+    # Why the lifespan? The app creates its database client there
+    async with app.app.router.lifespan_context(app.app):
+        # Why wait? Until then the warm-up competes with the measured queries
+        while not warmup.warm:
+            await asyncio.sleep(0.05)
+        await measure_hit_counts(args)
+
+
+async def measure_hit_counts(args):
+    db = get_async_db()
+    # Why no cache? Repeats would time dictionary lookups, not search
+    response_cache.max_entries = 0
+    await response_cache.clear()
+
+    print()
+    print(f"{'hits':>7} {'search ms':>10} {'trips':>6} {'$group ms':>14} {'trips':>6}"
+          + (f" {'legacy ms':>10} {'trips':>6}" if args.compare_legacy else ""))
+
+    for hits in HIT_COUNTS:
+        query = f"hits{hits}"
+        # The tag is in the cast of exactly the matching movies
+        cursor = db.movies.find({"cast": query}, {"_id": 1})
+        movie_ids = [m['_id'] async for m in cursor]
+
+        search_ms, search_trips = await measure(lambda: app.search_movies(
+            query=query, limit=20, offset=0, w_similarity=0.5, w_rating=0.3, w_popularity=0.2
+        ), args.repeat)
+        pop_ms, pop_trips = await measure(lambda: aggregated_watch_counts(db, movie_ids), args.repeat)
+        line = f"{len(movie_ids):>7} {search_ms:>10.1f} {search_trips:>6.0f} {pop_ms:>14.1f} {pop_trips:>6.0f}"
+
+        if args.compare_legacy:
+            legacy_ms, legacy_trips = await measure(lambda: legacy_watch_counts(db, movie_ids), 1)
+            line += f" {legacy_ms:>10.1f} {legacy_trips:>6.0f}"
+        print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark movie search popularity lookup")
+    parser.add_argument("--movies", type=int, default=100000)
+    parser.add_argument("--events", type=int, default=500000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--skip-seed", action="store_true", help="Reuse existing benchmark data")
+    parser.add_argument("--compare-legacy", action="store_true", help="Also time the old per-movie loop")
+    args = parser.parse_args()
+
+    if not args.skip_seed:
+        seed(get_db(), args.movies, args.events)
+
+    asyncio.run(run_benchmark(args))
+
+
+if __name__ == "__main__":
+    main()
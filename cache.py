@@ -0,0 +1,323 @@
+"""
+In-process response cache
+
+Hot read endpoints (search, top-watched, reviews) return the same answer for
+the same inputs many times a minute. We keep recent responses in memory:
+
+- keys are built from the endpoint name + parameters, with free text
+  normalized (cursors and ids are opaque and kept exactly)
+- each entry expires after its endpoint's TTL
+- when full, the least recently used entry is evicted
+- entries carry tags (e.g. "reviews:<movie_id>") so a write can drop exactly
+  the entries it made stale
+
+With several API workers (serve.py), one cache lives in the parent process
+and the workers talk to it over a local socket (CACHE_SERVER_ADDRESS), so
+a response computed by one worker is a hit in all of them and an
+invalidation reaches all of them. Each call to the server waits at most
+CACHE_TIMEOUT_MS, on a thread so the event loop keeps serving other
+requests; a slow or dead server turns into cache misses.
+
+Handlers await the shared `response_cache` the same way in both setups.
+"""
+import asyncio
+import os
+import threading
+import time
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from multiprocessing.managers import BaseManager
+
+CACHE_MAX_ENTRIES = int(os.environ.get('CACHE_MAX_ENTRIES', 1024))
+# Set by serve.py for its workers; empty = cache inside this process
+CACHE_SERVER_ADDRESS = os.environ.get('CACHE_SERVER_ADDRESS', '')
+CACHE_SERVER_AUTHKEY = os.environ.get('CACHE_SERVER_AUTHKEY', '')
+# Longest wait for the cache server; a request is never held up longer
+CACHE_TIMEOUT_MS = int(os.environ.get('CACHE_TIMEOUT_MS', 50))
+# After a failed call, skip the server (all misses) for this long
+CACHE_RETRY_SECONDS = float(os.environ.get('CACHE_RETRY_SECONDS', 5))
+# Calls to the server in flight at once, per worker
+CACHE_CLIENT_THREADS = int(os.environ.get('CACHE_CLIENT_THREADS', 4))
+
+# Time-to-live per endpoint, in seconds
+# Why different TTLs? Trending changes slowly, reviews change when people post
+CACHE_TTLS = {
+    "search": int(os.environ.get('CACHE_TTL_SEARCH', 60)),
+    "top_watched": int(os.environ.get('CACHE_TTL_TOP_WATCHED', 300)),
+    "reviews": int(os.environ.get('CACHE_TTL_REVIEWS', 120))
+}
+
+
+def normalize(text):
+    """
+    Make equivalent free text produce the same key ("  Nolan " == "nolan")
+    Only for text matched case-insensitively (search queries): cursors and
+    ids are case-sensitive, two spellings can be two different pages
+    """
+    return " ".join(text.lower().split())
+
+
+def make_key(endpoint, **params):
+    """Build a cache key from the endpoint name and its parameters, as given"""
+    parts = [f"{name}={params[name]!r}" for name in sorted(params)]
+    return endpoint + "?" + "&".join(parts)
+
+
+class ResponseCache:
+    """Size-bounded LRU cache with per-entry TTL and tag invalidation"""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        # key -> (expires_at, value, tags); order = least to most recently used
+        self.entries = OrderedDict()
+        # tag -> keys carrying that tag
+        self.tags = defaultdict(set)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        """Return the cached value, or None on a miss"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value, _ = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(key)  # Mark as most recently used
+        self.hits += 1
+        return value
+
+    def set(self, key, value, ttl, tags=()):
+        """Store a value for `ttl` seconds, evicting the LRU entry if full"""
+        if key in self.entries:
+            self._remove(key)
+        self.entries[key] = (time.monotonic() + ttl, value, tuple(tags))
+        for tag in tags:
+            self.tags[tag].add(key)
+
+        while len(self.entries) > self.max_entries:
+            oldest_key = next(iter(self.entries))
+            self._remove(oldest_key)
+            self.evictions += 1
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of the given tags"""
+        for tag in tags:
+            for key in list(self.tags.get(tag, ())):
+                self._remove(key)
+                self.invalidations += 1
+
+    def clear(self):
+        """Drop everything (counters are kept)"""
+        self.entries.clear()
+        self.tags.clear()
+
+    def stats(self):
+        """Counters used to size the cache"""
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / lookups, 3) if lookups else 0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "invalidations": self.invalidations
+        }
+
+    def _remove(self, key):
+        """Remove one entry and its tag links"""
+        _, _, tags = self.entries.pop(key)
+        for tag in tags:
+            keys = self.tags.get(tag)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self.tags[tag]
+
+
+class LockedResponseCache(ResponseCache):
+    """
+    ResponseCache for the cache server
+    Why a lock? The server answers each worker connection on its own thread
+    """
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES):
+        super().__init__(max_entries)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return super().get(key)
+
+    def set(self, key, value, ttl, tags=()):
+        with self.lock:
+            super().set(key, value, ttl, tags)
+
+    def invalidate(self, *tags):
+        with self.lock:
+            super().invalidate(*tags)
+
+    def clear(self):
+        with self.lock:
+            super().clear()
+
+    def stats(self):
+        with self.lock:
+            return super().stats()
+
+
+class CacheManager(BaseManager):
+    """Local cache server: one LockedResponseCache shared by every worker"""
+
+
+def serve_cache(address, authkey):
+    """Run the cache server until the process exits (called by serve.py)"""
+    cache = LockedResponseCache()
+    CacheManager.register("get_cache", callable=lambda: cache)
+    CacheManager(address=address, authkey=authkey).get_server().serve_forever()
+
+
+class LocalCacheClient:
+    """Awaitable interface of a ResponseCache in this process (one API worker)"""
+
+    def __init__(self, cache):
+        self.cache = cache
+
+    @property
+    def max_entries(self):
+        return self.cache.max_entries
+
+    @max_entries.setter
+    def max_entries(self, max_entries):
+        self.cache.max_entries = max_entries
+
+    async def get(self, key):
+        return self.cache.get(key)
+
+    async def set(self, key, value, ttl, tags=()):
+        self.cache.set(key, value, ttl, tags)
+
+    async def invalidate(self, *tags):
+        self.cache.invalidate(*tags)
+
+    async def clear(self):
+        self.cache.clear()
+
+    async def stats(self):
+        return self.cache.stats()
+
+
+class CacheClient:
+    """
+    Awaitable ResponseCache interface backed by the cache server
+    Why not fail the request when the server is gone? A cache outage turns
+    into misses (and counted errors), the database still answers
+    """
+
+    def __init__(self, address, authkey, timeout_ms=CACHE_TIMEOUT_MS, retry_seconds=CACHE_RETRY_SECONDS,
+                 threads=CACHE_CLIENT_THREADS):
+        self.address = address
+        self.authkey = authkey
+        self.timeout = timeout_ms / 1000
+        self.retry_seconds = retry_seconds
+        # Why threads? Proxy calls block on a socket with no timeout of
+        # their own; the event loop only awaits them, with a timeout
+        # Why several? Each thread has its own connection to the server, so
+        # one stuck call doesn't hold up the others
+        self.callers = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="cache-client")
+        self.cache = None
+        self.connect_lock = threading.Lock()
+        # Calls are skipped (misses) until then, after a failure
+        self.down_until = 0
+        self.errors = 0
+        self.timeouts = 0
+
+    def _cache(self):
+        # Why a lock? Caller threads may connect at the same time; the proxy
+        # itself opens one connection per thread
+        with self.connect_lock:
+            if self.cache is None:
+                CacheManager.register("get_cache")
+                manager = CacheManager(address=self.address, authkey=self.authkey)
+                manager.connect()
+                self.cache = manager.get_cache()
+            return self.cache
+
+    def _remote_call(self, method, args):
+        try:
+            return getattr(self._cache(), method)(*args)
+        except (OSError, EOFError):
+            self.cache = None  # Reconnect on the next call
+            raise
+
+    async def _call(self, method, *args, default=None):
+        if time.monotonic() < self.down_until:
+            return default
+        call = asyncio.get_running_loop().run_in_executor(self.callers, self._remote_call, method, args)
+        try:
+            return await asyncio.wait_for(call, self.timeout)
+        except TimeoutError:
+            # The call may still be stuck on its thread, so the server is
+            # skipped for a while rather than tying up the other threads too
+            self.timeouts += 1
+            error = f"no answer within {self.timeout * 1000:.0f}ms"
+        except (OSError, EOFError) as e:
+            error = e
+        self.errors += 1
+        self.down_until = time.monotonic() + self.retry_seconds
+        print(f"Cache server unavailable, skipping it for {self.retry_seconds}s: {error}")
+        return default
+
+    async def get(self, key):
+        return await self._call("get", key)
+
+    async def set(self, key, value, ttl, tags=()):
+        await self._call("set", key, value, ttl, tuple(tags))
+
+    async def invalidate(self, *tags):
+        await self._call("invalidate", *tags)
+
+    async def clear(self):
+        await self._call("clear")
+
+    async def stats(self):
+        stats = await self._call("stats", default={})
+        return dict(stats, shared=True, errors=self.errors, timeouts=self.timeouts)
+
+
+# Shared cache used by the API
+if CACHE_SERVER_ADDRESS:
+    response_cache = CacheClient(CACHE_SERVER_ADDRESS, bytes.fromhex(CACHE_SERVER_AUTHKEY))
+else:
+    response_cache = LocalCacheClient(ResponseCache())
+
+
+def movie_tag(movie_id):
+    """Tag for entries that contain data about one movie"""
+    return f"movie:{movie_id}"
+
+
+def reviews_tag(movie_id):
+    """Tag for the reviews entries of one movie"""
+    return f"reviews:{movie_id}"
+
+
+async def invalidate_for_review(movie_id):
+    """A new review changes that movie's reviews page and rating"""
+    await response_cache.invalidate(reviews_tag(movie_id), movie_tag(movie_id))
+
+
+async def invalidate_for_watches(movie_ids):
+    """New watch events change trending and the popularity of those movies"""
+    await response_cache.invalidate("top_watched", *[movie_tag(movie_id) for movie_id in set(movie_ids)])
@@ -1,45 +1,86 @@
-from pymongo import MongoClient, ASCENDING, TEXT
+import os
+from pymongo import MongoClient
+from motor.motor_asyncio import AsyncIOMotorClient
 
-# Connect to local MongoDB
-# Why localhost:27017? That's the default MongoDB address on your computer
-client = MongoClient('mongodb://localhost:27017/')
+from indexes import reconcile_indexes
+from profiling import command_profiler
 
-# Create/access database named 'movie_streaming'
-db = client['movie_streaming']
+# Connection settings
+# Why environment variables? Benchmarks and other machines can point the app
+# at a different server or database without editing code
+MONGO_URI = os.environ.get('MONGO_URI', 'mongodb://localhost:27017/')
+MONGO_DB_NAME = os.environ.get('MONGO_DB_NAME', 'movie_streaming')
 
-# Create collections (like tables in SQL)
-movies_collection = db['movies']
-users_collection = db['users']
-watch_history_collection = db['watch_history']
-reviews_collection = db['reviews']
+# Connection pool settings for the async client used by the API
+# Why explicit? Concurrent requests each borrow a connection, so the pool size
+# decides how many queries can run at once; the wait timeout stops requests
+# from hanging forever when the pool is exhausted
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000))
+
+# Multi-worker deployments (serve.py) size pools from one budget for the
+# whole server, split evenly across the API_WORKERS processes
+# Why a budget? N workers with 100 connections each can exceed what the
+# MongoDB server accepts
+API_WORKERS = int(os.environ.get('API_WORKERS', 1))
+MONGO_CONNECTION_BUDGET = int(os.environ.get('MONGO_CONNECTION_BUDGET', 0))
+# Share of a worker's budget for the blocking client (background jobs)
+MONGO_SYNC_POOL_SIZE = int(os.environ.get('MONGO_SYNC_POOL_SIZE', 4))
+sync_pool_options = {}
+if MONGO_CONNECTION_BUDGET:
+    worker_budget = MONGO_CONNECTION_BUDGET // API_WORKERS
+    MONGO_MAX_POOL_SIZE = max(1, worker_budget - MONGO_SYNC_POOL_SIZE)
+    MONGO_MIN_POOL_SIZE = min(MONGO_MIN_POOL_SIZE, MONGO_MAX_POOL_SIZE)
+    sync_pool_options = {"maxPoolSize": MONGO_SYNC_POOL_SIZE}
+
+# Both clients are created on first use, not at import
+# Why lazy? Importing the app (tools, benchmarks, the serve.py parent) opens
+# nothing, and each API worker creates its clients in its own lifespan
+client = None
 
 
 def create_indexes():
     """
     Create indexes to make searches faster
     Why indexes? Like a book index - helps find data quickly
+    The indexes are declared in indexes.py; this builds missing ones and
+    drops redundant ones, and does nothing when they already match
     """
-    
-    # Text index for searching movies by title, director, cast
-    # Why TEXT index? MongoDB built-in feature for keyword search
-    movies_collection.create_index([
-        ('title', TEXT),
-        ('director', TEXT),
-        ('cast', TEXT)
-    ], name='movie_search_index')
-    
-    # Regular indexes for faster queries
-    # Why ASCENDING? Sorts data A to Z for quick lookup
-    users_collection.create_index([('email', ASCENDING)], unique=True)
-    watch_history_collection.create_index([('user_id', ASCENDING)])
-    watch_history_collection.create_index([('movie_id', ASCENDING)])
-    watch_history_collection.create_index([('timestamp', ASCENDING)])
-    reviews_collection.create_index([('movie_id', ASCENDING)])
-    reviews_collection.create_index([('user_id', ASCENDING)])
-    
+    reconcile_indexes(get_db())
     print("All indexes created successfully!")
 
 
 def get_db():
-    """Return database connection"""
-    return db
\ No newline at end of file
+    """Return database connection, creating the client on first use"""
+    global client
+    if client is None:
+        # Connect to local MongoDB
+        # Why localhost:27017? That's the default MongoDB address on your computer
+        # Why the profiler listener? Counts round trips per request (see profiling.py)
+        # Why connect=False? No socket is opened until the first query
+        client = MongoClient(MONGO_URI, connect=False, event_listeners=[command_profiler], **sync_pool_options)
+        # Slow aggregations are explained with this client
+        command_profiler.explain_client = client
+    # Create/access database named 'movie_streaming'
+    return client[MONGO_DB_NAME]
+
+
+# Async client for the API
+# Why a second client? The sync client above blocks the event loop, which is
+# fine for scripts like sample_data.py but not for FastAPI handlers
+async_client = None
+
+
+def get_async_db():
+    """Return async (Motor) database connection, creating the client on first use"""
+    global async_client
+    if async_client is None:
+        async_client = AsyncIOMotorClient(
+            MONGO_URI,
+            minPoolSize=MONGO_MIN_POOL_SIZE,
+            maxPoolSize=MONGO_MAX_POOL_SIZE,
+            waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            event_listeners=[command_profiler]
+        )
+    return async_client[MONGO_DB_NAME]
\ No newline at end of file
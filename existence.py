@@ -0,0 +1,228 @@
+"""
+Existence checks and display names of users and movies
+
+Most endpoints start with "does this user/movie exist, and what is its
+name?". Asking MongoDB every time costs a round trip before the real work
+can start. Each collection gets an IdRegistry instead:
+
+- an LRU of recently seen id -> name, for ids that exist
+- a Bloom filter over every _id, loaded in the background at startup
+  (see startup.py), for
+  ids that don't: "not in the filter" means "not in the collection"
+- MongoDB (one find_one on _id) only when neither can answer
+
+Why can a Bloom filter be trusted for "no"? It has no false negatives for
+ids it was given, so it only has to be given every id. Inserts after the
+scan (POST /movies in another worker, scripts, imports) reach it through a
+change stream opened before the scan. ObjectId timestamps can't tell new
+ids apart: ids may be made up with any time (generate_data.make_id).
+
+Without change streams (standalone servers, ID_FILTER_FOLLOW=off), or once
+the stream has failed, the filter can't know about inserts: its "no" is
+then confirmed with MongoDB and only its "maybe" saves nothing. Known ids
+are still answered from the name cache.
+"""
+import asyncio
+import hashlib
+import math
+import os
+from collections import OrderedDict
+
+import numpy as np
+from bson import ObjectId
+from pymongo.errors import OperationFailure, PyMongoError
+
+ID_NAME_CACHE_SIZE = int(os.environ.get('ID_NAME_CACHE_SIZE', 100_000))
+ID_FILTER_FALSE_POSITIVE_RATE = float(os.environ.get('ID_FILTER_FALSE_POSITIVE_RATE', 0.01))
+# auto: follow inserts with a change stream if the server has them; off:
+# never trust the filter's "no" (e.g. mongomock)
+ID_FILTER_FOLLOW = os.environ.get('ID_FILTER_FOLLOW', 'auto')
+
+# MongoDB error code for "change streams need a replica set"
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+# Ids added to the filter at a time while loading
+ID_LOAD_BATCH = 100_000
+
+
+def id_hashes(binaries):
+    """Two 64-bit hashes per 12-byte ObjectId (double hashing)"""
+    digests = b"".join(hashlib.blake2b(binary, digest_size=16).digest() for binary in binaries)
+    pairs = np.frombuffer(digests, dtype=np.uint64).reshape(-1, 2)
+    return pairs[:, 0], pairs[:, 1]
+
+
+class BloomFilter:
+    """Bit array answering "maybe present" or "certainly absent" for ObjectIds"""
+
+    def __init__(self, capacity, false_positive_rate=ID_FILTER_FALSE_POSITIVE_RATE):
+        capacity = max(capacity, 1000)
+        # Standard sizing: m = -n ln p / (ln 2)^2 bits and k = m/n ln 2 hashes
+        self.size = int(-capacity * math.log(false_positive_rate) / math.log(2) ** 2) + 1
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.capacity = capacity
+        self.count = 0
+        self.bits = np.zeros((self.size + 7) // 8, dtype=np.uint8)
+
+    def _positions(self, object_ids):
+        first, second = id_hashes([object_id.binary for object_id in object_ids])
+        steps = np.arange(self.hash_count, dtype=np.uint64)
+        # Why uint64? The sums wrap around the same way for every caller
+        positions = (first[:, None] + steps * second[:, None]) % np.uint64(self.size)
+        # Bit position -> (byte, mask within the byte)
+        return (positions >> np.uint64(3)).astype(np.intp), np.left_shift(np.uint8(1), (positions & np.uint64(7)).astype(np.uint8))
+
+    def add_many(self, object_ids):
+        if not object_ids:
+            return
+        indices, masks = self._positions(object_ids)
+        # Why .at? Two ids can set bits in the same byte
+        np.bitwise_or.at(self.bits, indices.ravel(), masks.ravel())
+        self.count += len(object_ids)
+
+    def __contains__(self, object_id):
+        indices, masks = self._positions([object_id])
+        return bool(np.all(self.bits[indices[0]] & masks[0]))
+
+
+class IdRegistry:
+    """Known ids and names of one collection (see module docstring)"""
+
+    def __init__(self, collection, name_field, max_names=ID_NAME_CACHE_SIZE):
+        self.collection = collection
+        self.name_field = name_field
+        self.max_names = max_names
+        # _id -> name; order = least to most recently used
+        self.names = OrderedDict()
+        self.filter = None
+        # Whether the filter has every id, inserts included
+        self.following = False
+        self.follow_task = None
+        self.name_hits = 0
+        self.filter_negatives = 0
+        self.lookups = 0
+
+    def remember(self, object_id, name):
+        """Record an existing id (e.g. just inserted) and its name"""
+        self.names[object_id] = name
+        self.names.move_to_end(object_id)
+        while len(self.names) > self.max_names:
+            self.names.popitem(last=False)
+        if self.filter is not None:
+            self.filter.add_many([object_id])
+
+    async def name_of(self, db, object_id):
+        """Name of an existing id, None if there is no such document"""
+        name = self.names.get(object_id)
+        if name is not None:
+            self.names.move_to_end(object_id)
+            self.name_hits += 1
+            return name
+        if self.following and object_id not in self.filter:
+            self.filter_negatives += 1
+            return None
+
+        self.lookups += 1
+        document = await db[self.collection].find_one({"_id": object_id}, {self.name_field: 1})
+        if document is None:
+            return None
+        name = document.get(self.name_field) or ""
+        self.remember(object_id, name)
+        return name
+
+    async def exists(self, db, object_id):
+        return await self.name_of(db, object_id) is not None
+
+    async def load(self, db):
+        """Build the Bloom filter of every _id; until then lookups go to MongoDB"""
+        await self.stop()
+        stream = None
+        if ID_FILTER_FOLLOW == "auto":
+            # Why open it before the scan? Inserts made during the scan are
+            # then in the stream, none fall in between
+            stream = db[self.collection].watch([{"$match": {"operationType": "insert"}},
+                                                {"$project": {"documentKey": 1}}])
+            try:
+                first = await stream.try_next()
+            except OperationFailure as e:
+                await stream.close()
+                if e.code != CHANGE_STREAM_UNSUPPORTED:
+                    raise
+                print(f"Change streams need a replica set, absent {self.collection} ids are confirmed with MongoDB")
+                stream = None
+
+        try:
+            bloom = await self._scan(db)
+        except BaseException:
+            if stream is not None:
+                await stream.close()
+            raise
+        # Ids remembered during the load may have been missed by the scan
+        bloom.add_many(list(self.names))
+        self.filter = bloom
+        if stream is not None:
+            if first is not None:
+                self._add_inserted(first)
+            self.following = True
+            self.follow_task = asyncio.create_task(self._follow(stream))
+
+    async def _scan(self, db):
+        """Bloom filter of the _ids in the collection now"""
+        # Why estimated_document_count? Reads collection metadata, no scan
+        expected = await db[self.collection].estimated_document_count()
+        # Why twice the size? Room for inserts before the next restart
+        bloom = BloomFilter(2 * expected)
+        batch = []
+        # Only _id: served from the _id index
+        async for document in db[self.collection].find({}, {"_id": 1}):
+            batch.append(document['_id'])
+            if len(batch) >= ID_LOAD_BATCH:
+                bloom.add_many(batch)
+                batch = []
+                await asyncio.sleep(0)  # Let requests run between batches
+        bloom.add_many(batch)
+        return bloom
+
+    def _add_inserted(self, change):
+        object_id = change['documentKey']['_id']
+        # Only ObjectIds are ever looked up
+        if isinstance(object_id, ObjectId):
+            self.filter.add_many([object_id])
+
+    async def _follow(self, stream):
+        """Add inserted ids to the filter until the stream fails"""
+        try:
+            async with stream:
+                async for change in stream:
+                    self._add_inserted(change)
+        except PyMongoError as e:
+            print(f"Lost the {self.collection} change stream, absent ids are confirmed with MongoDB: {e}")
+        finally:
+            # Inserts may be missed from now on
+            self.following = False
+
+    async def stop(self):
+        if self.follow_task is not None:
+            self.follow_task.cancel()
+            try:
+                await self.follow_task
+            except asyncio.CancelledError:
+                pass
+            self.follow_task = None
+
+    def stats(self):
+        return {
+            "filter_loaded": self.filter is not None,
+            "following_inserts": self.following,
+            "filter_ids": self.filter.count if self.filter is not None else 0,
+            "filter_bytes": self.filter.bits.nbytes if self.filter is not None else 0,
+            "cached_names": len(self.names),
+            "name_hits": self.name_hits,
+            "filter_negatives": self.filter_negatives,
+            "database_lookups": self.lookups
+        }
+
+
+# Shared registries used by the API
+known_users = IdRegistry("users", "name")
+known_movies = IdRegistry("movies", "title")
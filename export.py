@@ -0,0 +1,277 @@
+"""
+Export watch history and reviews to columnar files for offline analytics
+
+Questions like "watch time by genre" or "by subscription type" scan the
+whole history; run on MongoDB they compete with the API. This script copies
+the data out once, in batches, and analytics.py answers them from the files.
+
+Layout (Hive-style partitions, also readable by DuckDB, Spark or pandas):
+
+    analytics_export/
+        watch_history/date=2024-05-01/part-20240502T030000.arrow
+        reviews/date=2024-05-01/part-20240502T030000.arrow
+        movies.arrow, users.arrow      dimensions, replaced on every run
+        watermark.json                 where the next run starts
+
+Each run exports the events with watermark < timestamp <= now - lag, as new
+files, then moves the watermark. Archived months (see archive.py) are read
+from watch_history_archive, so a first run exports the whole history.
+
+Why the lag (EXPORT_LAG_SECONDS)? Events are stamped by clients and written
+in batches, so recent ones may still be on their way. Events that arrive
+stamped before the watermark are not exported; `--full` starts over.
+
+Why "arrow" by default? Uncompressed Arrow IPC files are memory-mapped by
+analytics.py without decoding. "parquet" files are several times smaller
+and better for other tools.
+
+Files are written as .tmp and renamed once the run succeeded, then the
+watermark moves. A failed run leaves files newer than the watermark's run,
+which the next run deletes before exporting the same window again.
+
+Usage:
+    python export.py [--path analytics_export] [--format arrow|parquet] [--full]
+"""
+import argparse
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from bson import ObjectId
+from pymongo import ReadPreference
+
+from archive import ARCHIVE, month_of, unpack_events
+
+ANALYTICS_PATH = os.environ.get('ANALYTICS_PATH', 'analytics_export')
+ANALYTICS_FORMAT = os.environ.get('ANALYTICS_FORMAT', 'arrow')
+EXPORT_LAG_SECONDS = int(os.environ.get('EXPORT_LAG_SECONDS', 300))
+# Documents read and written per round
+EXPORT_BATCH = 100_000
+
+EXTENSIONS = {"arrow": "arrow", "parquet": "parquet"}
+
+# Columns of each export; ObjectIds become their hex string
+WATCH_SCHEMA = pa.schema([
+    ("_id", pa.string()), ("user_id", pa.string()), ("movie_id", pa.string()),
+    ("timestamp", pa.timestamp("ms")), ("watch_duration", pa.int32())
+])
+REVIEW_SCHEMA = pa.schema([
+    ("_id", pa.string()), ("user_id", pa.string()), ("movie_id", pa.string()),
+    ("timestamp", pa.timestamp("ms")), ("rating", pa.float64()), ("review_text", pa.string())
+])
+MOVIE_SCHEMA = pa.schema([
+    ("_id", pa.string()), ("title", pa.string()), ("director", pa.string()),
+    ("release_year", pa.int32()), ("genres", pa.list_(pa.string())), ("rating", pa.float64()),
+    ("watch_count", pa.int64()), ("review_count", pa.int64()), ("rating_sum", pa.float64())
+])
+# Why no email? Analytics doesn't need contact details
+USER_SCHEMA = pa.schema([
+    ("_id", pa.string()), ("name", pa.string()), ("subscription_type", pa.string())
+])
+
+
+def to_table(documents, schema):
+    """MongoDB documents -> Arrow table with the schema's columns"""
+    columns = {name: [] for name in schema.names}
+    for document in documents:
+        for name, column in columns.items():
+            value = document.get(name)
+            column.append(str(value) if isinstance(value, ObjectId) else value)
+    return pa.table(columns, schema=schema)
+
+
+def open_writer(path, schema, file_format):
+    if file_format == "parquet":
+        return pq.ParquetWriter(path, schema, compression="zstd")
+    return pa.ipc.new_file(path, schema)
+
+
+class PartitionWriter:
+    """Writes events into date=YYYY-MM-DD/part-<run> files, one open file per date"""
+
+    def __init__(self, directory, schema, run, file_format):
+        self.directory = directory
+        self.schema = schema
+        self.run = run
+        self.file_format = file_format
+        self.writers = {}
+        self.files = []
+        # Times each date's file was opened; a reopened date gets a new file
+        self.opened = {}
+        self.rows = 0
+
+    def write(self, events):
+        by_date = {}
+        for event in events:
+            by_date.setdefault(event['timestamp'].date(), []).append(event)
+        for date, date_events in by_date.items():
+            writer = self.writers.get(date)
+            if writer is None:
+                partition = os.path.join(self.directory, f"date={date.isoformat()}")
+                os.makedirs(partition, exist_ok=True)
+                count = self.opened[date] = self.opened.get(date, 0) + 1
+                suffix = f"-{count}" if count > 1 else ""
+                path = os.path.join(partition, f"part-{self.run}{suffix}.{EXTENSIONS[self.file_format]}")
+                writer = self.writers[date] = open_writer(path + ".tmp", self.schema, self.file_format)
+                self.files.append(path)
+            writer.write_table(to_table(date_events, self.schema))
+        self.rows += len(events)
+
+    def close_before(self, date=None):
+        """Close the files of dates before `date` (all without one)"""
+        for day in [day for day in self.writers if date is None or day < date]:
+            self.writers.pop(day).close()
+
+    def publish(self):
+        self.close_before()
+        for path in self.files:
+            os.replace(path + ".tmp", path)
+
+
+def window_query(since, until):
+    return {"$gt": since, "$lte": until} if since else {"$lte": until}
+
+
+def export_sorted(cursor, writer):
+    """Write a cursor sorted by timestamp, closing each day's file once passed"""
+    batch = []
+    for document in cursor:
+        batch.append(document)
+        if len(batch) >= EXPORT_BATCH:
+            writer.write(batch)
+            writer.close_before(batch[-1]['timestamp'].date())
+            batch = []
+    if batch:
+        writer.write(batch)
+
+
+def export_watch_history(db, writer, since, until):
+    """Archived months, then hot events, in the window"""
+    window = window_query(since, until)
+    oldest_hot = db.watch_history.find_one({"timestamp": window}, {"timestamp": 1}, sort=[("timestamp", 1)])
+    # While archive.py moves a month, its events are briefly in both places
+    overlap_from = month_of(oldest_hot['timestamp']) if oldest_hot else None
+    archived_ids = set()
+
+    months = {"$lte": until}
+    if since:
+        months["$gte"] = month_of(since)
+    current_month = None
+    for document in db[ARCHIVE].find({"month": months}).sort("month", 1):
+        if document['month'] != current_month:
+            writer.close_before()
+            current_month = document['month']
+        events = [
+            event for event in unpack_events(document['events'], document['user_id'])
+            if (not since or event['timestamp'] > since) and event['timestamp'] <= until
+        ]
+        if overlap_from and document['month'] >= overlap_from:
+            archived_ids.update(event['_id'] for event in events)
+        writer.write(events)
+    writer.close_before()
+
+    # Why sort? The (timestamp, movie_id) index returns events in order,
+    # so each day's file is finished before the next one is opened
+    cursor = db.watch_history.find({"timestamp": window}).sort("timestamp", 1).batch_size(EXPORT_BATCH)
+    if archived_ids:
+        cursor = (event for event in cursor if event['_id'] not in archived_ids)
+    export_sorted(cursor, writer)
+
+
+def export_reviews(db, writer, since, until):
+    cursor = db.reviews.find({"timestamp": window_query(since, until)}).sort("timestamp", 1).batch_size(EXPORT_BATCH)
+    export_sorted(cursor, writer)
+
+
+def export_dimension(collection, schema, path, file_format):
+    """Full snapshot of a small collection, replacing the previous one in one step"""
+    writer = open_writer(path + ".tmp", schema, file_format)
+    batch = []
+    for document in collection.find({}, {name: 1 for name in schema.names}).batch_size(EXPORT_BATCH):
+        batch.append(document)
+        if len(batch) >= EXPORT_BATCH:
+            writer.write_table(to_table(batch, schema))
+            batch = []
+    writer.write_table(to_table(batch, schema))
+    writer.close()
+    # Why replace? analytics.py may still map the old file; it stays readable
+    os.replace(path + ".tmp", path)
+
+
+def read_watermark(path):
+    try:
+        with open(os.path.join(path, "watermark.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def remove_unfinished(path, last_run):
+    """Delete the files of runs that didn't move the watermark"""
+    for directory, _, files in os.walk(path):
+        for name in files:
+            # Why compare names? Run ids are timestamps, so they sort in time
+            unfinished = name.startswith("part-") and (not last_run or name[5:20] > last_run)
+            if name.endswith(".tmp") or unfinished:
+                os.remove(os.path.join(directory, name))
+
+
+def export_all(db, path=ANALYTICS_PATH, file_format=ANALYTICS_FORMAT, full=False, now=None):
+    """One export run, returns {export: rows written}"""
+    if full:
+        shutil.rmtree(path, ignore_errors=True)
+    os.makedirs(path, exist_ok=True)
+    watermark = read_watermark(path)
+    remove_unfinished(path, watermark.get("run"))
+    if watermark and watermark.get("format") != file_format:
+        raise ValueError(f"{path} holds {watermark.get('format')} files, run with --full to switch")
+    until = (now or datetime.now()) - timedelta(seconds=EXPORT_LAG_SECONDS)
+    # Why milliseconds? Stored timestamps have millisecond precision
+    until = until.replace(microsecond=until.microsecond // 1000 * 1000)
+    run = until.strftime("%Y%m%dT%H%M%S")
+
+    # Why a secondary? On a replica set the export reads away from the API
+    db = db.client.get_database(db.name, read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+    extension = EXTENSIONS[file_format]
+    export_dimension(db.movies, MOVIE_SCHEMA, os.path.join(path, f"movies.{extension}"), file_format)
+    export_dimension(db.users, USER_SCHEMA, os.path.join(path, f"users.{extension}"), file_format)
+
+    rows = {}
+    writers = []
+    for name, schema, export in [("watch_history", WATCH_SCHEMA, export_watch_history),
+                                 ("reviews", REVIEW_SCHEMA, export_reviews)]:
+        since = datetime.fromisoformat(watermark[name]) if name in watermark else None
+        if since and since >= until:
+            continue
+        writer = PartitionWriter(os.path.join(path, name), schema, run, file_format)
+        export(db, writer, since, until)
+        writers.append(writer)
+        rows[name] = writer.rows
+        watermark[name] = until.isoformat()
+
+    for writer in writers:
+        writer.publish()
+    watermark.update(format=file_format, run=run)
+    with open(os.path.join(path, "watermark.json.tmp"), "w") as f:
+        json.dump(watermark, f)
+    os.replace(os.path.join(path, "watermark.json.tmp"), os.path.join(path, "watermark.json"))
+    return rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export watch history and reviews to columnar files")
+    parser.add_argument("--path", default=ANALYTICS_PATH)
+    parser.add_argument("--format", choices=sorted(EXTENSIONS), default=ANALYTICS_FORMAT)
+    parser.add_argument("--full", action="store_true", help="Delete the export and start over")
+    args = parser.parse_args()
+
+    from database import get_db
+
+    rows = export_all(get_db(), args.path, args.format, args.full)
+    for name, count in rows.items():
+        print(f"{name}: {count:,} rows exported")
+    print(f"Export written to {args.path}")
@@ -0,0 +1,157 @@
+"""
+Facet counts for /movies/browse
+
+A browse page shows how many movies each genre and each decade would give:
+
+- genre counts follow the year and rating filters (not the genre filter,
+  so the other genres stay visible with their counts)
+- decade counts follow the genre and rating filters (not the year range)
+
+Counting them is a $group over every matching movie, too slow to run per
+page on a large catalog. Each distinct filter combination is counted once
+and kept here; a new movie then adds itself to every kept count it matches
+(add_movie), so the counts stay exact without being recomputed.
+
+Why only new movies? Genres, release_year and the catalog rating never
+change after insert; watch counts and reviews don't affect facets.
+
+Entries also expire after BROWSE_FACET_TTL seconds so that, with several
+workers (serve.py), movies added through another worker are counted too.
+"""
+import os
+import time
+from collections import Counter, OrderedDict
+
+BROWSE_FACET_CACHE_SIZE = int(os.environ.get('BROWSE_FACET_CACHE_SIZE', 512))
+BROWSE_FACET_TTL = int(os.environ.get('BROWSE_FACET_TTL', 600))
+
+
+def decade_of(year):
+    return year // 10 * 10
+
+
+def browse_filter(genre=None, year_from=None, year_to=None, min_rating=None):
+    """MongoDB filter of a browse request"""
+    query = {}
+    if genre:
+        query["genres"] = genre
+    years = {}
+    if year_from is not None:
+        years["$gte"] = year_from
+    if year_to is not None:
+        years["$lte"] = year_to
+    if years:
+        query["release_year"] = years
+    if min_rating is not None:
+        query["rating"] = {"$gte": min_rating}
+    return query
+
+
+def movie_matches(movie, genre=None, year_from=None, year_to=None, min_rating=None):
+    """Same test as browse_filter, on a movie document"""
+    year = movie.get('release_year')
+    return (
+        (not genre or genre in (movie.get('genres') or []))
+        and (year_from is None or (year is not None and year >= year_from))
+        and (year_to is None or (year is not None and year <= year_to))
+        and (min_rating is None or movie.get('rating', 0) >= min_rating)
+    )
+
+
+class FacetCache:
+    """LRU of facet counts per filter combination, updated on new movies"""
+
+    def __init__(self, max_entries=BROWSE_FACET_CACHE_SIZE, ttl=BROWSE_FACET_TTL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # key -> (expires_at, counts); order = least to most recently used
+        self.entries = OrderedDict()
+        # Bumped by every add_movie; a count started before it is not kept
+        self.version = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _get(self, key):
+        entry = self.entries.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def _set(self, key, counts, version):
+        # A movie added while counting may or may not be in the counts
+        if version != self.version:
+            return
+        self.entries[key] = (time.monotonic() + self.ttl, counts)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    async def genre_counts(self, db, year_from=None, year_to=None, min_rating=None):
+        """{"total": movies matching the filters, "genres": {genre: count}}"""
+        key = ("genres", year_from, year_to, min_rating)
+        counts = self._get(key)
+        if counts is None:
+            version = self.version
+            query = browse_filter(None, year_from, year_to, min_rating)
+            genres = Counter()
+            cursor = db.movies.aggregate([
+                {"$match": query},
+                {"$unwind": "$genres"},
+                {"$group": {"_id": "$genres", "count": {"$sum": 1}}}
+            ])
+            async for row in cursor:
+                genres[row['_id']] = row['count']
+            counts = {"total": await db.movies.count_documents(query), "genres": genres}
+            self._set(key, counts, version)
+        return counts
+
+    async def decade_counts(self, db, genre=None, min_rating=None):
+        """{decade: count} of the movies matching the genre and rating filters"""
+        key = ("decades", genre, min_rating)
+        counts = self._get(key)
+        if counts is None:
+            version = self.version
+            counts = Counter()
+            cursor = db.movies.aggregate([
+                {"$match": browse_filter(genre, None, None, min_rating)},
+                {"$group": {
+                    "_id": {"$subtract": ["$release_year", {"$mod": ["$release_year", 10]}]},
+                    "count": {"$sum": 1}
+                }}
+            ])
+            async for row in cursor:
+                if row['_id'] is not None:
+                    counts[int(row['_id'])] = row['count']
+            self._set(key, counts, version)
+        return counts
+
+    def add_movie(self, movie):
+        """Count a new movie in every kept entry whose filters it matches"""
+        self.version += 1
+        genres = set(movie.get('genres') or [])
+        year = movie.get('release_year')
+        for key, (_, counts) in self.entries.items():
+            if key[0] == "genres":
+                _, year_from, year_to, min_rating = key
+                if movie_matches(movie, None, year_from, year_to, min_rating):
+                    counts["total"] += 1
+                    counts["genres"].update(genres)
+            else:
+                _, genre, min_rating = key
+                if year is not None and movie_matches(movie, genre, None, None, min_rating):
+                    counts[decade_of(year)] += 1
+
+    def stats(self):
+        return {
+            "entries": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses
+        }
+
+
+# Shared facet counts used by the API
+facet_cache = FacetCache()
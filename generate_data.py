@@ -0,0 +1,306 @@
+"""
+Scalable synthetic data generator for load testing
+
+Unlike sample_data.py (20 movies, 100 events), this can fill the database
+with millions of documents:
+
+    python generate_data.py --movies 1e5 --users 1e6 --events 1e8 --workers 8
+
+- Popularity follows a Zipf distribution: a few movies get most watches,
+  and a few heavy users do most of the watching
+- Timestamps spread over --days days, busier in recent days and evenings
+- Same --seed and --now = same data (ids, titles, events), whatever
+  --workers is; --now defaults to today 00:00, so same-day runs match
+- Each worker process streams --batch-size documents at a time, so memory
+  stays constant no matter how many documents are generated
+
+Why deterministic ids? Workers can reference movie #123 or user #456 by
+computing its ObjectId instead of loading every id into memory.
+"""
+import argparse
+import math
+import os
+import random
+import struct
+import time
+from array import array
+from bisect import bisect
+from datetime import datetime, timedelta
+from multiprocessing import Pool
+
+from bson import ObjectId
+from pymongo import MongoClient
+
+# Id "kinds" stored in the ObjectId so movie #5 and user #5 differ
+MOVIE_KIND = 1
+USER_KIND = 2
+
+# Documents per worker task
+# Why bigger than a batch? Fewer tasks to schedule, still fine-grained enough
+# to keep every worker busy until the end
+TASK_BATCHES = 10
+
+TITLE_WORDS = [
+    "Dark", "Last", "Lost", "Silent", "Broken", "Golden", "Hidden", "Eternal", "Midnight", "Crimson",
+    "Night", "Empire", "Storm", "River", "Shadow", "Dream", "Legacy", "Horizon", "Kingdom", "Echo",
+    "Return", "Rise", "Fall", "Journey", "Secret", "Promise", "Frontier", "Signal", "Garden", "Machine"
+]
+GENRES = [
+    "Action", "Adventure", "Animation", "Biography", "Comedy", "Crime", "Drama",
+    "Fantasy", "Horror", "Romance", "Sci-Fi", "Thriller", "War"
+]
+FIRST_NAMES = [
+    "Ahmed", "Fatima", "Hassan", "Ayesha", "Bilal", "Zainab", "Usman", "Mariam", "Ali", "Sana",
+    "John", "Emma", "Liam", "Olivia", "Noah", "Ava", "Lucas", "Mia", "Ethan", "Sofia"
+]
+LAST_NAMES = [
+    "Khan", "Malik", "Shah", "Raza", "Ahmed", "Iqbal", "Tariq", "Noor",
+    "Smith", "Brown", "Garcia", "Miller", "Davis", "Lopez", "Wilson", "Moore"
+]
+SUBSCRIPTIONS = ["Free", "Basic", "Premium"]
+SUBSCRIPTION_WEIGHTS = [5, 3, 2]
+REVIEW_TEXTS = [
+    "Great movie! Highly recommend.",
+    "Amazing performances and direction.",
+    "A must-watch film.",
+    "Good story and excellent cast.",
+    "Decent movie, worth watching.",
+    "Not my taste, but well made.",
+    "Too long for what it is.",
+    "Brilliant cinematography."
+]
+# Relative chance of watching at each hour of the day (evening peak)
+HOUR_WEIGHTS = [2, 1, 1, 1, 1, 1, 2, 3, 3, 3, 3, 4, 5, 5, 4, 4, 5, 6, 8, 10, 12, 12, 9, 5]
+
+
+def parse_count(value):
+    """Accept counts like 100000 or 1e5"""
+    return int(float(value))
+
+
+def make_id(kind, index):
+    """Deterministic ObjectId for document number `index` of a kind"""
+    # 4-byte fixed timestamp + 1-byte kind + 7-byte index = 12 bytes
+    return ObjectId(struct.pack(">IB", 1600000000, kind) + index.to_bytes(7, "big"))
+
+
+def zipf_cumulative(n, exponent):
+    """Cumulative weights of ranks 1..n for P(rank) ~ 1 / rank^exponent"""
+    cumulative = array("d")
+    total = 0.0
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return cumulative
+
+
+def rank_to_index(rank, n):
+    """
+    Scatter popularity ranks over document numbers
+    Why? Otherwise movie #0 is always the most popular, #1 the second, ...
+    """
+    step = 1000003  # Prime, so the mapping is a permutation unless n is a multiple of it
+    if math.gcd(step, n) != 1:
+        return rank
+    return (rank * step) % n
+
+
+class ZipfSampler:
+    """Pick document numbers 0..n-1 with Zipf-distributed popularity"""
+
+    def __init__(self, n, exponent):
+        self.n = n
+        self.cumulative = zipf_cumulative(n, exponent)
+        self.total = self.cumulative[-1]
+
+    def sample(self, rng):
+        rank = bisect(self.cumulative, rng.random() * self.total)
+        return rank_to_index(min(rank, self.n - 1), self.n)
+
+
+def random_timestamp(rng, now, days):
+    """Recent days and evening hours are busier"""
+    # Why sqrt? Skews days_ago towards 0, like a growing user base
+    days_ago = int(days * (1 - math.sqrt(rng.random())))
+    hour = rng.choices(range(24), weights=HOUR_WEIGHTS)[0]
+    day = (now - timedelta(days=days_ago)).replace(hour=hour, minute=0, second=0, microsecond=0)
+    timestamp = day + timedelta(seconds=rng.randrange(3600))
+    # Later today hasn't happened yet, use the same hour yesterday
+    return timestamp if timestamp <= now else timestamp - timedelta(days=1)
+
+
+def generate_movie(rng, index):
+    words = rng.sample(TITLE_WORDS, rng.randint(1, 3))
+    return {
+        "_id": make_id(MOVIE_KIND, index),
+        "title": " ".join(words) + f" {index}",
+        "release_year": rng.randint(1950, 2024),
+        "genres": rng.sample(GENRES, rng.randint(1, 3)),
+        "cast": [f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}" for _ in range(rng.randint(2, 5))],
+        "director": f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}",
+        "rating": round(rng.uniform(1.5, 5.0), 1)
+    }
+
+
+def generate_user(rng, index):
+    first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+    return {
+        "_id": make_id(USER_KIND, index),
+        "name": f"{first} {last}",
+        "email": f"user{index}@example.com",
+        "subscription_type": rng.choices(SUBSCRIPTIONS, weights=SUBSCRIPTION_WEIGHTS)[0]
+    }
+
+
+# Per-process state, built once per worker by init_worker
+worker = {}
+
+
+def init_samplers(args):
+    """State the document generators need (also used by benchmark.py)"""
+    worker["args"] = args
+    worker["movies"] = ZipfSampler(args["movies"], args["zipf"])
+    worker["users"] = ZipfSampler(args["users"], args["zipf"])
+    worker["now"] = datetime.fromisoformat(args["now"])
+
+
+def init_worker(args):
+    """Runs in each worker process after fork"""
+    # Why a client per process? MongoClient is not fork-safe
+    worker["db"] = MongoClient(args["uri"])[args["db_name"]]
+    init_samplers(args)
+
+
+def generate_watch(rng, _index):
+    args = worker["args"]
+    return {
+        "user_id": make_id(USER_KIND, worker["users"].sample(rng)),
+        "movie_id": make_id(MOVIE_KIND, worker["movies"].sample(rng)),
+        "timestamp": random_timestamp(rng, worker["now"], args["days"]),
+        "watch_duration": rng.randint(1, 180)
+    }
+
+
+def generate_review(rng, _index):
+    args = worker["args"]
+    return {
+        "user_id": make_id(USER_KIND, worker["users"].sample(rng)),
+        "movie_id": make_id(MOVIE_KIND, worker["movies"].sample(rng)),
+        "rating": round(min(5.0, max(1.0, rng.gauss(3.8, 0.8))), 1),
+        "review_text": rng.choice(REVIEW_TEXTS),
+        "timestamp": random_timestamp(rng, worker["now"], args["days"])
+    }
+
+
+GENERATORS = {
+    "movies": generate_movie,
+    "users": generate_user,
+    "watch_history": generate_watch,
+    "reviews": generate_review
+}
+
+
+def run_task(task):
+    """Generate and insert documents [start, start + count) of one collection"""
+    collection_name, start, count = task
+    args = worker["args"]
+    # Why seed per task? The same task always yields the same documents,
+    # whichever worker runs it
+    rng = random.Random(f"{args['seed']}:{collection_name}:{start}")
+    generate = GENERATORS[collection_name]
+    collection = worker["db"][collection_name]
+
+    batch = []
+    for index in range(start, start + count):
+        batch.append(generate(rng, index))
+        if len(batch) == args["batch_size"]:
+            collection.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+    return collection_name, count
+
+
+def make_tasks(collection_name, total, batch_size):
+    task_size = batch_size * TASK_BATCHES
+    return [
+        (collection_name, start, min(task_size, total - start))
+        for start in range(0, total, task_size)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a large synthetic movie streaming dataset")
+    parser.add_argument("--movies", type=parse_count, default=100000)
+    parser.add_argument("--users", type=parse_count, default=100000)
+    parser.add_argument("--events", type=parse_count, default=1000000, help="Watch history records")
+    parser.add_argument("--reviews", type=parse_count, default=None, help="Default: events / 100")
+    parser.add_argument("--days", type=int, default=365, help="Timestamp spread in days")
+    parser.add_argument("--zipf", type=float, default=1.1, help="Zipf exponent of popularity")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--now", type=datetime.fromisoformat, default=None,
+                        help="Time the timestamps lead up to, e.g. 2024-05-01T00:00 (default: today 00:00)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--skip-derived", action="store_true",
+                        help="Don't rebuild the materialized views (trending, watch counts, ratings)")
+    args = parser.parse_args()
+    if args.reviews is None:
+        args.reviews = args.events // 100
+    # Why midnight? A wall-clock time would change the events on every run
+    if args.now is None:
+        args.now = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    print(f"Timestamps lead up to {args.now.isoformat()} (pass --now to reproduce)")
+
+    # Imported here so worker processes never open the module-level client
+    from database import MONGO_URI, MONGO_DB_NAME, create_indexes, get_db
+    from views import rebuild_views
+
+    # Start from empty collections (ids are deterministic, so they'd clash)
+    db = get_db()
+    for name in list(GENERATORS) + ["watch_history_archive", "movie_daily_watches"]:
+        db[name].drop()
+
+    worker_args = {
+        "uri": MONGO_URI,
+        "db_name": MONGO_DB_NAME,
+        "movies": args.movies,
+        "users": args.users,
+        "zipf": args.zipf,
+        "days": args.days,
+        "seed": args.seed,
+        "batch_size": args.batch_size,
+        # Why pass 'now'? Every worker uses the same time reference
+        "now": args.now.isoformat()
+    }
+    totals = {
+        "movies": args.movies,
+        "users": args.users,
+        "watch_history": args.events,
+        "reviews": args.reviews
+    }
+
+    with Pool(args.workers, initializer=init_worker, initargs=(worker_args,)) as pool:
+        for collection_name, total in totals.items():
+            start = time.perf_counter()
+            done = 0
+            tasks = make_tasks(collection_name, total, args.batch_size)
+            for _, count in pool.imap_unordered(run_task, tasks):
+                done += count
+                elapsed = time.perf_counter() - start
+                print(f"\r{collection_name}: {done:,}/{total:,} ({done / elapsed:,.0f} docs/s)", end="")
+            print()
+
+    # Why after inserting? Building an index once is faster than updating it
+    # on every insert
+    print("Creating indexes...")
+    create_indexes()
+
+    if not args.skip_derived:
+        print("Rebuilding materialized views...")
+        rebuild_views(db)
+    print("Done!")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+Declared indexes and the queries they serve
+
+INDEXES lists every index the app needs, QUERIES the shape of every query
+that should use one (equality fields, sort, range). At startup the
+declaration is compared with the server's index_information():
+
+- missing indexes (or ones whose keys/options changed) are built in the
+  background, so the API starts serving right away
+- redundant indexes are dropped, after the builds, so a query never loses
+  its index midway: plain indexes whose keys are a prefix of a declared
+  index (which serves all their queries), and the old indexes listed in DROP
+- other undeclared indexes (made by hand by an operator, or by another
+  app on the same database) are only reported, never dropped
+- when the two already match, startup does no index work beyond one
+  listIndexes per collection
+
+check_coverage() reports queries no declared index can serve without a
+collection scan or an in-memory sort.
+
+Usage:
+    python indexes.py            # report differences and uncovered queries
+    python indexes.py --apply    # build missing / drop redundant, blocking
+"""
+import argparse
+import asyncio
+
+from pymongo import ASCENDING, DESCENDING, TEXT
+from pymongo.errors import OperationFailure
+from starlette.concurrency import run_in_threadpool
+
+# collection -> indexes, each {"keys": [(field, direction)], "name": ..., "unique": ...}
+# Why fewer, compound indexes? Every insert updates every index
+INDEXES = {
+    "movies": [
+        # Text index for searching movies by title, director, cast
+        # Why TEXT index? MongoDB built-in feature for keyword search
+        {"name": "movie_search_index", "keys": [("title", TEXT), ("director", TEXT), ("cast", TEXT)]},
+        # Browse pages: genre first (equality), then the sort, then the year
+        # range, so a page is read in order and filtered inside the index
+        {"name": "browse_genre_rating", "keys": [("genres", ASCENDING), ("rating", DESCENDING), ("_id", DESCENDING), ("release_year", ASCENDING)]},
+        {"name": "browse_genre_popularity", "keys": [("genres", ASCENDING), ("watch_count", DESCENDING), ("_id", DESCENDING), ("release_year", ASCENDING)]},
+        {"name": "browse_rating", "keys": [("rating", DESCENDING), ("_id", DESCENDING), ("release_year", ASCENDING)]},
+        {"name": "browse_popularity", "keys": [("watch_count", DESCENDING), ("_id", DESCENDING), ("release_year", ASCENDING)]}
+    ],
+    "users": [
+        {"keys": [("email", ASCENDING)], "unique": True}
+    ],
+    "watch_history": [
+        # History pages, recent watches and per-user counts; sorted by the index
+        {"name": "user_recent", "keys": [("user_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]},
+        # Time ranges (archiving, bucket rebuilds)
+        {"keys": [("timestamp", ASCENDING), ("movie_id", ASCENDING)]},
+        # Polling view worker: unstamped events (null), then one batch each
+        {"keys": [("view_seq", ASCENDING)]}
+    ],
+    "watch_history_archive": [
+        {"keys": [("user_id", ASCENDING), ("month", DESCENDING)]},
+        {"keys": [("month", ASCENDING)]}
+    ],
+    "reviews": [
+        # Reviews pages, newest first; sorted by the index
+        {"keys": [("movie_id", ASCENDING), ("timestamp", DESCENDING), ("_id", DESCENDING)]},
+        # Incremental analytics exports (export.py)
+        {"keys": [("timestamp", ASCENDING)]},
+        # Polling view worker, as for watch_history
+        {"keys": [("view_seq", ASCENDING)]}
+    ],
+    "ingest_staging": [
+        # Left-over staged events (see ingest.py)
+        {"keys": [("received_at", ASCENDING)]}
+    ],
+    "movie_daily_watches": [
+        # Why unique? Each movie has exactly one bucket per day, and the
+        # view worker upserts into it
+        {"keys": [("day", ASCENDING), ("movie_id", ASCENDING)], "unique": True}
+    ],
+}
+
+# Indexes created by earlier versions that no query uses any more, and
+# that no declared index covers as a prefix
+DROP = {
+    "watch_history": ["movie_id_1"],
+    "reviews": ["user_id_1"],
+}
+
+# Index options that change what an index does, beyond speeding up queries
+# Why keep such indexes? Dropping a unique or TTL index changes behavior
+BEHAVIOR_OPTIONS = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds", "collation")
+
+# Query shapes, checked against INDEXES by check_coverage()
+# equality: fields matched by value; sort: [(field, direction)]; range: field
+# compared with $gt/$lt; text: uses $text
+QUERIES = [
+    {"name": "GET /users/{user_id}/history", "collection": "watch_history",
+     "equality": ["user_id"], "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]},
+    {"name": "GET /users/{user_id}/history (archive)", "collection": "watch_history_archive",
+     "equality": ["user_id"], "sort": [("month", DESCENDING)]},
+    {"name": "GET /users/{user_id}/recommendations", "collection": "watch_history",
+     "equality": ["user_id"], "sort": [("timestamp", DESCENDING)]},
+    {"name": "GET /movies/{movie_id}/reviews", "collection": "reviews",
+     "equality": ["movie_id"], "sort": [("timestamp", DESCENDING), ("_id", DESCENDING)]},
+    {"name": "POST /movies/reviews/summary:batch", "collection": "reviews",
+     "equality": ["movie_id"], "sort": [("timestamp", DESCENDING)]},
+    {"name": "GET /movies/search (mongo backend)", "collection": "movies", "text": True},
+    {"name": "GET /movies/browse?genre=", "collection": "movies", "equality": ["genres"],
+     "sort": [("rating", DESCENDING), ("_id", DESCENDING)], "range": "release_year"},
+    {"name": "GET /movies/browse?genre=&sort=popularity", "collection": "movies", "equality": ["genres"],
+     "sort": [("watch_count", DESCENDING), ("_id", DESCENDING)], "range": "release_year"},
+    {"name": "GET /movies/browse", "collection": "movies",
+     "sort": [("rating", DESCENDING), ("_id", DESCENDING)], "range": "release_year"},
+    {"name": "GET /movies/browse?sort=popularity", "collection": "movies",
+     "sort": [("watch_count", DESCENDING), ("_id", DESCENDING)], "range": "release_year"},
+    {"name": "facets.py: decade counts", "collection": "movies", "equality": ["genres"], "range": "rating"},
+    {"name": "facets.py: genre counts", "collection": "movies", "range": "rating"},
+    {"name": "GET /movies/top-watched", "collection": "movie_daily_watches", "range": "day"},
+    {"name": "archive.py: month of events", "collection": "watch_history", "range": "timestamp",
+     "sort": [("timestamp", ASCENDING)]},
+    {"name": "archive.py: crash recovery", "collection": "watch_history_archive", "equality": ["month"]},
+    {"name": "export.py: watch history", "collection": "watch_history", "range": "timestamp",
+     "sort": [("timestamp", ASCENDING)]},
+    {"name": "export.py: reviews", "collection": "reviews", "range": "timestamp",
+     "sort": [("timestamp", ASCENDING)]},
+    {"name": "export.py: archived months", "collection": "watch_history_archive", "range": "month",
+     "sort": [("month", ASCENDING)]},
+    {"name": "recommendations.py --build", "collection": "watch_history", "sort": [("user_id", ASCENDING)]},
+    {"name": "ingest.py: recovery", "collection": "ingest_staging", "range": "received_at"},
+    {"name": "ingest.py: recovery (already written?)", "collection": "watch_history",
+     "equality": ["user_id"], "range": "timestamp"},
+    {"name": "views.py polling", "collection": "watch_history", "equality": ["view_seq"]},
+    {"name": "views.py polling", "collection": "reviews", "equality": ["view_seq"]},
+]
+
+
+def index_name(spec):
+    """Declared name, or the one MongoDB would generate (e.g. email_1)"""
+    return spec.get("name") or "_".join(f"{field}_{direction}" for field, direction in spec["keys"])
+
+
+def matches(spec, info):
+    """True if an existing index (index_information() entry) is the declared one"""
+    if bool(spec.get("unique")) != bool(info.get("unique")):
+        return False
+    if any(direction == TEXT for _, direction in spec["keys"]):
+        # Text indexes are stored as _fts/_ftsx keys, compare the weighted fields
+        fields = info.get("weights") or {field for field, direction in info["key"] if direction == TEXT}
+        return set(fields) == {field for field, _ in spec["keys"]}
+    return [tuple(key) for key in info["key"]] == [(field, direction) for field, direction in spec["keys"]]
+
+
+def covered_by_prefix(info, specs):
+    """
+    True if an existing index only repeats the first keys of a declared one
+    (e.g. user_id_1 next to user_id_1_timestamp_-1): every query it serves,
+    the declared index serves too
+    """
+    if any(option in info for option in BEHAVIOR_OPTIONS):
+        return False
+    keys = [tuple(key) for key in info["key"]]
+    if any(not isinstance(direction, (int, float)) for _, direction in keys):
+        return False  # Text, hashed, geo...
+    return any(
+        [(field, direction) for field, direction in spec["keys"]][:len(keys)] == keys
+        for spec in specs
+    )
+
+
+def plan_indexes(db, indexes=INDEXES, drop=DROP):
+    """
+    Compare declared and existing indexes
+    Returns {"create": [(collection, spec)], "drop": [(collection, name)],
+    "unknown": [(collection, name)]}; create and drop are empty when nothing
+    changed, unknown lists undeclared indexes that are kept
+    """
+    plan = {"create": [], "drop": [], "unknown": []}
+    for collection_name, specs in indexes.items():
+        existing = db[collection_name].index_information()
+        declared = {index_name(spec): spec for spec in specs}
+        for name, spec in declared.items():
+            info = existing.get(name)
+            if info is None:
+                plan["create"].append((collection_name, spec))
+            elif not matches(spec, info):
+                # Same name, different definition: rebuild it
+                plan["drop"].append((collection_name, name))
+                plan["create"].append((collection_name, spec))
+        for name, info in existing.items():
+            if name == "_id_" or name in declared:
+                continue
+            if name in drop.get(collection_name, []) or covered_by_prefix(info, specs):
+                plan["drop"].append((collection_name, name))
+            else:
+                plan["unknown"].append((collection_name, name))
+    return plan
+
+
+def apply_plan(db, plan):
+    """
+    Build the missing indexes, then drop the redundant ones
+    Why this order? The index replacing a dropped one is ready first
+    (a changed index with the same name has to be dropped first)
+    """
+    creates = {(collection_name, index_name(spec)) for collection_name, spec in plan["create"]}
+    for collection_name, name in plan["drop"]:
+        if (collection_name, name) in creates:
+            drop_index(db[collection_name], name)
+    for collection_name, spec in plan["create"]:
+        options = {"unique": True} if spec.get("unique") else {}
+        db[collection_name].create_index(spec["keys"], name=index_name(spec), **options)
+        print(f"Index built: {collection_name}.{index_name(spec)}")
+    for collection_name, name in plan["drop"]:
+        if (collection_name, name) not in creates:
+            drop_index(db[collection_name], name)
+            print(f"Redundant index dropped: {collection_name}.{name}")
+
+
+def drop_index(collection, name):
+    try:
+        collection.drop_index(name)
+    except OperationFailure:
+        pass  # Already dropped (e.g. by another worker)
+
+
+def covers(keys, query):
+    """
+    True if an index with these keys serves the query without a scan or an
+    in-memory sort: equality fields first (any order), then the sort (or
+    all of it reversed), then the range field
+    """
+    equality = set(query.get("equality", []))
+    if set(field for field, _ in keys[:len(equality)]) != equality:
+        return False
+    rest = keys[len(equality):]
+
+    sort = query.get("sort", [])
+    if sort:
+        head = rest[:len(sort)]
+        reversed_sort = [(field, -direction) for field, direction in sort]
+        if head != sort and head != reversed_sort:
+            return False
+        rest = rest[len(sort):]
+        if query.get("range") and query["range"] != sort[0][0] and (not rest or rest[0][0] != query["range"]):
+            return False
+    elif query.get("range"):
+        if not rest or rest[0][0] != query["range"]:
+            return False
+    return bool(equality or sort or query.get("range"))
+
+
+def check_coverage(indexes=INDEXES, queries=QUERIES):
+    """Names of the queries no declared index serves"""
+    uncovered = []
+    for query in queries:
+        specs = indexes.get(query["collection"], [])
+        if query.get("text"):
+            covered = any(direction == TEXT for spec in specs for _, direction in spec["keys"])
+        else:
+            # Every collection has the _id index
+            candidates = [spec["keys"] for spec in specs] + [[("_id", ASCENDING)]]
+            covered = any(covers(keys, query) for keys in candidates)
+        if not covered:
+            uncovered.append(f"{query['name']} ({query['collection']})")
+    return uncovered
+
+
+def reconcile_indexes(db):
+    """Bring the server's indexes in line with INDEXES (blocking), return the plan"""
+    plan = plan_indexes(db)
+    for collection_name, name in plan["unknown"]:
+        print(f"Undeclared index kept: {collection_name}.{name}")
+    apply_plan(db, plan)
+    return plan
+
+
+class IndexReconciler:
+    """Startup index check; builds and drops run in the background"""
+
+    def __init__(self):
+        self.task = None
+        self.plan = None
+        self.state = "not started"
+        self.uncovered = check_coverage()
+        self.unknown = []
+
+    async def start(self, sync_db):
+        for name in self.uncovered:
+            print(f"No index covers query: {name}")
+        # Why threadpool? Reading index_information uses the blocking client
+        self.plan = await run_in_threadpool(plan_indexes, sync_db)
+        self.unknown = self.plan["unknown"]
+        for collection_name, name in self.unknown:
+            print(f"Undeclared index kept: {collection_name}.{name}")
+        if not self.plan["create"] and not self.plan["drop"]:
+            self.state = "up to date"
+            return
+        self.state = "building"
+        self.task = asyncio.create_task(self._apply(sync_db))
+
+    async def _apply(self, sync_db):
+        try:
+            await run_in_threadpool(apply_plan, sync_db, self.plan)
+            self.plan = None
+            self.state = "up to date"
+        except Exception as e:
+            self.state = f"failed: {e}"
+            print(f"Index build failed: {e}")
+
+    async def stop(self):
+        # A build already sent to the server finishes there on its own
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self):
+        plan = self.plan or {"create": [], "drop": []}
+        return {
+            "state": self.state,
+            "to_create": [f"{collection}.{index_name(spec)}" for collection, spec in plan["create"]],
+            "to_drop": [f"{collection}.{name}" for collection, name in plan["drop"]],
+            "undeclared_kept": [f"{collection}.{name}" for collection, name in self.unknown],
+            "uncovered_queries": self.uncovered
+        }
+
+
+# Shared reconciler used by the API
+index_reconciler = IndexReconciler()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare declared and existing indexes")
+    parser.add_argument("--apply", action="store_true", help="Build missing and drop redundant indexes")
+    args = parser.parse_args()
+
+    from database import get_db
+
+    for name in check_coverage():
+        print(f"No index covers query: {name}")
+    if args.apply:
+        reconcile_indexes(get_db())
+        print("Indexes up to date!")
+    else:
+        plan = plan_indexes(get_db())
+        for collection_name, spec in plan["create"]:
+            print(f"Missing: {collection_name}.{index_name(spec)}")
+        for collection_name, name in plan["drop"]:
+            print(f"Redundant: {collection_name}.{name}")
+        for collection_name, name in plan["unknown"]:
+            print(f"Undeclared, kept: {collection_name}.{name}")
+        if not plan["create"] and not plan["drop"]:
+            print("Indexes up to date!")
@@ -0,0 +1,318 @@
+"""
+Buffered ingestion of watch events
+
+POST /events/watch stores the validated events of a request as one
+document in the ingest_staging collection, puts them into an in-memory
+queue and returns. A background task takes events off the queue and writes
+them to watch_history with one unordered insert_many per batch, then
+deletes the staging documents whose events are all written. A batch is
+flushed when it reaches INGEST_BATCH_SIZE events or when its oldest event
+has waited INGEST_MAX_AGE_MS, whichever comes first.
+
+Why buffer? Players send a steady stream of small requests. Writing each
+one on its own would mean one round trip (and index update batch) per event.
+
+Why stage first? Once the API answered 202 the events must survive a crash
+or a worker restart, which loses the in-memory queue. Staging is one small
+insert per request; watch_history and its indexes are still written in
+batches.
+
+Staging documents older than INGEST_RECOVER_AFTER_SECONDS were left by a
+crash or by a batch that failed every retry. The recovering worker
+(worker 0 with serve.py) writes those of their events that watch_history
+doesn't have yet, then deletes them.
+
+Backpressure (queue full), set with INGEST_FULL_POLICY:
+- "block":  wait up to INGEST_ENQUEUE_TIMEOUT_MS for room, then reject
+- "reject": reject at once (the client should retry later)
+- "drop":   accept the request but discard its events (counted in stats)
+
+A failed flush is retried INGEST_MAX_RETRIES times with exponential backoff,
+then its events are left staged until they are recovered.
+"""
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo.errors import BulkWriteError, PyMongoError
+
+INGEST_BATCH_SIZE = int(os.environ.get('INGEST_BATCH_SIZE', 1000))
+INGEST_MAX_AGE_MS = int(os.environ.get('INGEST_MAX_AGE_MS', 200))
+INGEST_QUEUE_MAX = int(os.environ.get('INGEST_QUEUE_MAX', 100000))
+INGEST_FULL_POLICY = os.environ.get('INGEST_FULL_POLICY', 'block')
+INGEST_ENQUEUE_TIMEOUT_MS = int(os.environ.get('INGEST_ENQUEUE_TIMEOUT_MS', 2000))
+INGEST_MAX_RETRIES = int(os.environ.get('INGEST_MAX_RETRIES', 3))
+INGEST_RETRY_BACKOFF_MS = int(os.environ.get('INGEST_RETRY_BACKOFF_MS', 100))
+# Staged events older than this are no longer waiting in any worker's queue
+INGEST_RECOVER_AFTER_SECONDS = int(os.environ.get('INGEST_RECOVER_AFTER_SECONDS', 60))
+INGEST_RECOVER_INTERVAL_SECONDS = int(os.environ.get('INGEST_RECOVER_INTERVAL_SECONDS', 30))
+
+# Biggest NDJSON body accepted in one request
+INGEST_MAX_LINES = min(int(os.environ.get('INGEST_MAX_LINES', 10000)), INGEST_QUEUE_MAX)
+
+FULL_POLICIES = ("block", "reject", "drop")
+
+# MongoDB error code for "duplicate key"
+DUPLICATE_KEY = 11000
+
+# Events accepted but not yet written, one document per request
+STAGING = "ingest_staging"
+
+
+class QueueFullError(Exception):
+    """The queue has no room for the events and the policy says reject"""
+
+
+class StagingError(Exception):
+    """The events couldn't be stored in the staging collection, nothing was queued"""
+
+
+def event_key(event):
+    """What makes two watch events the same event"""
+    return event['user_id'], event['movie_id'], event['timestamp']
+
+
+class WatchEventBuffer:
+    """Async queue of watch events with a background batch writer"""
+
+    def __init__(self, db,
+                 batch_size=INGEST_BATCH_SIZE,
+                 max_age_ms=INGEST_MAX_AGE_MS,
+                 queue_max=INGEST_QUEUE_MAX,
+                 full_policy=INGEST_FULL_POLICY,
+                 enqueue_timeout_ms=INGEST_ENQUEUE_TIMEOUT_MS,
+                 max_retries=INGEST_MAX_RETRIES,
+                 retry_backoff_ms=INGEST_RETRY_BACKOFF_MS,
+                 recover_after_seconds=INGEST_RECOVER_AFTER_SECONDS,
+                 recover_interval_seconds=INGEST_RECOVER_INTERVAL_SECONDS):
+        if full_policy not in FULL_POLICIES:
+            raise ValueError(f"INGEST_FULL_POLICY must be one of {FULL_POLICIES}, got {full_policy!r}")
+        self.db = db
+        self.batch_size = batch_size
+        self.max_age = max_age_ms / 1000
+        self.queue_max = queue_max
+        self.full_policy = full_policy
+        self.enqueue_timeout = enqueue_timeout_ms / 1000
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.recover_after = timedelta(seconds=recover_after_seconds)
+        self.recover_interval = recover_interval_seconds
+
+        # Items are (staging document _id, event)
+        self.queue = asyncio.Queue()
+        self.room_freed = asyncio.Event()
+        # Slots of requests between their room check and their puts
+        self.reserved = 0
+        # Staging document _id -> its events not written yet
+        self.staged = {}
+        self.task = None
+        self.recover_task = None
+
+        # Counters for /events/stats and the ingest benchmark
+        self.accepted = 0
+        self.written = 0
+        self.dropped = 0
+        self.rejected = 0
+        self.retries = 0
+        self.flushes = 0
+        self.left_staged = 0
+        self.recovered = 0
+
+    def free_slots(self):
+        return self.queue_max - self.queue.qsize() - self.reserved
+
+    async def enqueue(self, events):
+        """
+        Queue a batch of events, all or nothing
+        Returns the number of events queued (0 when the drop policy applied)
+        Raises QueueFullError when they can't be queued, StagingError when
+        they can't be staged
+        """
+        if self.free_slots() < len(events):
+            if self.full_policy == "drop":
+                self.dropped += len(events)
+                return 0
+            if self.full_policy == "reject":
+                self.rejected += len(events)
+                raise QueueFullError("Ingest queue is full")
+            try:
+                await asyncio.wait_for(self._wait_for_room(len(events)), self.enqueue_timeout)
+            except asyncio.TimeoutError:
+                self.rejected += len(events)
+                raise QueueFullError("Ingest queue stayed full")
+
+        # Why reserve? Other requests run while this one is staged, the
+        # room checked above must still be there for its puts
+        self.reserved += len(events)
+        try:
+            staged = await self.db[STAGING].insert_one({"received_at": datetime.now(), "events": events})
+        except PyMongoError as e:
+            raise StagingError(f"Events could not be stored: {e}") from e
+        finally:
+            self.reserved -= len(events)
+
+        self.staged[staged.inserted_id] = len(events)
+        for event in events:
+            self.queue.put_nowait((staged.inserted_id, event))
+        self.accepted += len(events)
+        return len(events)
+
+    async def _wait_for_room(self, count):
+        while self.free_slots() < count:
+            self.room_freed.clear()
+            await self.room_freed.wait()
+
+    def start(self, recover=False):
+        """
+        Start the background writer
+        recover: also write left-over staged events (one process per database)
+        """
+        self.task = asyncio.create_task(self._run())
+        if recover:
+            self.recover_task = asyncio.create_task(self._recover_regularly())
+
+    async def stop(self):
+        """Flush everything still queued, then stop the writer"""
+        if self.recover_task is not None:
+            self.recover_task.cancel()
+            self.recover_task = None
+        if self.task is None:
+            return
+        # Why a sentinel? Events queued before it are flushed first (FIFO)
+        self.queue.put_nowait(None)
+        await self.task
+        self.task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            first = await self.queue.get()
+            if first is None:
+                return
+            batch = [first]
+            deadline = loop.time() + self.max_age
+            stopping = False
+
+            # Fill the batch until it's full or its first event got too old
+            while len(batch) < self.batch_size:
+                try:
+                    item = self.queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        item = await asyncio.wait_for(self.queue.get(), timeout)
+                    except asyncio.TimeoutError:
+                        break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            self.room_freed.set()
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch):
+        """Write one batch, retrying failed attempts with backoff"""
+        events = [event for _, event in batch]
+        for attempt in range(self.max_retries + 1):
+            try:
+                await self._write(events)
+                self.written += len(events)
+                self.flushes += 1
+                await self._unstage(batch)
+                return
+            except PyMongoError as e:
+                if attempt == self.max_retries:
+                    print(f"Leaving {len(events)} watch events staged after {attempt + 1} attempts: {e}")
+                    self.left_staged += len(events)
+                    # Their staging documents stay for recovery, even if
+                    # the rest of their events get written
+                    for staged_id, _ in batch:
+                        self.staged.pop(staged_id, None)
+                    return
+                self.retries += 1
+                await asyncio.sleep(self.retry_backoff * 2 ** attempt)
+
+    async def _unstage(self, batch):
+        """Delete the staging documents whose events are now all written"""
+        done = []
+        for staged_id, count in Counter(staged_id for staged_id, _ in batch).items():
+            if staged_id in self.staged:
+                self.staged[staged_id] -= count
+                if not self.staged[staged_id]:
+                    del self.staged[staged_id]
+                    done.append(staged_id)
+        if done:
+            try:
+                await self.db[STAGING].delete_many({"_id": {"$in": done}})
+            except PyMongoError as e:
+                # Recovery finds their events written and deletes them then
+                print(f"Staged watch events written but not deleted: {e}")
+
+    async def _write(self, batch):
+        try:
+            # Why unordered? The server keeps going past a bad document and
+            # can apply the inserts in parallel
+            await self.db.watch_history.insert_many(batch, ordered=False)
+        except BulkWriteError as e:
+            # insert_many sets each event's _id, so on a retry the events that
+            # already made it fail as duplicates; those count as written
+            if any(error['code'] != DUPLICATE_KEY for error in e.details['writeErrors']):
+                raise
+        # Trending buckets, popularity and cached reads are updated by the
+        # view worker (see views.py)
+
+    async def _recover_regularly(self):
+        while True:
+            try:
+                await self.recover()
+            except PyMongoError as e:
+                print(f"Recovering staged watch events failed, retrying: {e}")
+            await asyncio.sleep(self.recover_interval)
+
+    async def recover(self):
+        """Write the events of left-over staging documents, return how many were missing"""
+        cutoff = datetime.now() - self.recover_after
+        recovered = 0
+        async for staged in self.db[STAGING].find({"received_at": {"$lt": cutoff}}):
+            events = staged['events']
+            # Why look them up? Their batch may have been written right
+            # before the crash, and a second copy would be counted twice
+            written = set()
+            cursor = self.db.watch_history.find(
+                {"user_id": {"$in": list({event['user_id'] for event in events})},
+                 "timestamp": {"$in": list({event['timestamp'] for event in events})}},
+                {"_id": 0, "user_id": 1, "movie_id": 1, "timestamp": 1}
+            )
+            async for event in cursor:
+                written.add(event_key(event))
+            missing = [event for event in events if event_key(event) not in written]
+            if missing:
+                await self._write(missing)
+            await self.db[STAGING].delete_one({"_id": staged['_id']})
+            recovered += len(missing)
+        if recovered:
+            print(f"Recovered {recovered} staged watch events")
+        self.recovered += recovered
+        return recovered
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "queue_max": self.queue_max,
+            "full_policy": self.full_policy,
+            "accepted": self.accepted,
+            "written": self.written,
+            "dropped": self.dropped,
+            "rejected": self.rejected,
+            "retries": self.retries,
+            "flushes": self.flushes,
+            "staged_requests": len(self.staged),
+            "left_staged": self.left_staged,
+            "recovered": self.recovered
+        }
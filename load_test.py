@@ -0,0 +1,102 @@
+"""
+Load test for the running API
+
+Sends requests to every endpoint from 1, 16 and 128 concurrent clients and
+prints throughput plus p50/p99 latency for each concurrency level.
+
+Usage:
+    uvicorn app:app            # in another terminal
+    python load_test.py [--url http://localhost:8000] [--requests 2000]
+
+Why several concurrency levels? If the event loop is blocked, throughput
+stays flat no matter how many clients we add
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+import httpx
+
+from database import get_db
+
+CONCURRENCY_LEVELS = [1, 16, 128]
+
+
+def build_paths():
+    """Pick real ids from the database so history/reviews don't 404"""
+    db = get_db()
+    user_ids = [str(u['_id']) for u in db.users.find({}, {"_id": 1}).limit(100)]
+    movie_ids = [str(m['_id']) for m in db.movies.find({}, {"_id": 1}).limit(100)]
+    queries = ["nolan", "godfather", "tom hanks", "drama", "matrix"]
+
+    paths = ["/movies/top-watched"]
+    paths += [f"/users/{user_id}/history" for user_id in user_ids]
+    paths += [f"/movies/{movie_id}/reviews" for movie_id in movie_ids]
+    paths += [f"/movies/search?query={query}" for query in queries]
+    return paths
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a sorted list"""
+    index = max(0, int(round(pct / 100 * len(values))) - 1)
+    return values[index]
+
+
+async def worker(client, paths, remaining, latencies, errors):
+    """One simulated client: send requests until the shared budget runs out"""
+    while remaining[0] > 0:
+        remaining[0] -= 1
+        path = random.choice(paths)
+        start = time.perf_counter()
+        try:
+            response = await client.get(path)
+            if response.status_code >= 500:
+                errors[0] += 1
+        except httpx.HTTPError:
+            errors[0] += 1
+        latencies.append((time.perf_counter() - start) * 1000)
+
+
+async def run_level(url, paths, concurrency, total_requests):
+    """Run one concurrency level and return its stats"""
+    latencies = []
+    errors = [0]
+    remaining = [total_requests]
+    limits = httpx.Limits(max_connections=concurrency)
+
+    async with httpx.AsyncClient(base_url=url, limits=limits, timeout=30) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*[
+            worker(client, paths, remaining, latencies, errors)
+            for _ in range(concurrency)
+        ])
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": len(latencies),
+        "errors": errors[0],
+        "throughput": len(latencies) / elapsed,
+        "p50": statistics.median(latencies),
+        "p99": percentile(latencies, 99)
+    }
+
+
+async def main(args):
+    paths = build_paths()
+    print(f"{'clients':>8} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p99 ms':>9}")
+    for concurrency in args.concurrency:
+        stats = await run_level(args.url, paths, concurrency, args.requests)
+        print(f"{stats['concurrency']:>8} {stats['requests']:>9} {stats['errors']:>7} "
+              f"{stats['throughput']:>9.1f} {stats['p50']:>9.1f} {stats['p99']:>9.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load test the movie streaming API")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--requests", type=int, default=2000, help="Requests per concurrency level")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=CONCURRENCY_LEVELS)
+    asyncio.run(main(parser.parse_args()))
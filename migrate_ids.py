@@ -0,0 +1,120 @@
+"""
+One-shot migration: string ids -> ObjectId
+
+Older data stored user_id and movie_id in watch_history and reviews as
+strings, so the $lookup against users._id / movies._id (ObjectIds) never
+matched. This script rewrites them in bulk batches and then rebuilds the
+materialized views (trending buckets, watch counts, ratings), which were
+keyed on the old string ids.
+
+Usage:
+    python migrate_ids.py [--batch-size 1000] [--verify]
+
+Safe to run more than once: only string ids are touched.
+"""
+import argparse
+
+from bson import ObjectId
+from pymongo import UpdateOne
+
+from database import get_db
+from views import rebuild_views
+
+# Collections and the id fields that reference another collection's _id
+ID_FIELDS = {
+    "watch_history": ["user_id", "movie_id"],
+    "reviews": ["user_id", "movie_id"]
+}
+
+
+def migrate_collection(collection, fields, batch_size):
+    """Convert string ids to ObjectId, return (updated, skipped) counts"""
+    # Only documents that still have at least one string id
+    query = {"$or": [{field: {"$type": "string"}} for field in fields]}
+    projection = {field: 1 for field in fields}
+
+    updated = 0
+    skipped = 0
+    batch = []
+    for doc in collection.find(query, projection):
+        changes = {}
+        for field in fields:
+            value = doc.get(field)
+            if isinstance(value, str):
+                if ObjectId.is_valid(value):
+                    changes[field] = ObjectId(value)
+                else:
+                    skipped += 1  # Not an id at all, leave it for a human to look at
+        if changes:
+            batch.append(UpdateOne({"_id": doc['_id']}, {"$set": changes}))
+
+        # Why batches? One round trip per 1000 documents instead of per document
+        if len(batch) >= batch_size:
+            updated += collection.bulk_write(batch, ordered=False).modified_count
+            batch = []
+
+    if batch:
+        updated += collection.bulk_write(batch, ordered=False).modified_count
+    return updated, skipped
+
+
+def verify(db):
+    """
+    Check that joins return results after the migration
+    Returns True when a user's history and a movie's reviews both join
+    """
+    ok = True
+    checks = [
+        ("watch_history", "user_id", "movies", "movie_id"),
+        ("reviews", "movie_id", "users", "user_id")
+    ]
+    for collection_name, group_field, join_from, join_field in checks:
+        sample = db[collection_name].find_one({}, {group_field: 1})
+        if not sample:
+            print(f"  {collection_name}: empty, nothing to verify")
+            continue
+
+        raw_count = db[collection_name].count_documents({group_field: sample[group_field]})
+        joined = list(db[collection_name].aggregate([
+            {"$match": {group_field: sample[group_field]}},
+            {"$lookup": {
+                "from": join_from,
+                "localField": join_field,
+                "foreignField": "_id",
+                "as": "joined"
+            }},
+            {"$unwind": "$joined"},
+            {"$count": "joined"}
+        ]))
+        joined_count = joined[0]['joined'] if joined else 0
+
+        status = "OK" if joined_count == raw_count else "MISMATCH"
+        if joined_count != raw_count:
+            ok = False
+        print(f"  {collection_name} -> {join_from}: {joined_count}/{raw_count} joined [{status}]")
+    return ok
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert string user_id/movie_id values to ObjectId")
+    parser.add_argument("--batch-size", type=int, default=1000)
+    parser.add_argument("--verify", action="store_true", help="Check that $lookup joins return results")
+    args = parser.parse_args()
+
+    db = get_db()
+    for collection_name, fields in ID_FIELDS.items():
+        updated, skipped = migrate_collection(db[collection_name], fields, args.batch_size)
+        print(f"{collection_name}: {updated} documents updated, {skipped} invalid ids skipped")
+
+    print("Rebuilding materialized views...")
+    rebuild_views(db)
+    print("Migration finished!")
+
+    if args.verify:
+        print("Verifying joins...")
+        if not verify(db):
+            raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
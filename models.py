@@ -1,9 +1,40 @@
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, PlainSerializer, PlainValidator, WithJsonSchema
+from typing import Annotated, Dict, List, Optional
 from datetime import datetime
+from bson import ObjectId
 
 # Why Pydantic models? FastAPI uses them to validate data automatically
 
+# Most ids one batch request may ask for (a page of the UI grid is 50)
+MAX_BATCH_IDS = 100
+
+
+def validate_object_id(value):
+    """Accept an ObjectId or its 24-character hex string"""
+    if isinstance(value, ObjectId):
+        return value
+    if isinstance(value, str) and ObjectId.is_valid(value):
+        return ObjectId(value)
+    raise ValueError(f"Invalid ObjectId: {value!r}")
+
+
+# A 24-character hex ObjectId, e.g. for ids in URL paths
+# Why check the text? A malformed id is a client error, not a failed lookup
+OBJECT_ID_PATTERN = "^[0-9a-fA-F]{24}$"
+
+
+# Typed reference to another document's _id
+# Why ObjectId and not str? $lookup compares values exactly, so user_id and
+# movie_id must have the same type as the _id they point to, otherwise the
+# join matches nothing and can't use the _id index.
+# In JSON it is still a plain string.
+PyObjectId = Annotated[
+    ObjectId,
+    PlainValidator(validate_object_id),
+    PlainSerializer(lambda value: str(value), return_type=str, when_used='json'),
+    WithJsonSchema({"type": "string", "example": "65a1b2c3d4e5f6a7b8c9d0e1"})
+]
+
 class Movie(BaseModel):
     """Movie data structure"""
     title: str
@@ -11,7 +42,13 @@ class Movie(BaseModel):
     genres: List[str]  # List because movie can have multiple genres
     cast: List[str]    # List of actor names
     director: str
-    rating: float      # Average rating like 4.5 out of 5
+    rating: float      # Seed rating like 4.5 out of 5, used until users review it
+    # Running review aggregates, updated on every new review (see ratings.py)
+    review_count: int = 0
+    rating_sum: float = 0
+    rating_histogram: Dict[str, int] = {}  # "1".."5" stars -> number of reviews
+    # All-time number of watches, kept current by the view worker (see views.py)
+    watch_count: int = 0
 
 class User(BaseModel):
     """User data structure"""
@@ -21,15 +58,27 @@ class User(BaseModel):
 
 class WatchHistory(BaseModel):
     """Track what users watched"""
-    user_id: str
-    movie_id: str
+    user_id: PyObjectId   # users._id
+    movie_id: PyObjectId  # movies._id
     timestamp: datetime
     watch_duration: int  # in minutes
 
 class Review(BaseModel):
     """User reviews for movies"""
-    user_id: str
-    movie_id: str
+    user_id: PyObjectId   # users._id
+    movie_id: PyObjectId  # movies._id
     rating: float       # User's rating 1-5
     review_text: str
-    timestamp: datetime
\ No newline at end of file
+    timestamp: datetime
+
+class NewReview(BaseModel):
+    """Body of POST /movies/{movie_id}/reviews"""
+    user_id: PyObjectId
+    rating: float = Field(..., ge=1, le=5)
+    review_text: str
+
+class MovieIds(BaseModel):
+    """Body of the POST /movies/...batch endpoints"""
+    # Why str and not PyObjectId? A malformed id gets a not-found entry
+    # like a missing one, instead of failing the whole batch
+    ids: List[str] = Field(..., min_length=1, max_length=MAX_BATCH_IDS)
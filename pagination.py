@@ -0,0 +1,85 @@
+import base64
+from datetime import datetime
+
+from bson import ObjectId
+from bson.errors import InvalidId
+
+from serialization import dumps
+
+# Keyset (cursor) pagination helpers
+# Why keyset instead of skip/limit? skip still walks every skipped document,
+# while "continue after (timestamp, _id)" jumps straight there using the index
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+def encode_cursor(timestamp, doc_id):
+    """Turn the (timestamp, _id) of the last document into an opaque string"""
+    raw = f"{timestamp.isoformat()}|{doc_id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(after):
+    """
+    Turn an 'after' string back into (timestamp, ObjectId)
+    Raises ValueError if the cursor was not produced by encode_cursor
+    """
+    try:
+        raw = base64.urlsafe_b64decode(after.encode()).decode()
+        timestamp, doc_id = raw.split("|")
+        return datetime.fromisoformat(timestamp), ObjectId(doc_id)
+    except (ValueError, InvalidId, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {after}") from e
+
+
+def keyset_stages(match, after=None, limit=None):
+    """
+    Build the $match/$sort/$limit stages for one page, newest first
+    Why sort on _id too? Two events can share a timestamp, _id breaks the tie
+    """
+    if after:
+        timestamp, doc_id = decode_cursor(after)
+        match = {
+            **match,
+            "$or": [
+                {"timestamp": {"$lt": timestamp}},
+                {"timestamp": timestamp, "_id": {"$lt": doc_id}}
+            ]
+        }
+
+    stages = [
+        {"$match": match},
+        {"$sort": {"timestamp": -1, "_id": -1}}
+    ]
+    if limit:
+        # Why limit + 1? The extra document tells us if there is a next page
+        stages.append({"$limit": limit + 1})
+    return stages
+
+
+def next_page(docs, limit, time_field, joined_field=None):
+    """
+    Trim the extra look-ahead document and return (page, next cursor)
+    joined_field: missing when the $lookup found nothing (e.g. a deleted
+    movie); those documents are dropped only after the cursor is taken
+    Why after? The page may come out shorter, but "is there a next page"
+    and where it starts still depend on the events alone
+    """
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor(last[time_field], last['_id'])
+    if joined_field:
+        docs = [doc for doc in docs if joined_field in doc]
+    return docs, next_cursor
+
+
+async def ndjson_stream(cursor):
+    """
+    Yield one JSON line per document as the cursor produces them
+    Why stream? Memory stays at one batch no matter how many documents match
+    """
+    async for doc in cursor:
+        yield dumps(doc) + b"\n"
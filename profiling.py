@@ -0,0 +1,303 @@
+"""
+Request profiling and slow-query instrumentation
+
+For every request we record where the time went:
+
+- db         time spent in MongoDB commands, and how many round trips
+- handler    the endpoint function (includes waiting for the database)
+- scoring, encode, ...    named sections inside handlers (see phase())
+- serialize  validating and JSON-encoding the response after the handler
+- total      the whole request
+
+The numbers go back to the client as a Server-Timing header (shown in the
+browser's network tab) and into Prometheus histograms on /metrics.
+
+MongoDB commands are counted by a pymongo CommandListener. Motor runs
+commands in worker threads but copies the request's context into them, so
+the listener finds the request's profile through a ContextVar.
+
+Any aggregation slower than PROFILE_SLOW_AGGREGATION_MS gets its query plan
+logged (explain, queryPlanner verbosity, so the query isn't run again).
+Collection scans show up there as COLLSCAN.
+"""
+import functools
+import json
+import os
+import threading
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from fastapi.routing import APIRoute
+from pymongo import monitoring
+
+PROFILING_ENABLED = os.environ.get('PROFILING_ENABLED', '1') == '1'
+PROFILE_SLOW_AGGREGATION_MS = float(os.environ.get('PROFILE_SLOW_AGGREGATION_MS', 100))
+# Explain the same slow pipeline shape at most once per interval
+PROFILE_EXPLAIN_INTERVAL_S = float(os.environ.get('PROFILE_EXPLAIN_INTERVAL_S', 300))
+
+# Histogram buckets (Prometheus "le" upper bounds)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+ROUND_TRIP_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100)
+
+
+class Histogram:
+    """Minimal Prometheus histogram with labels (safe to use from threads)"""
+
+    def __init__(self, name, description, label_names, buckets):
+        self.name = name
+        self.description = description
+        self.label_names = label_names
+        self.buckets = buckets
+        # label values -> [count per bucket..., sum, count]
+        self.series = defaultdict(lambda: [0] * (len(buckets) + 2))
+        self.lock = threading.Lock()
+
+    def observe(self, value, *label_values):
+        with self.lock:
+            series = self.series[label_values]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += value
+            series[-1] += 1
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.description}", f"# TYPE {self.name} histogram"]
+        with self.lock:
+            series = {labels: list(values) for labels, values in self.series.items()}
+        for label_values, values in sorted(series.items()):
+            labels = ",".join(f'{name}="{value}"' for name, value in zip(self.label_names, label_values))
+            prefix = labels + "," if labels else ""
+            for bound, count in zip(self.buckets, values):
+                lines.append(f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{prefix}le="+Inf"}} {values[-1]}')
+            lines.append(f"{self.name}_sum{{{labels}}} {values[-2]}")
+            lines.append(f"{self.name}_count{{{labels}}} {values[-1]}")
+        return "\n".join(lines)
+
+
+request_seconds = Histogram(
+    "http_request_duration_seconds", "Time to serve a request",
+    ("method", "route", "status"), SECONDS_BUCKETS)
+phase_seconds = Histogram(
+    "http_request_phase_seconds", "Time spent per request phase",
+    ("route", "phase"), SECONDS_BUCKETS)
+round_trips = Histogram(
+    "http_request_db_round_trips", "MongoDB commands sent per request",
+    ("route",), ROUND_TRIP_BUCKETS)
+command_seconds = Histogram(
+    "mongodb_command_duration_seconds", "Time per MongoDB command",
+    ("command",), SECONDS_BUCKETS)
+METRICS = [request_seconds, phase_seconds, round_trips, command_seconds]
+
+
+def render_metrics():
+    """All metrics in the Prometheus text format"""
+    lines = [metric.render() for metric in METRICS]
+    lines.append("# HELP mongodb_slow_aggregations_total Aggregations slower than PROFILE_SLOW_AGGREGATION_MS")
+    lines.append("# TYPE mongodb_slow_aggregations_total counter")
+    lines.append(f"mongodb_slow_aggregations_total {command_profiler.slow_aggregations}")
+    return "\n".join(lines) + "\n"
+
+
+class RequestProfile:
+    """Timings of one request"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.route = "unmatched"
+        self.phases = defaultdict(float)
+        self.db_round_trips = 0
+        self.lock = threading.Lock()
+
+    def add(self, phase_name, seconds):
+        # Why a lock? Concurrent queries of one request finish in different threads
+        with self.lock:
+            self.phases[phase_name] += seconds
+
+    def count_command(self, seconds):
+        with self.lock:
+            self.db_round_trips += 1
+            self.phases["db"] += seconds
+
+    def server_timing(self):
+        """Server-Timing header value, durations in milliseconds"""
+        entries = [
+            f'db;dur={self.phases.get("db", 0) * 1000:.2f};desc="{self.db_round_trips} round trips"'
+        ]
+        for name, seconds in self.phases.items():
+            if name != "db":
+                entries.append(f"{name};dur={seconds * 1000:.2f}")
+        entries.append(f"total;dur={(time.perf_counter() - self.start) * 1000:.2f}")
+        return ", ".join(entries)
+
+
+current_profile = ContextVar("current_profile", default=None)
+
+
+@contextmanager
+def phase(name):
+    """Time a section of a handler: `with phase("scoring"): ...`"""
+    profile = current_profile.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start)
+
+
+class CommandProfiler(monitoring.CommandListener):
+    """
+    Counts MongoDB round trips per request, times every command and explains
+    slow aggregations
+    Why not explain inside the listener? Listeners must not do I/O, so plans
+    are fetched on a separate thread with `explain_client`
+    """
+
+    def __init__(self):
+        self.explain_client = None
+        self.pending = {}           # request_id -> aggregate command, until it finishes
+        self.last_explained = {}    # pipeline shape -> time of last explain
+        self.slow_aggregations = 0
+        self.explainer = ThreadPoolExecutor(max_workers=1)
+        self.lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name == "aggregate":
+            with self.lock:
+                self.pending[event.request_id] = (event.database_name, event.command)
+
+    def succeeded(self, event):
+        self._finished(event)
+
+    def failed(self, event):
+        self._finished(event)
+
+    def _finished(self, event):
+        seconds = event.duration_micros / 1e6
+        profile = current_profile.get()
+        if profile is not None:
+            profile.count_command(seconds)
+
+        command = None
+        if event.command_name == "aggregate":
+            with self.lock:
+                command = self.pending.pop(event.request_id, None)
+        command_seconds.observe(seconds, event.command_name)
+        if command and seconds * 1000 >= PROFILE_SLOW_AGGREGATION_MS:
+            self._explain_later(seconds, *command)
+
+    def _explain_later(self, seconds, database_name, command):
+        # Same collection + stage names = same shape, whatever the values
+        shape = (command["aggregate"], tuple(next(iter(stage)) for stage in command.get("pipeline", [])))
+        now = time.monotonic()
+        with self.lock:
+            self.slow_aggregations += 1
+            if now - self.last_explained.get(shape, -PROFILE_EXPLAIN_INTERVAL_S) < PROFILE_EXPLAIN_INTERVAL_S:
+                return
+            self.last_explained[shape] = now
+        if self.explain_client is not None:
+            self.explainer.submit(self._explain, seconds, database_name, command)
+
+    def _explain(self, seconds, database_name, command):
+        try:
+            plan = self.explain_client[database_name].command(
+                "explain",
+                {"aggregate": command["aggregate"], "pipeline": command["pipeline"], "cursor": {}},
+                verbosity="queryPlanner"
+            )
+        except Exception as e:
+            print(f"Slow aggregation on {command['aggregate']} ({seconds * 1000:.0f} ms), explain failed: {e}")
+            return
+        stages = sorted(plan_stages(plan))
+        print(f"Slow aggregation on {command['aggregate']} ({seconds * 1000:.0f} ms), "
+              f"plan stages: {', '.join(stages)}")
+        print(json.dumps({"pipeline": command["pipeline"], "plan": plan}, default=str))
+
+
+def plan_stages(plan):
+    """Every "stage" name in an explain output (COLLSCAN, IXSCAN, FETCH, ...)"""
+    stages = set()
+    if isinstance(plan, dict):
+        for key, value in plan.items():
+            if key == "stage" and isinstance(value, str):
+                stages.add(value)
+            else:
+                stages |= plan_stages(value)
+    elif isinstance(plan, list):
+        for item in plan:
+            stages |= plan_stages(item)
+    return stages
+
+
+# Shared listener, passed to the MongoDB clients in database.py
+command_profiler = CommandProfiler()
+
+
+class ProfiledRoute(APIRoute):
+    """
+    Route that times its endpoint ("handler") and everything after it
+    ("serialize": response validation + JSON encoding)
+    """
+
+    def __init__(self, path, endpoint, **kwargs):
+        # Why wraps? FastAPI reads the parameters from the original signature
+        @functools.wraps(endpoint)
+        async def timed_endpoint(*args, **kwargs):
+            with phase("handler"):
+                return await endpoint(*args, **kwargs)
+        super().__init__(path, timed_endpoint, **kwargs)
+
+    def get_route_handler(self):
+        handler = super().get_route_handler()
+
+        async def profiled_handler(request):
+            profile = current_profile.get()
+            if profile is None:
+                return await handler(request)
+            profile.route = self.path
+            start = time.perf_counter()
+            response = await handler(request)
+            profile.add("serialize", time.perf_counter() - start - profile.phases.get("handler", 0))
+            return response
+        return profiled_handler
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: one RequestProfile per request, Server-Timing header, metrics"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not PROFILING_ENABLED:
+            return await self.app(scope, receive, send)
+
+        profile = RequestProfile()
+        token = current_profile.set(profile)
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", profile.server_timing().encode()))
+                message = dict(message, headers=headers)
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            current_profile.reset(token)
+            total = time.perf_counter() - profile.start
+            request_seconds.observe(total, scope["method"], profile.route, str(status))
+            round_trips.observe(profile.db_round_trips, profile.route)
+            for name, seconds in list(profile.phases.items()):
+                phase_seconds.observe(seconds, profile.route, name)
@@ -0,0 +1,102 @@
+"""
+Running review aggregates stored on each movie document
+
+    {"review_count": 12, "rating_sum": 51.3,
+     "rating_histogram": {"1": 0, "2": 1, "3": 2, "4": 5, "5": 4}}
+
+They are updated with one atomic $inc whenever a review is inserted, so the
+average rating is rating_sum / review_count, with no scan of the reviews
+collection.
+
+Usage (recompute from existing reviews):
+    python ratings.py --rebuild
+"""
+import argparse
+from collections import defaultdict
+
+from pymongo import UpdateOne
+
+
+def star_bucket(rating):
+    """Histogram bucket of a rating: nearest whole star, 1-5"""
+    return str(min(5, max(1, int(rating + 0.5))))
+
+
+def review_stats_update(ratings):
+    """
+    Build the $inc update that adds one or more ratings to a movie's aggregates
+    Why $inc? It is atomic on the document, so concurrent reviews never lose
+    each other's counts
+    """
+    inc = {"review_count": len(ratings), "rating_sum": sum(ratings)}
+    for rating in ratings:
+        key = f"rating_histogram.{star_bucket(rating)}"
+        inc[key] = inc.get(key, 0) + 1
+    return {"$inc": inc}
+
+
+def review_stats_updates(reviews):
+    """Group a batch of reviews into one UpdateOne per movie"""
+    ratings_by_movie = defaultdict(list)
+    for review in reviews:
+        ratings_by_movie[review['movie_id']].append(review['rating'])
+    return [
+        UpdateOne({"_id": movie_id}, review_stats_update(ratings))
+        for movie_id, ratings in ratings_by_movie.items()
+    ]
+
+
+def average_rating(movie):
+    """Average user rating of a movie document, 0 when nobody reviewed it"""
+    count = movie.get('review_count', 0)
+    return movie.get('rating_sum', 0) / count if count else 0
+
+
+def effective_rating(movie):
+    """
+    Rating used for ranking: real user average once reviews exist,
+    otherwise the catalog's seed rating
+    """
+    if movie.get('review_count', 0):
+        return average_rating(movie)
+    return movie.get('rating', 0)
+
+
+def rebuild_review_stats(db):
+    """Recompute every movie's aggregates from the reviews collection"""
+    db.movies.update_many({}, {"$set": {"review_count": 0, "rating_sum": 0, "rating_histogram": {}}})
+
+    # Same grouping as ingest, but fed from a server-side $group
+    per_bucket = db.reviews.aggregate([
+        {"$group": {
+            "_id": {"movie_id": "$movie_id", "stars": {"$floor": {"$add": ["$rating", 0.5]}}},
+            "count": {"$sum": 1},
+            "rating_sum": {"$sum": "$rating"}
+        }}
+    ])
+    operations = []
+    for row in per_bucket:
+        bucket = star_bucket(row['_id']['stars'])
+        operations.append(UpdateOne(
+            {"_id": row['_id']['movie_id']},
+            {"$inc": {
+                "review_count": row['count'],
+                "rating_sum": row['rating_sum'],
+                f"rating_histogram.{bucket}": row['count']
+            }}
+        ))
+    if operations:
+        db.movies.bulk_write(operations, ordered=False)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain per-movie review aggregates")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute aggregates from reviews")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        from database import get_db
+        rebuild_review_stats(get_db())
+        print("Movie review aggregates rebuilt!")
+    else:
+        parser.print_help()
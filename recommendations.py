@@ -0,0 +1,377 @@
+"""
+Item-item recommendations from co-watch counts
+
+Two movies are similar when the same users watch both. A background job
+counts, for every pair of movies, how many users watched both, turns the
+counts into cosine similarities and keeps each movie's closest neighbors:
+
+    similarity(a, b) = co_watches(a, b) / sqrt(watches(a) * watches(b))
+
+The result is a sparse matrix in CSR form (row = movie, columns = its
+neighbors), saved as plain .npy files in one directory per build:
+
+    CURRENT                 name of the build in use, e.g. 20240501T120000.000000-4242
+    <build>/indptr.npy      int64  row i's neighbors are at indptr[i]:indptr[i + 1]
+    <build>/indices.npy     int32  neighbor row numbers
+    <build>/data.npy        float32 similarities
+    <build>/movie_ids.npy   uint8   12 ObjectId bytes per row
+    <build>/meta.json
+
+A new build is written to its own directory, then CURRENT is replaced in
+one atomic rename. Readers resolve CURRENT once and open every file from
+that directory, so they never mix the arrays of two builds.
+
+The API memory-maps these files, so loading is instant and several workers
+share one copy through the page cache. A recommendation is a sparse dot
+product: the user's recent movies (weighted by recency) times the matrix.
+No aggregation runs against MongoDB per request.
+
+Usage:
+    python recommendations.py --build [--path recommendations_model]
+"""
+import argparse
+import asyncio
+import json
+import os
+import shutil
+import time
+from collections import namedtuple
+from datetime import datetime
+
+import numpy as np
+from bson import ObjectId
+from starlette.concurrency import run_in_threadpool
+
+from scoring import top_page
+
+RECOMMENDATIONS_PATH = os.environ.get('RECOMMENDATIONS_PATH', 'recommendations_model')
+# Rebuild the model inside the API every N minutes (0 = only via the CLI)
+RECOMMENDATIONS_REBUILD_MINUTES = float(os.environ.get('RECOMMENDATIONS_REBUILD_MINUTES', 0))
+
+# Neighbors kept per movie
+# Why a cap? Bounds both the file size and the work per request
+MAX_NEIGHBORS = 100
+# Most recent distinct movies per user used to build the model
+# Why a cap? Pairs grow with the square of a user's history
+MAX_USER_HISTORY = 50
+# Pairs watched together by fewer users are treated as noise
+MIN_CO_WATCHES = 1
+# Pairs buffered before they are merged into the running counts
+PAIR_CHUNK = 20_000_000
+
+# File naming the build in use, inside the model path
+CURRENT = "CURRENT"
+# Builds kept on disk, the current one included
+# Why more than one? A reader that resolved CURRENT just before a swap may
+# still be opening the previous build's files
+KEEP_BUILDS = 2
+
+# Recent watch events used to score one user
+RECENT_HISTORY = 50
+# A movie watched this many events ago counts half as much as the latest one
+HISTORY_HALF_LIFE = 10
+DEFAULT_RECOMMENDATIONS = 10
+MAX_RECOMMENDATIONS = 100
+
+
+# ----- Building (background job) -----
+
+def pair_keys(rows, movie_count):
+    """
+    Every pair of one user's movies (distinct row numbers)
+    A pair (a, b) with a < b is stored as the single key a * movie_count + b
+    """
+    rows = np.sort(np.asarray(rows, dtype=np.int64))
+    first, second = np.triu_indices(len(rows), 1)
+    return rows[first] * movie_count + rows[second]
+
+
+def merge_pairs(buffer, merged):
+    """Fold buffered pair keys into the running (unique keys, counts)"""
+    keys = np.concatenate([merged[0]] + buffer)
+    weights = np.concatenate([merged[1], np.ones(len(keys) - len(merged[0]))])
+    unique, inverse = np.unique(keys, return_inverse=True)
+    return unique, np.bincount(inverse, weights=weights)
+
+
+def build_model(db, max_neighbors=MAX_NEIGHBORS, max_history=MAX_USER_HISTORY,
+                min_co_watches=MIN_CO_WATCHES):
+    """
+    Compute the CSR similarity matrix from watch_history, return its arrays
+    Only the hot window is read: archived months (see archive.py) are old taste
+    """
+    movie_ids = [movie['_id'] for movie in db.movies.find({}, {"_id": 1}).sort("_id", 1)]
+    rows = {movie_id: row for row, movie_id in enumerate(movie_ids)}
+    movie_count = len(movie_ids)
+
+    watches = np.zeros(movie_count, dtype=np.int64)
+    buffer = []
+    buffered = 0
+    merged = (np.empty(0, dtype=np.int64), np.empty(0))
+    users = 0
+
+    def add_user(history):
+        nonlocal buffer, buffered, merged, users
+        # Keep the user's most recent distinct movies
+        history.sort(reverse=True)
+        recent = []
+        seen = set()
+        for _, row in history:
+            if row not in seen:
+                seen.add(row)
+                recent.append(row)
+                if len(recent) == max_history:
+                    break
+        watches[recent] += 1
+        users += 1
+        if len(recent) < 2:
+            return
+        keys = pair_keys(recent, movie_count)
+        buffer.append(keys)
+        buffered += len(keys)
+        if buffered >= PAIR_CHUNK:
+            merged = merge_pairs(buffer, merged)
+            buffer, buffered = [], 0
+
+    # Why sort by user_id? Uses the user_id index and streams one user at a
+    # time, so only the pair counts are held in memory
+    current_user, history = None, []
+    cursor = db.watch_history.find({}, {"_id": 0, "user_id": 1, "movie_id": 1, "timestamp": 1})
+    for event in cursor.sort("user_id", 1).batch_size(10000):
+        row = rows.get(event['movie_id'])
+        if row is None:
+            continue
+        if event['user_id'] != current_user and history:
+            add_user(history)
+            history = []
+        current_user = event['user_id']
+        history.append((event['timestamp'], row))
+    if history:
+        add_user(history)
+    keys, counts = merge_pairs(buffer, merged)
+
+    # Cosine similarity of each pair, mirrored so both movies list the other
+    keep = counts >= min_co_watches
+    keys, counts = keys[keep], counts[keep]
+    first, second = keys // movie_count, keys % movie_count
+    similarity = (counts / np.sqrt(watches[first] * watches[second])).astype(np.float32)
+    sources = np.concatenate([first, second])
+    targets = np.concatenate([second, first])
+    similarity = np.concatenate([similarity, similarity])
+
+    # Keep each movie's max_neighbors most similar movies
+    order = np.lexsort((-similarity, sources))
+    sources, targets, similarity = sources[order], targets[order], similarity[order]
+    rank = np.arange(len(sources)) - np.searchsorted(sources, sources)
+    keep = rank < max_neighbors
+    sources, targets, similarity = sources[keep], targets[keep], similarity[keep]
+
+    indptr = np.zeros(movie_count + 1, dtype=np.int64)
+    np.cumsum(np.bincount(sources, minlength=movie_count), out=indptr[1:])
+    return {
+        "indptr": indptr,
+        "indices": targets.astype(np.int32),
+        "data": similarity,
+        "movie_ids": np.frombuffer(b"".join(movie_id.binary for movie_id in movie_ids),
+                                   dtype=np.uint8).reshape(movie_count, 12),
+        "meta": {"built_at": datetime.now().isoformat(timespec="seconds"),
+                 "movies": movie_count, "users": users, "pairs": int(len(keys))}
+    }
+
+
+def current_build(path):
+    """Directory of the build in use, None when none was saved yet"""
+    try:
+        with open(os.path.join(path, CURRENT)) as f:
+            build = f.read().strip()
+    except FileNotFoundError:
+        return None
+    return os.path.join(path, build)
+
+
+def save_model(model, path=RECOMMENDATIONS_PATH):
+    """
+    Write the model as a new build, then point CURRENT at it in one step
+    Why a directory per build? The API never maps half-written files, and
+    the files of the build it resolved stay in place while it opens them
+    """
+    # Sortable by time, so the oldest builds are the first names
+    build = f"{datetime.now():%Y%m%dT%H%M%S.%f}-{os.getpid()}"
+    directory = os.path.join(path, build)
+    os.makedirs(directory)
+    for name in ["indptr", "indices", "data", "movie_ids"]:
+        np.save(os.path.join(directory, f"{name}.npy"), model[name])
+    with open(os.path.join(directory, "meta.json"), "w") as f:
+        json.dump(model["meta"], f)
+
+    # Why os.replace? Renaming over CURRENT is atomic: readers see the old
+    # name or the new one, never no file
+    pointer = os.path.join(path, f"{CURRENT}.{build}")
+    with open(pointer, "w") as f:
+        f.write(build)
+    os.replace(pointer, os.path.join(path, CURRENT))
+
+    # Why delete instead of overwriting? Workers that still map old files
+    # keep reading them; a deleted file lives on until unmapped
+    builds = sorted(entry.name for entry in os.scandir(path) if entry.is_dir())
+    for old in builds[:-KEEP_BUILDS]:
+        if old != build:
+            shutil.rmtree(os.path.join(path, old), ignore_errors=True)
+
+
+# ----- Serving -----
+
+# One mapped model; never changed once loaded, a new one replaces it whole
+CoWatchModel = namedtuple("CoWatchModel", ["indptr", "indices", "data", "movie_ids", "rows", "meta", "build"])
+
+
+class Recommender:
+    """Memory-mapped co-watch model + per-user scoring"""
+
+    def __init__(self, path=RECOMMENDATIONS_PATH):
+        self.path = path
+        self.model = None
+        self.task = None
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    @property
+    def meta(self):
+        return self.model.meta if self.model is not None else {}
+
+    def load(self):
+        """Map the current build's files (no-op when none was built yet)"""
+        # Resolved once: every file below comes from this one build
+        directory = current_build(self.path)
+        if directory is None:
+            return False
+        arrays = {
+            name: np.load(os.path.join(directory, f"{name}.npy"), mmap_mode="r")
+            for name in ["indptr", "indices", "data", "movie_ids"]
+        }
+        raw = arrays["movie_ids"].tobytes()
+        movie_ids = [ObjectId(raw[offset:offset + 12]) for offset in range(0, len(raw), 12)]
+        with open(os.path.join(directory, "meta.json")) as f:
+            meta = json.load(f)
+
+        # Why one assignment? load() runs in a thread during reloads; a
+        # request holds either the old model or the new one, never a mix
+        self.model = CoWatchModel(
+            indptr=arrays["indptr"],
+            indices=arrays["indices"],
+            data=arrays["data"],
+            movie_ids=movie_ids,
+            rows={movie_id: row for row, movie_id in enumerate(movie_ids)},
+            meta=meta,
+            build=directory
+        )
+        return True
+
+    def recommend(self, recent_movie_ids, k):
+        """
+        Return [(movie_id, score)] for a user whose recent movies are
+        `recent_movie_ids` (newest first), best first
+        """
+        # Read once: a reload may swap self.model while this runs
+        model = self.model
+        if model is None:
+            return []
+        history = [model.rows[movie_id] for movie_id in recent_movie_ids if movie_id in model.rows]
+        if not history:
+            return []
+
+        # Newer watches count more; a movie watched twice counts once
+        weights = {}
+        for position, row in enumerate(history):
+            weights.setdefault(row, 0.5 ** (position / HISTORY_HALF_LIFE))
+        rows = np.fromiter(weights, dtype=np.int64, count=len(weights))
+        row_weights = np.fromiter(weights.values(), dtype=np.float64, count=len(weights))
+
+        # Sparse dot product: sum of the neighbor rows, weighted by recency
+        starts, ends = model.indptr[rows], model.indptr[rows + 1]
+        neighbors = np.concatenate([model.indices[s:e] for s, e in zip(starts, ends)])
+        similarity = np.concatenate([
+            model.data[s:e] * weight for s, e, weight in zip(starts, ends, row_weights)
+        ])
+        if not len(neighbors):
+            return []
+        candidates, inverse = np.unique(neighbors, return_inverse=True)
+        scores = np.bincount(inverse, weights=similarity)
+
+        # Don't recommend what the user just watched
+        scores[np.isin(candidates, rows)] = 0
+        page = top_page(scores, 0, k)
+        return [
+            (model.movie_ids[candidates[position]], round(float(scores[position]), 4))
+            for position in page.tolist()
+            if scores[position] > 0
+        ]
+
+    def start(self, sync_db, rebuild=True):
+        """
+        Rebuild the model in the background every RECOMMENDATIONS_REBUILD_MINUTES
+        Other API workers (rebuild=False) map the new files once they appear
+        """
+        if RECOMMENDATIONS_REBUILD_MINUTES <= 0:
+            return
+        if rebuild:
+            self.task = asyncio.create_task(self._rebuild_periodically(sync_db))
+        else:
+            self.task = asyncio.create_task(self._reload_periodically())
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _rebuild_periodically(self, sync_db):
+        while True:
+            await asyncio.sleep(RECOMMENDATIONS_REBUILD_MINUTES * 60)
+            try:
+                # Why threadpool? Building is CPU work on the blocking client
+                model = await run_in_threadpool(build_model, sync_db)
+                await run_in_threadpool(save_model, model, self.path)
+                await run_in_threadpool(self.load)
+            except Exception as e:
+                print(f"Rebuilding recommendations failed: {e}")
+
+    async def _reload_periodically(self):
+        # Why at most a minute? A new model reaches every worker soon after it's saved
+        interval = min(60, RECOMMENDATIONS_REBUILD_MINUTES * 60)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                model = self.model
+                if current_build(self.path) != (model.build if model is not None else None):
+                    await run_in_threadpool(self.load)
+            except (OSError, ValueError) as e:
+                print(f"Reloading recommendations failed: {e}")
+
+    def stats(self):
+        return {"loaded": self.loaded, "path": self.path, **self.meta}
+
+
+# Shared model used by the API (mapped at startup)
+recommender = Recommender()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build the co-watch recommendation model")
+    parser.add_argument("--build", action="store_true", help="Build from watch_history and save")
+    parser.add_argument("--path", default=RECOMMENDATIONS_PATH)
+    parser.add_argument("--neighbors", type=int, default=MAX_NEIGHBORS)
+    parser.add_argument("--max-history", type=int, default=MAX_USER_HISTORY)
+    parser.add_argument("--min-co-watches", type=int, default=MIN_CO_WATCHES)
+    args = parser.parse_args()
+
+    if args.build:
+        from database import get_db
+
+        start = time.perf_counter()
+        model = build_model(get_db(), args.neighbors, args.max_history, args.min_co_watches)
+        save_model(model, args.path)
+        print(f"Model saved to {args.path} in {time.perf_counter() - start:.1f}s: {model['meta']}")
+    else:
+        parser.print_help()
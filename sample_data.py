@@ -1,4 +1,7 @@
-from database import movies_collection, users_collection, watch_history_collection, reviews_collection
+from database import get_db
+from trending import bucket_updates
+from ratings import review_stats_updates
+from views import watch_count_updates
 from datetime import datetime, timedelta
 import random
 
@@ -184,12 +187,29 @@ users_data = [
 def populate_database():
     """Fill database with sample data"""
     
+    # Collections (like tables in SQL)
+    db = get_db()
+    movies_collection = db['movies']
+    users_collection = db['users']
+    watch_history_collection = db['watch_history']
+    # Compressed months older than the hot window (see archive.py)
+    watch_history_archive_collection = db['watch_history_archive']
+    reviews_collection = db['reviews']
+    # Per-movie daily watch counters (see trending.py)
+    daily_watches_collection = db['movie_daily_watches']
+    # Where the view worker stopped reading (see views.py)
+    view_checkpoints_collection = db['view_checkpoints']
+    
     # Clear existing data
     # Why clear? Start fresh each time we run this
     movies_collection.delete_many({})
     users_collection.delete_many({})
     watch_history_collection.delete_many({})
+    watch_history_archive_collection.delete_many({})
     reviews_collection.delete_many({})
+    daily_watches_collection.delete_many({})
+    # The views are filled below, so the view worker starts over from now
+    view_checkpoints_collection.delete_many({})
     
     print("Inserting movies...")
     movies_result = movies_collection.insert_many(movies_data)
@@ -211,14 +231,18 @@ def populate_database():
         timestamp = datetime.now() - timedelta(days=random_days_ago)
         watch_duration = random.randint(30, 180)  # 30-180 minutes
         
+        # Why no str()? Ids are stored as ObjectId so $lookup can join on _id
         watch_history_data.append({
-            "user_id": str(random_user),
-            "movie_id": str(random_movie),
+            "user_id": random_user,
+            "movie_id": random_movie,
             "timestamp": timestamp,
             "watch_duration": watch_duration
         })
     
     watch_history_collection.insert_many(watch_history_data)
+    # Keep the daily trending buckets and watch counts in step with the raw events
+    daily_watches_collection.bulk_write(bucket_updates(watch_history_data))
+    movies_collection.bulk_write(watch_count_updates(watch_history_data))
     
     print("Creating reviews...")
     # Create 50 reviews
@@ -242,14 +266,16 @@ def populate_database():
         ]
         
         reviews_data.append({
-            "user_id": str(random_user),
-            "movie_id": str(random_movie),
+            "user_id": random_user,
+            "movie_id": random_movie,
             "rating": rating,
             "review_text": random.choice(review_texts),
             "timestamp": datetime.now() - timedelta(days=random.randint(0, 60))
         })
     
     reviews_collection.insert_many(reviews_data)
+    # Keep each movie's review_count / rating_sum / rating_histogram in step
+    movies_collection.bulk_write(review_stats_updates(reviews_data))
     
     print("Database populated successfully!")
     print(f"Movies: {len(movie_ids)}")
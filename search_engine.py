@@ -0,0 +1,295 @@
+"""
+In-memory search engine for /movies/search
+
+An alternative to MongoDB's $text index (SEARCH_BACKEND=memory). Built from
+the movies collection at startup and kept current on writes.
+
+- Inverted index: term -> postings (doc numbers + term weights), stored as
+  compact typed arrays instead of Python lists of objects
+- BM25 scoring over title, director and cast (title words count double)
+- Prefix matching ("inter" finds "interstellar") through a sorted vocabulary
+- Typo tolerance ("intersteller") through character trigrams of the vocabulary
+- BM25 and the hybrid formula (scoring.py) run as NumPy array operations
+  over the postings, reading the typed arrays without copying them
+
+Why normalize similarity by the best match? BM25 scores have no fixed
+range (they grow with query length), unlike the old "score / 10".
+"""
+import heapq
+import math
+import os
+import re
+from array import array
+from bisect import bisect_left, insort
+from collections import Counter, defaultdict
+
+import numpy as np
+
+from ratings import effective_rating
+from scoring import DEFAULT_WEIGHTS, hybrid_scores, score_fields, top_page
+
+SEARCH_BACKEND = os.environ.get('SEARCH_BACKEND', 'mongo')
+
+# BM25 parameters (standard values)
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# How much a word counts per field
+FIELD_WEIGHTS = {"title": 2.0, "director": 1.0, "cast": 1.0}
+
+# Matches through prefixes/typos count less than exact words
+PREFIX_WEIGHT = 0.7
+FUZZY_WEIGHT = 0.5
+MIN_PREFIX_LENGTH = 2
+MAX_PREFIX_EXPANSIONS = 50
+MIN_FUZZY_LENGTH = 4
+MIN_FUZZY_SIMILARITY = 0.35
+MAX_FUZZY_EXPANSIONS = 10
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """Lowercase words of a text"""
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+def trigrams(term):
+    """Character trigrams of a word, padded so short words still have some"""
+    padded = f"${term}$"
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def movie_terms(movie):
+    """Weighted term frequencies of one movie document"""
+    weights = Counter()
+    for field, field_weight in FIELD_WEIGHTS.items():
+        value = movie.get(field) or ""
+        if isinstance(value, list):
+            value = " ".join(value)
+        for term in tokenize(value):
+            weights[term] += field_weight
+    return weights
+
+
+class SearchEngine:
+    """Inverted index over movies with BM25 + hybrid ranking"""
+
+    def __init__(self):
+        # Doc number (position in these arrays) <-> movie _id
+        self.movie_ids = []
+        self.doc_numbers = {}
+        self.lengths = array("f")       # weighted number of words per movie
+        self.ratings = array("f")       # effective rating (see ratings.py)
+        self.watch_counts = array("q")  # all-time watch count
+        self.alive = bytearray()        # 0 once a movie is removed or replaced
+
+        # term -> (doc numbers, weighted term frequencies)
+        self.postings = {}
+        self.vocabulary = []                # sorted terms, for prefix matching
+        self.trigram_terms = defaultdict(set)
+
+        self.total_length = 0.0
+        self.live_docs = 0
+        self.loaded = False
+        # Movies added while a load runs, replayed onto the new index
+        self.pending = None
+
+    @property
+    def loading(self):
+        return self.pending is not None
+
+    # ----- Building and incremental updates -----
+
+    def add_movie(self, movie, watch_count=0):
+        """Index a movie, replacing any older version of it"""
+        if self.pending is not None:
+            self.pending.append((movie, watch_count))
+        movie_id = movie['_id']
+        if movie_id in self.doc_numbers:
+            old = self.doc_numbers[movie_id]
+            watch_count = watch_count or self.watch_counts[old]
+            self.remove_movie(movie_id)
+
+        doc = len(self.movie_ids)
+        terms = movie_terms(movie)
+        length = sum(terms.values())
+
+        self.movie_ids.append(movie_id)
+        self.doc_numbers[movie_id] = doc
+        self.lengths.append(length)
+        self.ratings.append(effective_rating(movie))
+        self.watch_counts.append(watch_count)
+        self.alive.append(1)
+        self.total_length += length
+        self.live_docs += 1
+
+        for term, weight in terms.items():
+            posting = self.postings.get(term)
+            if posting is None:
+                posting = self.postings[term] = (array("i"), array("f"))
+                insort(self.vocabulary, term)
+                for gram in trigrams(term):
+                    self.trigram_terms[gram].add(term)
+            # Doc numbers only grow, so postings stay sorted
+            posting[0].append(doc)
+            posting[1].append(weight)
+
+    def remove_movie(self, movie_id):
+        """
+        Hide a movie from results
+        Why not delete its postings? Removing from the middle of arrays is
+        slow; dead entries are skipped and dropped on the next full load
+        """
+        doc = self.doc_numbers.pop(movie_id, None)
+        if doc is None or not self.alive[doc]:
+            return
+        self.alive[doc] = 0
+        self.total_length -= self.lengths[doc]
+        self.live_docs -= 1
+
+    def set_rating(self, movie_id, rating):
+        doc = self.doc_numbers.get(movie_id)
+        if doc is not None:
+            self.ratings[doc] = rating
+
+    def add_watches(self, movie_ids):
+        """Count new watch events towards popularity"""
+        for movie_id, count in Counter(movie_ids).items():
+            doc = self.doc_numbers.get(movie_id)
+            if doc is not None:
+                self.watch_counts[doc] += count
+
+    async def load(self, db):
+        """(Re)build the whole index from MongoDB, then swap it in"""
+        fresh = SearchEngine()
+        # Why record adds? The cursor may have passed a movie inserted now,
+        # and the swap below would drop it from the old index too
+        self.pending = []
+        try:
+            # Popularity = the movie's watch_count view (see views.py)
+            projection = {
+                "title": 1, "director": 1, "cast": 1, "rating": 1,
+                "review_count": 1, "rating_sum": 1, "watch_count": 1
+            }
+            async for movie in db.movies.find({}, projection):
+                fresh.add_movie(movie, movie.get('watch_count', 0))
+
+            # Seen twice? add_movie replaces the older copy
+            for movie, watch_count in self.pending:
+                fresh.add_movie(movie, watch_count)
+        except BaseException:
+            # A failed load keeps the old index, which has the adds already
+            self.pending = None
+            raise
+        fresh.loaded = True
+        self.__dict__.update(fresh.__dict__)
+
+    # ----- Searching -----
+
+    def expand(self, token):
+        """Index terms matching one query word: {term: match weight}"""
+        matches = {}
+        if token in self.postings:
+            matches[token] = 1.0
+
+        # Prefix: every vocabulary word starting with the token
+        if len(token) >= MIN_PREFIX_LENGTH:
+            start = bisect_left(self.vocabulary, token)
+            end = bisect_left(self.vocabulary, token + "\uffff")
+            prefixed = self.vocabulary[start:end]
+            if len(prefixed) > MAX_PREFIX_EXPANSIONS:
+                # Keep the most common words (the most likely completions)
+                prefixed = heapq.nlargest(MAX_PREFIX_EXPANSIONS, prefixed,
+                                          key=lambda term: len(self.postings[term][0]))
+            for term in prefixed:
+                matches.setdefault(term, PREFIX_WEIGHT)
+
+        # Typos: only when nothing matched exactly or by prefix
+        if not matches and len(token) >= MIN_FUZZY_LENGTH:
+            query_grams = trigrams(token)
+            shared = Counter()
+            for gram in query_grams:
+                shared.update(self.trigram_terms.get(gram, ()))
+            similar = []
+            for term, count in shared.items():
+                similarity = count / (len(query_grams) + len(trigrams(term)) - count)
+                if similarity >= MIN_FUZZY_SIMILARITY:
+                    similar.append((similarity, term))
+            for similarity, term in heapq.nlargest(MAX_FUZZY_EXPANSIONS, similar):
+                matches[term] = FUZZY_WEIGHT * similarity
+        return matches
+
+    def bm25(self, query):
+        """
+        BM25 score of every movie, as an array indexed by doc number
+        (0 for movies that don't match or were removed)
+        """
+        scores = np.zeros(len(self.movie_ids))
+        if not self.live_docs:
+            return scores
+        average_length = self.total_length / self.live_docs
+        # Why frombuffer? A view on the typed arrays, no copy per query
+        lengths = np.frombuffer(self.lengths, dtype=np.float32)
+
+        for token in set(tokenize(query)):
+            # Per query word, a movie counts its best matching term only, so
+            # 50 prefix expansions don't outweigh one exact hit
+            best = np.zeros(len(self.movie_ids))
+            for term, match_weight in self.expand(token).items():
+                docs, frequencies = self.postings[term]
+                docs = np.frombuffer(docs, dtype=np.int32)
+                frequencies = np.frombuffer(frequencies, dtype=np.float32)
+                idf = math.log(1 + (self.live_docs - len(docs) + 0.5) / (len(docs) + 0.5))
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * lengths[docs] / average_length)
+                term_scores = match_weight * idf * frequencies * (BM25_K1 + 1) / (frequencies + norm)
+                # Why no np.maximum.at? A doc appears once per posting list
+                best[docs] = np.maximum(best[docs], term_scores)
+            scores += best
+
+        # Removed movies stay in the postings (see remove_movie)
+        scores *= np.frombuffer(self.alive, dtype=np.uint8)
+        return scores
+
+    def search(self, query, limit, offset=0, weights=DEFAULT_WEIGHTS):
+        """
+        Return (number of matches, one page of results)
+        Each result is (movie_id, scores dict), best first
+        """
+        scores = self.bm25(query)
+        candidates = np.flatnonzero(scores)
+        if not len(candidates):
+            return 0, []
+
+        # Normalize each component to 0-1 over the candidates
+        bm25_scores = scores[candidates]
+        similarity = bm25_scores / bm25_scores.max()
+        rating = np.frombuffer(self.ratings, dtype=np.float32)[candidates] / 5.0
+        watch_counts = np.frombuffer(self.watch_counts, dtype=np.int64)[candidates]
+        popularity = watch_counts / (watch_counts.max() or 1)
+
+        hybrid = hybrid_scores(similarity, rating, popularity, weights)
+        page = top_page(hybrid, offset, limit)
+
+        results = []
+        fields = score_fields(hybrid, similarity, rating, popularity, page)
+        for position, scores_dict in zip(page.tolist(), fields):
+            scores_dict.update(
+                watch_count=int(watch_counts[position]),
+                score=round(float(bm25_scores[position]), 3)
+            )
+            results.append((self.movie_ids[candidates[position]], scores_dict))
+        return len(candidates), results
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "movies": self.live_docs,
+            "terms": len(self.postings),
+            "postings": sum(len(docs) for docs, _ in self.postings.values()),
+            "dead_docs": len(self.movie_ids) - self.live_docs
+        }
+
+
+# Shared engine used by the API (loaded at startup when SEARCH_BACKEND=memory)
+search_engine = SearchEngine()
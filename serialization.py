@@ -0,0 +1,48 @@
+"""
+Fast JSON encoding of MongoDB documents
+
+Handlers return documents as they come from the driver (ObjectId, datetime)
+wrapped in BSONResponse. orjson encodes them in one pass in C:
+
+- datetime is handled natively (same ISO 8601 text as isoformat())
+- ObjectId goes through bson_default as its hex string
+- NumPy floats from scoring.py are handled natively
+
+Why not FastAPI's default? Returning a dict makes FastAPI run
+jsonable_encoder (a Python walk over every nested field) and then
+json.dumps; a Response object is sent as is.
+
+The response cache stores the encoded bytes, so a cache hit is not
+encoded again.
+"""
+import orjson
+from bson import ObjectId
+from starlette.responses import JSONResponse
+
+from profiling import phase
+
+# Why OPT_NON_STR_KEYS? Histograms and counters may be keyed by numbers
+ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY
+
+
+def bson_default(value):
+    """orjson fallback for BSON types it doesn't know"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(content):
+    """Encode to JSON bytes"""
+    with phase("encode"):
+        return orjson.dumps(content, default=bson_default, option=ORJSON_OPTIONS)
+
+
+class BSONResponse(JSONResponse):
+    """JSON response that accepts raw MongoDB documents"""
+
+    def render(self, content):
+        # Already encoded, e.g. a response cache entry
+        if isinstance(content, bytes):
+            return content
+        return dumps(content)
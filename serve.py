@@ -0,0 +1,91 @@
+"""
+Production entry point: several API worker processes on one port
+
+    python serve.py [--workers 4] [--host 0.0.0.0] [--port 8000]
+
+- The port is bound once here and handed to every worker
+- Workers are started with "spawn": each imports the app and creates its
+  own MongoDB clients, nothing is inherited from this process
+- Each worker's pool is MONGO_CONNECTION_BUDGET / workers (see database.py)
+- This process runs the response cache shared by the workers (see cache.py)
+- Worker 0 runs the once-per-database jobs, the others follow (see app.py)
+- A worker that exits is restarted with the same index
+
+For development, `uvicorn app:app --reload` still runs a single process
+with an in-process cache.
+"""
+import argparse
+import multiprocessing
+import os
+import secrets
+import signal
+import tempfile
+import threading
+
+import uvicorn
+
+API_WORKERS = int(os.environ.get('API_WORKERS', os.cpu_count() or 1))
+# Total MongoDB connections of all workers together
+MONGO_CONNECTION_BUDGET = int(os.environ.get('MONGO_CONNECTION_BUDGET', 200))
+
+
+def run_worker(index, sockets, host, port):
+    """Worker process: serve the app on the inherited socket"""
+    # Read by app.py at import, which happens inside server.run()
+    os.environ['API_WORKER_INDEX'] = str(index)
+    config = uvicorn.Config("app:app", host=host, port=port)
+    uvicorn.Server(config).run(sockets=sockets)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with several worker processes")
+    parser.add_argument("--workers", type=int, default=API_WORKERS)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--connection-budget", type=int, default=MONGO_CONNECTION_BUDGET)
+    args = parser.parse_args()
+
+    # Shared response cache on a local socket, protected by a random key
+    address = os.path.join(tempfile.mkdtemp(prefix="movie-api-"), "cache.sock")
+    authkey = secrets.token_bytes(16)
+    from cache import serve_cache
+    threading.Thread(target=serve_cache, args=(address, authkey), daemon=True).start()
+
+    # Inherited by the workers
+    os.environ.update(
+        API_WORKERS=str(args.workers),
+        MONGO_CONNECTION_BUDGET=str(args.connection_budget),
+        CACHE_SERVER_ADDRESS=address,
+        CACHE_SERVER_AUTHKEY=authkey.hex()
+    )
+
+    sockets = [uvicorn.Config("app:app", host=args.host, port=args.port).bind_socket()]
+    spawn = multiprocessing.get_context("spawn")
+
+    def start(index):
+        process = spawn.Process(target=run_worker, args=(index, sockets, args.host, args.port))
+        process.start()
+        return process
+
+    stopping = threading.Event()
+    for signal_number in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signal_number, lambda *_: stopping.set())
+
+    print(f"Starting {args.workers} workers on http://{args.host}:{args.port} "
+          f"({args.connection_budget // args.workers} MongoDB connections each)")
+    workers = {index: start(index) for index in range(args.workers)}
+    while not stopping.wait(1):
+        for index, process in list(workers.items()):
+            if not process.is_alive():
+                print(f"Worker {index} exited with code {process.exitcode}, restarting")
+                workers[index] = start(index)
+
+    # SIGTERM lets each worker run its shutdown (e.g. flush queued watch events)
+    for process in workers.values():
+        process.terminate()
+    for process in workers.values():
+        process.join(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
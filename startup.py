@@ -0,0 +1,101 @@
+"""
+Warm-up after the server starts listening, and readiness for /ready
+
+The lifespan only creates clients and starts background tasks, so a
+restarted worker accepts connections right away instead of after every
+in-memory index has been loaded. The slow part runs here, in the
+background:
+
+    database     ping MongoDB until it answers
+    steps        e.g. index check, search engine, suggestions; run
+                 together once the database answered, each retried until
+                 it succeeds
+
+Requests served meanwhile still work: search falls back to MongoDB until
+the engine is loaded, existence checks go to MongoDB, etc. /ready answers
+503 until everything is warm, so a load balancer or a rolling restart
+only sends traffic to a worker once it serves at full speed.
+"""
+import asyncio
+import os
+import time
+
+# Pause before retrying a failed warm-up step
+WARMUP_RETRY_SECONDS = float(os.environ.get('WARMUP_RETRY_SECONDS', 5))
+# How long /ready waits for MongoDB to answer a ping
+READY_PING_TIMEOUT_SECONDS = float(os.environ.get('READY_PING_TIMEOUT_SECONDS', 2))
+
+
+class Warmup:
+    """Runs the warm-up steps in the background and reports their state"""
+
+    def __init__(self):
+        self.task = None
+        self.states = {}
+        self.started = None
+        self.ready_seconds = None
+
+    def start(self, db, steps, then=None):
+        """
+        steps: [(name, async function)], run once MongoDB answers
+        then: called once every step is done (e.g. start a worker that
+        updates what the steps loaded)
+        """
+        self.started = time.perf_counter()
+        self.ready_seconds = None
+        self.states = {"database": "connecting", **{name: "waiting" for name, _ in steps}}
+        self.task = asyncio.create_task(self._run(db, steps, then))
+
+    async def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _retry(self, name, step):
+        while True:
+            try:
+                self.states[name] = "running"
+                await step()
+                self.states[name] = "done"
+                return
+            except Exception as e:
+                self.states[name] = f"retrying: {e}"
+                print(f"Warm-up step {name} failed, retrying: {e}")
+                await asyncio.sleep(WARMUP_RETRY_SECONDS)
+
+    async def _run(self, db, steps, then):
+        await self._retry("database", lambda: db.command("ping"))
+        await asyncio.gather(*[self._retry(name, step) for name, step in steps])
+        if then is not None:
+            then()
+        self.ready_seconds = time.perf_counter() - self.started
+        print(f"Warm-up finished in {self.ready_seconds:.2f}s")
+
+    @property
+    def warm(self):
+        return self.ready_seconds is not None
+
+    async def check(self, db):
+        """
+        (ready, details) for /ready
+        Why ping again once warm? A worker that lost MongoDB shouldn't get traffic
+        """
+        database = self.states.get("database", "not started")
+        if database == "done":
+            database = "ok"
+        if self.warm:
+            try:
+                await asyncio.wait_for(db.command("ping"), READY_PING_TIMEOUT_SECONDS)
+                database = "ok"
+            except Exception as e:
+                database = f"unreachable: {str(e) or 'timeout'}"
+        details = {
+            "database": database,
+            "warmup": {name: state for name, state in self.states.items() if name != "database"},
+            "ready_after_seconds": round(self.ready_seconds, 3) if self.warm else None
+        }
+        return self.warm and database == "ok", details
+
+
+# Shared warm-up state used by the API
+warmup = Warmup()
@@ -0,0 +1,351 @@
+"""
+Typeahead suggestions for /movies/suggest
+
+Titles, directors and cast names are indexed from every word start, so
+typing any word of a name finds it:
+
+    "The Dark Knight" -> "the dark knight", "dark knight", "knight"
+
+All keys live in one sorted list. The keys starting with a prefix form one
+contiguous range, found with two binary searches. Each key points to its
+movie and name (label).
+
+Short prefixes match most of the catalog, so ranking their range on every
+request is slow. At load every prefix matching at least
+SUGGEST_RANKED_MIN_RANGE keys gets its best SUGGEST_RANKED_SIZE names
+precomputed; a request for it only re-sorts that list by the current
+watch counts. Smaller ranges are ranked on request with argpartition.
+
+Watch counts only grow, so a name can only enter a ranked list when one of
+its movies gets watched or added; add_watches and add_movie offer it to the
+ranked lists of its prefixes. Movies added after the load go to a small
+sorted side list instead of the big one, so adding one costs O(log N)
+searches rather than shifting every key. The next load merges them.
+
+Built from the movies collection at startup and kept current on writes
+(new movies) and by the view worker (watch counts).
+"""
+from bisect import bisect_left, insort
+from collections import Counter
+
+import numpy as np
+from starlette.concurrency import run_in_threadpool
+
+from scoring import top_page
+from search_engine import tokenize
+
+DEFAULT_SUGGESTIONS = 10
+MAX_SUGGESTIONS = 20
+MAX_PREFIX_LENGTH = 100
+
+# Fields offered as suggestions, in the order of their codes
+FIELDS = ("title", "director", "cast")
+
+# Prefixes matching at least this many keys get a precomputed ranked list
+SUGGEST_RANKED_MIN_RANGE = 512
+# Why more than MAX_SUGGESTIONS? Replaced movies leave gaps until the next
+# load, and a full list short of names sends the request to the slow path
+SUGGEST_RANKED_SIZE = 2 * MAX_SUGGESTIONS
+
+
+def word_starts(text):
+    """Normalized text from each word on: "a b c" -> ["a b c", "b c", "c"]"""
+    words = tokenize(text)
+    return [" ".join(words[i:]) for i in range(len(words))]
+
+
+def prefix_end(prefix):
+    """Smallest string greater than every string starting with `prefix`"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+class SuggestIndex:
+    """Sorted word-start keys over titles and names, ranked by popularity"""
+
+    def __init__(self):
+        # Movie rows <-> movie _id
+        self.movie_ids = []
+        self.rows_by_id = {}
+        self.titles = []
+        self.watch_counts = np.zeros(0, dtype=np.int64)
+        self.alive = np.zeros(0, dtype=bool)
+
+        # Labels: (field code, display text), shared by all keys of a name
+        self.labels = []
+        self.label_numbers = {}
+        # Labels of each movie row, to offer it again when it gets watched
+        self.row_labels = []
+
+        # Sorted keys and, at the same positions, their movie row and label
+        self.keys = []
+        self.key_rows = np.zeros(0, dtype=np.int32)
+        self.key_labels = np.zeros(0, dtype=np.int32)
+        # (key, row, label) of movies added since the load, sorted
+        self.added = []
+
+        # Prefix -> [floor, {label: row}]: its best names, and a score no
+        # member is below (so most offers are rejected without a scan)
+        self.ranked = {}
+        self.label_lists = {}
+        self.loaded = False
+        # Movies added while a load runs, replayed onto the new index
+        self.pending = None
+
+    @property
+    def loading(self):
+        return self.pending is not None
+
+    # ----- Building and incremental updates -----
+
+    def _label(self, field_code, text):
+        label = (field_code, text)
+        number = self.label_numbers.get(label)
+        if number is None:
+            number = self.label_numbers[label] = len(self.labels)
+            self.labels.append(label)
+        return number
+
+    def _entries(self, movie, row):
+        """(key, row, label) of every word start of a movie's names"""
+        entries = []
+        labels = []
+        for field_code, field in enumerate(FIELDS):
+            value = movie.get(field) or []
+            for text in (value if isinstance(value, list) else [value]):
+                label = self._label(field_code, text)
+                labels.append(label)
+                entries.extend((key, row, label) for key in word_starts(text))
+        self.row_labels.append(tuple(labels))
+        return entries
+
+    def _add_row(self, movie):
+        movie_id = movie['_id']
+        if movie_id in self.rows_by_id:
+            # Replaced: the old row's keys stay but are skipped until the next load
+            self.alive[self.rows_by_id[movie_id]] = False
+        row = len(self.movie_ids)
+        self.movie_ids.append(movie_id)
+        self.rows_by_id[movie_id] = row
+        self.titles.append(movie.get('title'))
+        return row
+
+    def _score(self, row):
+        return int(self.watch_counts[row]) if self.alive[row] else -1
+
+    def _lists_of(self, label):
+        """Ranked lists of the prefixes of a name's keys (kept until the next load)"""
+        lists = self.label_lists.get(label)
+        if lists is None:
+            lists = self.label_lists[label] = []
+            for key in word_starts(self.labels[label][1]):
+                for length in range(1, len(key) + 1):
+                    entry = self.ranked.get(key[:length])
+                    if entry is not None:
+                        lists.append(entry)
+                    # Why go on after a space? Such prefixes are never stored,
+                    # but longer ones can be
+                    elif key[length - 1] != " ":
+                        # Ranges only shrink as the prefix grows: none further on
+                        break
+        return lists
+
+    def _offer(self, label, row):
+        """Put a name into the ranked lists it now makes, for its movie `row`"""
+        score = self._score(row)
+        for entry in self._lists_of(label):
+            floor, members = entry
+            current = members.get(label)
+            if current is not None:
+                if current != row and score > self._score(current):
+                    members[label] = row
+            elif len(members) < SUGGEST_RANKED_SIZE:
+                members[label] = row
+            elif score > floor:
+                weakest = min(members, key=lambda member: self._score(members[member]))
+                weakest_score = self._score(members[weakest])
+                # Every member scores at least this now; scores never drop
+                entry[0] = weakest_score
+                if score > weakest_score:
+                    del members[weakest]
+                    members[label] = row
+
+    def add_movie(self, movie, watch_count=0):
+        """Make a new (or changed) movie suggestible"""
+        if self.pending is not None:
+            self.pending.append((movie, watch_count))
+        row = self._add_row(movie)
+        self.watch_counts = np.append(self.watch_counts, watch_count)
+        self.alive = np.append(self.alive, True)
+
+        for entry in self._entries(movie, row):
+            # Why a side list? Inserting into the big one shifts every key
+            insort(self.added, entry)
+        for label in self.row_labels[row]:
+            self._offer(label, row)
+
+    def add_watches(self, movie_ids):
+        """Count new watch events towards popularity"""
+        for movie_id, count in Counter(movie_ids).items():
+            row = self.rows_by_id.get(movie_id)
+            if row is None:
+                continue
+            self.watch_counts[row] += count
+            for label in self.row_labels[row]:
+                self._offer(label, row)
+
+    def _rank_range(self, start, end, scores, count):
+        """[(label, row, score)] of the best `count` names of a key range"""
+        rows = self.key_rows[start:end]
+        labels = self.key_labels[start:end]
+        return best_names(rows, labels, scores[start:end], count)
+
+    def _build(self, entries, watch_counts):
+        """Sort the keys and precompute the ranked lists (CPU only)"""
+        # Why sort once? Inserting keys one at a time is quadratic
+        entries.sort()
+        self.keys = keys = [key for key, _, _ in entries]
+        self.key_rows = np.array([row for _, row, _ in entries], dtype=np.int32)
+        self.key_labels = np.array([label for _, _, label in entries], dtype=np.int32)
+        self.watch_counts = np.array(watch_counts, dtype=np.int64)
+        self.alive = np.ones(len(watch_counts), dtype=bool)
+
+        scores = self.watch_counts[self.key_rows]
+        # Why only walk big ranges? A prefix's range holds its extensions'
+        # ranges, so once one is small all the longer ones are too
+        pending = [("", 0, len(keys))]
+        while pending:
+            prefix, start, end = pending.pop()
+            depth = len(prefix)
+            position = start
+            # The key equal to the prefix sorts first and has no next letter
+            while position < end and len(keys[position]) == depth:
+                position += 1
+            while position < end:
+                child = keys[position][:depth + 1]
+                child_end = bisect_left(keys, prefix_end(child), position, end)
+                if child_end - position >= SUGGEST_RANKED_MIN_RANGE:
+                    # Requests never end in a space
+                    if not child.endswith(" "):
+                        best = self._rank_range(position, child_end, scores, SUGGEST_RANKED_SIZE)
+                        floor = best[-1][2] if len(best) == SUGGEST_RANKED_SIZE else -1
+                        self.ranked[child] = [floor, {label: row for label, row, _ in best}]
+                    pending.append((child, position, child_end))
+                position = child_end
+
+    async def load(self, db):
+        """(Re)build the whole index from MongoDB, then swap it in"""
+        fresh = SuggestIndex()
+        # Why record adds? The cursor may have passed a movie inserted now,
+        # and the swap below would drop it from the old index too
+        self.pending = []
+        try:
+            entries = []
+            watch_counts = []
+            projection = {"title": 1, "director": 1, "cast": 1, "watch_count": 1}
+            async for movie in db.movies.find({}, projection):
+                row = fresh._add_row(movie)
+                watch_counts.append(movie.get('watch_count', 0))
+                entries.extend(fresh._entries(movie, row))
+
+            # Why threadpool? Sorting and ranking a large catalog takes seconds;
+            # nothing reads `fresh` until the swap
+            await run_in_threadpool(fresh._build, entries, watch_counts)
+            # Seen twice? The older row is skipped like any replaced movie
+            for movie, watch_count in self.pending:
+                fresh.add_movie(movie, watch_count)
+        except BaseException:
+            # A failed load keeps the old index, which has the adds already
+            self.pending = None
+            raise
+        fresh.loaded = True
+        self.__dict__.update(fresh.__dict__)
+
+    # ----- Suggesting -----
+
+    def suggest(self, prefix, k=DEFAULT_SUGGESTIONS):
+        """
+        Best names starting with `prefix` (at a word start), most watched
+        first: [{text, field, movie_id, movie_title, watch_count}]
+        """
+        prefix = " ".join(tokenize(prefix[:MAX_PREFIX_LENGTH]))
+        if not prefix:
+            return []
+
+        best = None
+        entry = self.ranked.get(prefix)
+        if entry is not None:
+            members = entry[1]
+            labels = np.fromiter(members.keys(), dtype=np.int32, count=len(members))
+            rows = np.fromiter(members.values(), dtype=np.int32, count=len(members))
+            best = best_names(rows, labels, self._scores(rows), k)
+            # A full list may have lost names to replaced movies: rank the range
+            if len(best) < k and len(members) == SUGGEST_RANKED_SIZE:
+                best = None
+        if best is None:
+            rows, labels = self._matches(prefix)
+            best = best_names(rows, labels, self._scores(rows), k)
+
+        return [{
+            "text": self.labels[label][1],
+            "field": FIELDS[self.labels[label][0]],
+            "movie_id": self.movie_ids[row],
+            "movie_title": self.titles[row],
+            "watch_count": score
+        } for label, row, score in best]
+
+    def _scores(self, rows):
+        # Removed movies rank below everything and are dropped
+        return np.where(self.alive[rows], self.watch_counts[rows], -1)
+
+    def _matches(self, prefix):
+        """Movie rows and labels of every key starting with `prefix`"""
+        start = bisect_left(self.keys, prefix)
+        end = bisect_left(self.keys, prefix_end(prefix), start)
+        added_start = bisect_left(self.added, (prefix,))
+        added_end = bisect_left(self.added, (prefix_end(prefix),), added_start)
+        added = self.added[added_start:added_end]
+        rows = np.concatenate([self.key_rows[start:end],
+                               np.array([row for _, row, _ in added], dtype=np.int32)])
+        labels = np.concatenate([self.key_labels[start:end],
+                                 np.array([label for _, _, label in added], dtype=np.int32)])
+        return rows, labels
+
+    def stats(self):
+        return {
+            "loaded": self.loaded,
+            "movies": int(self.alive.sum()),
+            "keys": len(self.keys) + len(self.added),
+            "names": len(self.labels),
+            "ranked_prefixes": len(self.ranked)
+        }
+
+
+def best_names(rows, labels, scores, count):
+    """
+    [(label, row, score)] of the `count` best distinct names, best first.
+    A name can match through several keys and movies: its best one counts;
+    negative scores (removed movies) are skipped
+    """
+    best = []
+    seen = set()
+
+    def pick(positions):
+        for position in positions.tolist():
+            label = int(labels[position])
+            if label in seen or scores[position] < 0:
+                continue
+            seen.add(label)
+            best.append((label, int(rows[position]), int(scores[position])))
+            if len(best) == count:
+                return
+
+    # Why 4 * count first? Usually enough distinct names, else rank the rest
+    candidates = top_page(scores, 0, 4 * count)
+    pick(candidates)
+    if len(best) < count and len(candidates) < len(scores):
+        pick(top_page(scores, len(candidates), len(scores)))
+    return best
+
+
+# Shared index used by the API (loaded at startup)
+suggest_index = SuggestIndex()
@@ -0,0 +1,48 @@
+"""
+Shared fixtures: the app runs in-process against mongomock, so the tests
+need no MongoDB server (pip install pytest mongomock mongomock-motor)
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# Read at import by the app's modules, so set before anything imports them
+# Why VIEWS_SOURCE=off? mongomock has no change streams, and a polling worker
+# would update the views while a test checks them
+os.environ.setdefault('MONGO_DB_NAME', 'movie_streaming_test')
+os.environ.setdefault('RECOMMENDATIONS_PATH', os.path.join(ROOT, 'tests', 'no_model'))
+os.environ.setdefault('SEARCH_BACKEND', 'memory')
+os.environ.setdefault('VIEWS_SOURCE', 'off')
+
+from benchmark import use_mock_backend  # noqa: E402
+
+use_mock_backend()
+
+COLLECTIONS = ["movies", "users", "watch_history", "watch_history_archive", "reviews",
+               "movie_daily_watches", "view_checkpoints", "ingest_staging"]
+
+
+@pytest.fixture
+def db():
+    """The (blocking) test database, emptied before each test"""
+    from database import get_db
+
+    database = get_db()
+    for name in COLLECTIONS:
+        database[name].drop()
+    return database
+
+
+@pytest.fixture
+def client(db):
+    """The app with its lifespan running (seed `db` before using it)"""
+    from fastapi.testclient import TestClient
+
+    from app import app
+
+    with TestClient(app) as test_client:
+        yield test_client
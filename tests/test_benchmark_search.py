@@ -0,0 +1,18 @@
+"""benchmark_search.py still runs against the app (clients are made in the lifespan)"""
+import asyncio
+from argparse import Namespace
+
+import benchmark_search
+from cache import response_cache
+
+
+def test_search_benchmark_runs(db, capsys, monkeypatch):
+    monkeypatch.setattr(response_cache, "max_entries", response_cache.max_entries)
+    # mongomock has no $merge; search works without watch counts
+    monkeypatch.setattr(benchmark_search, "rebuild_watch_counts", lambda db: None)
+    benchmark_search.seed(db, num_movies=30, num_events=100)
+    asyncio.run(benchmark_search.run_benchmark(Namespace(repeat=1, compare_legacy=True)))
+
+    rows = [line.split() for line in capsys.readouterr().out.splitlines() if line.strip()]
+    hits = [int(row[0]) for row in rows if row[0].isdigit()]
+    assert hits == [10, 30, 30, 30]
@@ -0,0 +1,96 @@
+"""Cached responses are dropped by the writes that make them stale"""
+import asyncio
+import multiprocessing
+import socket
+import time
+from datetime import datetime
+
+from cache import CacheClient, make_key, normalize, serve_cache
+
+
+def test_new_review_drops_cached_reviews_of_any_id_spelling(db, client):
+    movie_id = db.movies.insert_one({"title": "Heat", "genres": ["Crime"], "rating": 4.5}).inserted_id
+    user_id = db.users.insert_one({"name": "Ann", "email": "ann@example.com"}).inserted_id
+    db.reviews.insert_one({"user_id": user_id, "movie_id": movie_id, "rating": 4.0,
+                           "review_text": "Great", "timestamp": datetime(2024, 5, 1)})
+
+    # Upper-case hex is a valid id, cached under the same key as lower-case
+    path = f"/movies/{str(movie_id).upper()}/reviews"
+    assert len(client.get(path).json()["reviews"]) == 1
+
+    response = client.post(f"/movies/{movie_id}/reviews", json={"user_id": str(user_id), "rating": 5.0, "review_text": "Even better"})
+    assert response.status_code == 201
+    assert len(client.get(path).json()["reviews"]) == 2
+    assert len(client.get(f"/movies/{movie_id}/reviews").json()["reviews"]) == 2
+
+
+def test_keys_keep_cursors_and_normalize_only_free_text():
+    # Cursors are case-sensitive: two spellings are two pages
+    assert make_key("reviews", movie_id="1", after="AbC") != make_key("reviews", movie_id="1", after="abc")
+    assert make_key("reviews", movie_id="1", after="a  b") != make_key("reviews", movie_id="1", after="a b")
+    assert make_key("search", query=normalize("  Nolan ")) == make_key("search", query=normalize("nolan"))
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+def test_shared_cache_round_trip():
+    # The server runs in its own process, as with serve.py
+    address = ("127.0.0.1", free_port())
+    server = multiprocessing.get_context("spawn").Process(target=serve_cache, args=(address, b"key"), daemon=True)
+    server.start()
+    async def round_trip():
+        client = CacheClient(address, b"key", timeout_ms=2000)
+        for _ in range(100):
+            if "size" in await client.stats():
+                break
+            client.down_until = 0  # Still starting, retry now
+            await asyncio.sleep(0.1)
+
+        await client.set("reviews?movie_id='1'", b"body", 60, tags=["reviews:1"])
+        assert await client.get("reviews?movie_id='1'") == b"body"
+        await client.invalidate("reviews:1")
+        assert await client.get("reviews?movie_id='1'") is None
+
+    try:
+        asyncio.run(round_trip())
+    finally:
+        server.terminate()
+
+
+def test_unresponsive_cache_server_is_a_miss():
+    # Accepts connections but never answers
+    with socket.socket() as server:
+        server.bind(("127.0.0.1", 0))
+        server.listen()
+        client = CacheClient(server.getsockname(), b"key", timeout_ms=200, retry_seconds=60)
+
+        async def miss_without_blocking():
+            ticks = 0
+
+            async def other_request():
+                nonlocal ticks
+                while True:
+                    ticks += 1
+                    await asyncio.sleep(0.01)
+
+            other = asyncio.create_task(other_request())
+            start = time.perf_counter()
+            assert await client.get("search?query='heat'") is None
+            assert time.perf_counter() - start < 1
+            other.cancel()
+            # The loop kept serving while the call waited
+            assert ticks >= 5
+            assert client.timeouts == 1
+
+            # Skipped while it's down: no wait at all
+            start = time.perf_counter()
+            await client.set("search?query='heat'", b"body", 60)
+            assert await client.get("search?query='heat'") is None
+            assert time.perf_counter() - start < 0.01
+            assert client.timeouts == 1
+
+        asyncio.run(miss_without_blocking())
@@ -0,0 +1,64 @@
+"""Id checks: ids inserted after the Bloom filter was loaded are not missing"""
+import asyncio
+
+from database import get_async_db
+from existence import IdRegistry
+from generate_data import MOVIE_KIND, make_id
+
+
+class InsertStream:
+    """Stands in for a change stream that delivers some inserts, then waits"""
+
+    def __init__(self, object_ids):
+        self.changes = [{"documentKey": {"_id": object_id}} for object_id in object_ids]
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self.changes:
+            return self.changes.pop(0)
+        await asyncio.Event().wait()
+
+
+def test_insert_after_load_without_change_streams(db):
+    db.movies.insert_one({"_id": make_id(MOVIE_KIND, 0), "title": "Loaded"})
+
+    async def check():
+        registry = IdRegistry("movies", "title")
+        await registry.load(get_async_db())
+        assert not registry.following
+        # Same fixed timestamp as every generated id, inserted after the load
+        db.movies.insert_one({"_id": make_id(MOVIE_KIND, 1), "title": "Inserted"})
+        assert await registry.exists(get_async_db(), make_id(MOVIE_KIND, 1))
+        assert not await registry.exists(get_async_db(), make_id(MOVIE_KIND, 2))
+        assert await registry.name_of(get_async_db(), make_id(MOVIE_KIND, 0)) == "Loaded"
+
+    asyncio.run(check())
+
+
+def test_followed_inserts_reach_the_filter(db):
+    async def check():
+        registry = IdRegistry("movies", "title")
+        await registry.load(get_async_db())
+        registry.following = True
+        registry.follow_task = asyncio.create_task(registry._follow(InsertStream([make_id(MOVIE_KIND, 1)])))
+        await asyncio.sleep(0)
+
+        db.movies.insert_one({"_id": make_id(MOVIE_KIND, 1), "title": "Inserted"})
+        assert await registry.exists(get_async_db(), make_id(MOVIE_KIND, 1))
+        lookups = registry.lookups
+        # Ruled out by the filter, no round trip
+        assert not await registry.exists(get_async_db(), make_id(MOVIE_KIND, 2))
+        assert registry.lookups == lookups
+
+        await registry.stop()
+        assert not registry.following
+
+    asyncio.run(check())
@@ -0,0 +1,40 @@
+"""Index reconciliation drops redundant indexes, never unknown ones"""
+from pymongo import ASCENDING, DESCENDING
+
+from indexes import INDEXES, plan_indexes, reconcile_indexes
+
+
+def test_prefix_duplicates_and_listed_indexes_are_dropped(db):
+    reconcile_indexes(db)
+    # Prefix of the declared (user_id, timestamp, _id) index
+    db.watch_history.create_index([("user_id", ASCENDING)])
+    db.watch_history.create_index([("user_id", ASCENDING), ("timestamp", DESCENDING)])
+    # Listed in DROP
+    db.reviews.create_index([("user_id", ASCENDING)])
+
+    plan = plan_indexes(db)
+    assert sorted(plan["drop"]) == [
+        ("reviews", "user_id_1"), ("watch_history", "user_id_1"), ("watch_history", "user_id_1_timestamp_-1")
+    ]
+    assert plan["create"] == [] and plan["unknown"] == []
+
+
+def test_hand_made_indexes_are_kept(db):
+    reconcile_indexes(db)
+    db.movies.create_index([("director", ASCENDING)], name="ops_director")
+    # Same keys as a declared prefix, but unique: it enforces something
+    db.watch_history.create_index([("user_id", ASCENDING), ("timestamp", DESCENDING)], unique=True)
+
+    plan = plan_indexes(db)
+    assert plan["drop"] == []
+    assert sorted(plan["unknown"]) == [("movies", "ops_director"), ("watch_history", "user_id_1_timestamp_-1")]
+
+    reconcile_indexes(db)
+    assert "ops_director" in db.movies.index_information()
+
+
+def test_reconciled_indexes_match_the_declaration(db):
+    reconcile_indexes(db)
+    plan = plan_indexes(db)
+    assert plan == {"create": [], "drop": [], "unknown": []}
+    assert len(db.watch_history.index_information()) == len(INDEXES["watch_history"]) + 1
@@ -0,0 +1,67 @@
+"""Accepted watch events are staged in MongoDB until they are written"""
+import asyncio
+from datetime import datetime, timedelta
+
+from fastapi.testclient import TestClient
+
+from app import app
+from database import get_async_db
+from ingest import STAGING, WatchEventBuffer
+
+
+def seed(db):
+    user_id = db.users.insert_one({"name": "Ann", "email": "ann@example.com"}).inserted_id
+    movie_ids = db.movies.insert_many([{"title": "Heat"}, {"title": "Alien"}]).inserted_ids
+    events = [
+        {"user_id": user_id, "movie_id": movie_id, "timestamp": datetime(2024, 5, 1, 20), "watch_duration": 42}
+        for movie_id in movie_ids
+    ]
+    return user_id, movie_ids, events
+
+
+def test_events_are_staged_before_they_are_queued(db):
+    user_id, _, events = seed(db)
+
+    async def ingest():
+        buffer = WatchEventBuffer(get_async_db())
+        assert await buffer.enqueue(events) == 2
+        # Not written yet, but already stored: a crash here loses nothing
+        assert db[STAGING].find_one()["events"] == events
+        assert db.watch_history.count_documents({}) == 0
+        buffer.start()
+        await buffer.stop()
+
+    asyncio.run(ingest())
+    assert db.watch_history.count_documents({"user_id": user_id}) == 2
+    assert db[STAGING].count_documents({}) == 0
+
+
+def test_post_watch_events(db):
+    user_id, movie_ids, _ = seed(db)
+    body = "\n".join(
+        f'{{"user_id": "{user_id}", "movie_id": "{movie_id}", "timestamp": "2024-05-01T20:00:00", "watch_duration": 42}}'
+        for movie_id in movie_ids
+    )
+    with TestClient(app) as client:
+        response = client.post("/events/watch", content=body)
+        assert response.status_code == 202
+        assert response.json() == {"received": 2, "queued": 2}
+    # Shutdown flushes the queue
+    assert db.watch_history.count_documents({"user_id": user_id}) == 2
+    assert db[STAGING].count_documents({}) == 0
+
+
+def test_recover_writes_only_missing_events(db):
+    _, movie_ids, events = seed(db)
+    # A crash after the first event was written, before its request was unstaged
+    db.watch_history.insert_one(dict(events[0]))
+    db[STAGING].insert_one({"received_at": datetime.now() - timedelta(hours=1), "events": events})
+    # Still waiting in a live worker's queue: not touched
+    db[STAGING].insert_one({"received_at": datetime.now(), "events": events[:1]})
+
+    async def recover():
+        return await WatchEventBuffer(get_async_db()).recover()
+
+    assert asyncio.run(recover()) == 1
+    assert sorted(event["movie_id"] for event in db.watch_history.find()) == sorted(movie_ids)
+    assert db[STAGING].count_documents({}) == 1
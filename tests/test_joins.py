@@ -0,0 +1,59 @@
+"""
+user_id/movie_id are stored as ObjectIds, so the $lookup joins of the
+history and reviews endpoints find the movie and the user (see migrate_ids.py)
+"""
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+
+from migrate_ids import ID_FIELDS, migrate_collection
+
+
+def seed(db, reference=lambda object_id: object_id):
+    """One user, two movies, a watch and a review of each; returns their ids"""
+    user_id = db.users.insert_one({"name": "Ann", "email": "ann@example.com"}).inserted_id
+    movie_ids = db.movies.insert_many([
+        {"title": "Heat", "genres": ["Crime"], "rating": 4.5},
+        {"title": "Alien", "genres": ["Horror", "Sci-Fi"], "rating": 4.0}
+    ]).inserted_ids
+    now = datetime(2024, 5, 1)
+    for hours, movie_id in enumerate(movie_ids):
+        db.watch_history.insert_one({
+            "user_id": reference(user_id), "movie_id": reference(movie_id),
+            "timestamp": now - timedelta(hours=hours), "watch_duration": 90
+        })
+        db.reviews.insert_one({
+            "user_id": reference(user_id), "movie_id": reference(movie_id),
+            "rating": 4.0, "review_text": "Great", "timestamp": now - timedelta(hours=hours)
+        })
+    return user_id, movie_ids
+
+
+def assert_joined(client, user_id, movie_ids):
+    history = client.get(f"/users/{user_id}/history").json()
+    assert history["total_movies_watched"] == 2
+    assert [(entry["movie_id"], entry["movie_title"]) for entry in history["watch_history"]] == [
+        (str(movie_ids[0]), "Heat"), (str(movie_ids[1]), "Alien")
+    ]
+    assert history["watch_history"][1]["genres"] == ["Horror", "Sci-Fi"]
+
+    for movie_id in movie_ids:
+        reviews = client.get(f"/movies/{movie_id}/reviews").json()
+        assert [review["user_name"] for review in reviews["reviews"]] == ["Ann"]
+
+
+def test_history_and_reviews_join_objectid_references(db, client):
+    user_id, movie_ids = seed(db)
+    assert isinstance(db.watch_history.find_one()["movie_id"], ObjectId)
+    assert_joined(client, user_id, movie_ids)
+
+
+def test_string_references_join_after_migration(db, client):
+    user_id, movie_ids = seed(db, reference=str)
+    # Before the migration the string ids match nothing
+    assert client.get(f"/users/{user_id}/history").json()["watch_history"] == []
+
+    for name, fields in ID_FIELDS.items():
+        updated, skipped = migrate_collection(db[name], fields, batch_size=1)
+        assert (updated, skipped) == (2, 0)
+    assert_joined(client, user_id, movie_ids)
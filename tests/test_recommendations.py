@@ -0,0 +1,71 @@
+"""Co-watch model: built from watch_history, mapped and swapped whole"""
+import os
+from datetime import datetime, timedelta
+
+from recommendations import KEEP_BUILDS, Recommender, build_model, current_build, save_model
+
+
+def seed_watches(db, movie_ids, histories):
+    """histories: one list of movie numbers per user"""
+    now = datetime(2024, 5, 1)
+    for history in histories:
+        user_id = db.users.insert_one({"name": "User"}).inserted_id
+        for minutes, number in enumerate(history):
+            db.watch_history.insert_one({"user_id": user_id, "movie_id": movie_ids[number],
+                                         "timestamp": now + timedelta(minutes=minutes), "watch_duration": 30})
+
+
+def test_recommends_co_watched_movies(db, tmp_path):
+    movie_ids = db.movies.insert_many([{"title": f"Movie {number}"} for number in range(4)]).inserted_ids
+    seed_watches(db, movie_ids, [[0, 1], [0, 1], [0, 2], [3]])
+    path = str(tmp_path / "model")
+    save_model(build_model(db), path)
+
+    recommender = Recommender(path)
+    assert recommender.recommend([movie_ids[0]], 5) == []
+    assert recommender.load()
+    ranked = recommender.recommend([movie_ids[0]], 5)
+    assert [movie_id for movie_id, _ in ranked] == [movie_ids[1], movie_ids[2]]
+    assert recommender.stats()["movies"] == 4
+
+
+def test_reload_swaps_the_whole_model(db, tmp_path):
+    movie_ids = db.movies.insert_many([{"title": f"Movie {number}"} for number in range(3)]).inserted_ids
+    seed_watches(db, movie_ids, [[0, 1]])
+    path = str(tmp_path / "model")
+    save_model(build_model(db), path)
+    recommender = Recommender(path)
+    recommender.load()
+    old = recommender.model
+
+    # A bigger catalog: every array changes size
+    movie_ids += db.movies.insert_many([{"title": f"New {number}"} for number in range(50)]).inserted_ids
+    seed_watches(db, movie_ids, [[0, 2], [0, 2], [2, 40]])
+    save_model(build_model(db), path)
+    recommender.load()
+
+    # A request that started before the reload keeps reading the old model
+    assert old.indptr.shape == (4,) and recommender.model.indptr.shape == (54,)
+    assert [movie_id for movie_id, _ in recommender.recommend([movie_ids[0]], 5)][0] == movie_ids[2]
+
+
+def test_builds_are_switched_through_current(db, tmp_path):
+    movie_ids = db.movies.insert_many([{"title": f"Movie {number}"} for number in range(3)]).inserted_ids
+    seed_watches(db, movie_ids, [[0, 1]])
+    path = str(tmp_path / "model")
+    save_model(build_model(db), path)
+    first = current_build(path)
+    recommender = Recommender(path)
+    recommender.load()
+    assert recommender.model.build == first
+
+    builds = [first]
+    for _ in range(KEEP_BUILDS):
+        save_model(build_model(db), path)
+        builds.append(current_build(path))
+
+    # The build that was just replaced stays readable; older ones are removed
+    assert len(set(builds)) == len(builds)
+    assert not os.path.exists(first)
+    assert os.path.exists(os.path.join(builds[-2], "indptr.npy"))
+    assert recommender.load() and recommender.model.build == builds[-1]
@@ -0,0 +1,23 @@
+"""Review aggregates are updated by the POST itself, not later by the view worker"""
+
+
+def test_posted_review_is_in_the_next_read(db, client):
+    movie_id = db.movies.insert_one({
+        "title": "Heat", "genres": ["Crime"], "rating": 4.5,
+        "review_count": 1, "rating_sum": 2.0, "rating_histogram": {"2": 1}
+    }).inserted_id
+    user_id = db.users.insert_one({"name": "Ann", "email": "ann@example.com"}).inserted_id
+
+    # Cached with the old aggregates
+    before = client.get(f"/movies/{movie_id}/reviews").json()
+    assert (before["total_reviews"], before["average_rating"]) == (1, 2.0)
+
+    response = client.post(f"/movies/{movie_id}/reviews",
+                           json={"user_id": str(user_id), "rating": 5.0, "review_text": "Great"})
+    assert response.status_code == 201
+
+    after = client.get(f"/movies/{movie_id}/reviews").json()
+    assert (after["total_reviews"], after["average_rating"]) == (2, 3.5)
+    assert after["rating_histogram"] == {"2": 1, "5": 1}
+    summary = client.post("/movies/reviews/summary:batch", json={"ids": [str(movie_id)]}).json()
+    assert summary["results"][0]["total_reviews"] == 2
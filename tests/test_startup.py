@@ -0,0 +1,63 @@
+"""Startup: the server answers right away and /ready waits for the warm-up"""
+import asyncio
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from fastapi.testclient import TestClient
+
+import app as app_module
+from benchmark import STARTUP_TARGET_MS
+from suggest import suggest_index
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def test_first_response_within_target(db):
+    start = time.perf_counter()
+    with TestClient(app_module.app) as client:
+        response = client.get("/")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+    assert response.status_code == 200
+    assert elapsed_ms < STARTUP_TARGET_MS
+
+
+def test_ready_only_after_warmup(db, monkeypatch):
+    release = threading.Event()
+    load = suggest_index.load
+
+    async def slow_load(database):
+        # Why poll a threading.Event? The test runs outside the app's loop
+        while not release.is_set():
+            await asyncio.sleep(0.01)
+        await load(database)
+
+    monkeypatch.setattr(suggest_index, "load", slow_load)
+    with TestClient(app_module.app) as client:
+        response = client.get("/ready")
+        assert response.status_code == 503
+        assert response.json()["warmup"]["suggestions"] == "running"
+
+        release.set()
+        deadline = time.monotonic() + 10
+        while client.get("/ready").status_code != 200:
+            assert time.monotonic() < deadline, client.get("/ready").json()
+            time.sleep(0.01)
+
+
+def test_import_opens_no_client():
+    # Why a new interpreter? This one already imported (and mocked) everything
+    code = "\n".join([
+        "import motor.motor_asyncio, pymongo",
+        "def refuse(*args, **kwargs):",
+        "    raise AssertionError('MongoDB client created at import')",
+        "pymongo.MongoClient.__init__ = refuse",
+        "motor.motor_asyncio.AsyncIOMotorClient.__init__ = refuse",
+        "import app, database",
+        "assert database.client is None and database.async_client is None",
+    ])
+    result = subprocess.run([sys.executable, "-c", code], cwd=REPO_ROOT,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr
@@ -0,0 +1,77 @@
+"""Typeahead: precomputed ranked lists stay right as movies and watches arrive"""
+import asyncio
+from types import SimpleNamespace
+
+import suggest
+from database import get_async_db
+from search_engine import SearchEngine
+from suggest import SuggestIndex
+
+
+def load_index(db, monkeypatch, titles):
+    # Small limits so a handful of movies has ranked prefixes
+    monkeypatch.setattr(suggest, "SUGGEST_RANKED_MIN_RANGE", 3)
+    monkeypatch.setattr(suggest, "SUGGEST_RANKED_SIZE", 2)
+    db.movies.insert_many([{"_id": number, "title": title, "watch_count": number * 10}
+                           for number, title in enumerate(titles)])
+    index = SuggestIndex()
+    asyncio.run(index.load(get_async_db()))
+    return index
+
+
+def texts(index, prefix, k=2):
+    return [suggestion["text"] for suggestion in index.suggest(prefix, k)]
+
+
+def test_ranked_prefix_follows_watches(db, monkeypatch):
+    index = load_index(db, monkeypatch, ["Mad Max", "Memento", "Matrix", "Moon", "Up"])
+    assert "m" in index.ranked and "up" not in index.ranked
+    assert texts(index, "m") == ["Moon", "Matrix"]
+    assert texts(index, "up") == ["Up"]
+
+    # Mad Max was outside the ranked list of "m"; enough watches move it in
+    index.add_watches([0] * 100)
+    assert texts(index, "m") == ["Mad Max", "Moon"]
+    assert texts(index, "max") == ["Mad Max"]
+    assert index.suggest("m", 1)[0]["watch_count"] == 100
+
+
+def test_added_movies_are_suggested_without_a_reload(db, monkeypatch):
+    index = load_index(db, monkeypatch, ["Mad Max", "Memento", "Matrix", "Moon"])
+    keys = list(index.keys)
+
+    index.add_movie({"_id": 10, "title": "Metropolis"}, watch_count=500)
+    index.add_movie({"_id": 11, "title": "Zodiac"}, watch_count=1)
+    assert index.keys == keys
+    assert texts(index, "m") == ["Metropolis", "Moon"]
+    assert texts(index, "metro") == ["Metropolis"]
+    assert texts(index, "zod") == ["Zodiac"]
+
+    # A changed movie replaces its old names
+    index.add_movie({"_id": 10, "title": "Zelig"}, watch_count=500)
+    assert texts(index, "m") == ["Moon", "Matrix"]
+    assert texts(index, "metro") == []
+    assert texts(index, "z") == ["Zelig", "Zodiac"]
+
+
+def test_movies_added_during_a_load_survive_the_swap(db, monkeypatch):
+    db.movies.insert_many([{"_id": 0, "title": "Memento"}, {"_id": 1, "title": "Moon"}])
+    added = {"_id": 2, "title": "Metropolis"}
+
+    # Added after the load has read the catalog, before it swaps
+    index = SuggestIndex()
+    async def add_then_build(build, *args):
+        index.add_movie(added)
+        build(*args)
+    monkeypatch.setattr(suggest, "run_in_threadpool", add_then_build)
+    asyncio.run(index.load(get_async_db()))
+    assert texts(index, "metro") == ["Metropolis"]
+    assert not index.loading
+
+    engine = SearchEngine()
+    async def catalog(*args):
+        yield {"_id": 0, "title": "Memento"}
+        engine.add_movie(added)
+    asyncio.run(engine.load(SimpleNamespace(movies=SimpleNamespace(find=catalog))))
+    assert engine.search("metropolis", 10)[0] == 1
+    assert not engine.loading
@@ -0,0 +1,52 @@
+"""Polling view worker: every new document is applied, whatever its _id"""
+import asyncio
+from datetime import datetime
+
+from bson import ObjectId
+
+from database import get_async_db
+from views import CHECKPOINT_ID, SEQUENCE_FIELD, ViewMaintainer
+
+
+async def run_until(maintainer, done):
+    maintainer.start()
+    for _ in range(200):
+        if done():
+            break
+        await asyncio.sleep(0.01)
+    await maintainer.stop()
+
+
+def test_polling_applies_ids_older_than_the_checkpoint(db):
+    movie_id = db.movies.insert_one({"title": "Memento", "watch_count": 0}).inserted_id
+    user_id = db.users.insert_one({"name": "User"}).inserted_id
+    event = {"user_id": user_id, "movie_id": movie_id, "timestamp": datetime(2024, 5, 1), "watch_duration": 30}
+    # There before the first start: trusted as applied
+    db.watch_history.insert_one(dict(event))
+
+    async def scenario():
+        async_db = get_async_db()
+        leader = ViewMaintainer(async_db, source="polling", poll_interval_ms=10)
+        follower = ViewMaintainer(async_db, source="polling", poll_interval_ms=10, follower=True)
+        await run_until(leader, lambda: db.view_checkpoints.find_one({"_id": CHECKPOINT_ID}))
+        follower.start()
+        await asyncio.sleep(0.05)
+
+        # Client-made ids: older than anything seen so far (e.g. generate_data.py)
+        db.watch_history.insert_many([
+            dict(event, _id=ObjectId.from_datetime(datetime(2020, 9, 13))),
+            dict(event, _id=ObjectId("5f5e1000" + "0" * 16))
+        ])
+        await run_until(leader, lambda: leader.applied_watches == 2)
+        for _ in range(200):
+            if follower.applied_watches:
+                break
+            await asyncio.sleep(0.01)
+        await follower.stop()
+        return leader, follower
+
+    leader, follower = asyncio.run(scenario())
+    assert leader.applied_watches == 2 and follower.applied_watches == 2
+    assert db.movies.find_one({"_id": movie_id})["watch_count"] == 2
+    assert sorted(event[SEQUENCE_FIELD] for event in db.watch_history.find()) == [0, 1, 1]
+    assert db.view_checkpoints.find_one({"_id": CHECKPOINT_ID})["sequence"] == 1
@@ -0,0 +1,108 @@
+"""
+Rolling trending table
+
+Instead of grouping every raw watch event on each /movies/top-watched call,
+we keep one small counter document per movie per day:
+
+    {"movie_id": ..., "day": <midnight>, "watch_count": 12}
+
+Ingest adds +1 to the bucket of each event. Reading the top K over N days
+then only touches N buckets per movie, no matter how many raw events exist.
+
+Usage (rebuild buckets from existing watch_history):
+    python trending.py --rebuild
+"""
+import argparse
+from collections import Counter
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+DEFAULT_DAYS = 30
+MAX_DAYS = 365
+DEFAULT_TOP_K = 5
+MAX_TOP_K = 100
+
+
+def day_of(timestamp):
+    """Truncate a timestamp to the start of its day (the bucket key)"""
+    return datetime(timestamp.year, timestamp.month, timestamp.day)
+
+
+def bucket_updates(events):
+    """
+    Build upsert operations that add a batch of watch events to their buckets
+    Why group first? 1000 events for the same movie/day become one $inc
+    """
+    counts = Counter((event['movie_id'], day_of(event['timestamp'])) for event in events)
+    return [
+        UpdateOne(
+            {"movie_id": movie_id, "day": day},
+            {"$inc": {"watch_count": count}},
+            upsert=True
+        )
+        for (movie_id, day), count in counts.items()
+    ]
+
+
+async def top_movie_counts(daily_watches, days, k):
+    """
+    Return [(movie_id, watch_count)] for the k most watched movies of the
+    last `days` days (today included), highest first
+    """
+    start_day = day_of(datetime.now()) - timedelta(days=days - 1)
+
+    # Sum the small daily buckets per movie and keep the top k, on the server
+    # Why not in Python? A year of buckets is up to 365 documents per movie;
+    # only k rows should cross the wire
+    # Why $sort + $limit together? The server keeps a k-sized top list
+    # instead of sorting every movie
+    cursor = daily_watches.aggregate([
+        {"$match": {"day": {"$gte": start_day}}},
+        {"$group": {"_id": "$movie_id", "watch_count": {"$sum": "$watch_count"}}},
+        # Why _id too? Movies with the same count keep a stable order
+        {"$sort": {"watch_count": -1, "_id": 1}},
+        {"$limit": k}
+    ])
+    return [(bucket['_id'], bucket['watch_count']) async for bucket in cursor]
+
+
+def rebuild_buckets(db):
+    """Recompute all daily buckets from raw watch_history (one-off backfill)"""
+    db.movie_daily_watches.delete_many({})
+    db.watch_history.aggregate([
+        {"$group": {
+            "_id": {
+                "movie_id": "$movie_id",
+                "day": {"$dateTrunc": {"date": "$timestamp", "unit": "day"}}
+            },
+            "watch_count": {"$sum": 1}
+        }},
+        {"$project": {
+            "_id": 0,
+            "movie_id": "$_id.movie_id",
+            "day": "$_id.day",
+            "watch_count": 1
+        }},
+        {"$merge": {
+            "into": "movie_daily_watches",
+            "on": ["day", "movie_id"],
+            "whenMatched": "replace",
+            "whenNotMatched": "insert"
+        }}
+    ])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the daily trending buckets")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute buckets from watch_history")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        from database import create_indexes, get_db
+        # Why indexes first? $merge needs the unique (day, movie_id) index
+        create_indexes()
+        rebuild_buckets(get_db())
+        print("Daily trending buckets rebuilt!")
+    else:
+        parser.print_help()
@@ -0,0 +1,363 @@
+"""
+Materialized views kept current from the write log
+
+Derived data lives in small summary fields/collections so read endpoints
+are point reads:
+
+- movie_daily_watches     daily watch counts per movie (trending.py)
+- movies.watch_count      all-time watch count (search popularity)
+
+A background worker applies every new watch_history document to these
+views. It reads new documents from:
+
+- a change stream (replica sets): updates and the resume token are saved
+  in one transaction, so each change is applied exactly once
+- polling (standalone servers, which have no change streams): documents
+  without a view_seq are read, applied, then stamped with the batch's
+  sequence number (saved in the checkpoint once the stamps are written)
+
+Why stamp documents instead of reading them in _id order? ObjectIds are
+made by clients: an event can arrive after newer ids (a slow insert, a
+retry) or carry an old id (generate_data.py, imports), and would be
+skipped. Which documents are new is only known once they are stamped.
+
+Where it stopped is saved in the view_checkpoints collection, so a restart
+continues from there instead of rebuilding. A first start begins at "now"
+and trusts the views as they are; rebuild them once with
+`python views.py --rebuild` if they are out of date.
+
+Why not update the views in the request handlers? Writes from any process
+(ingest, scripts, other API workers) are covered, and the handlers only
+insert. Run one worker per database (VIEWS_SOURCE=off on the others).
+
+Review aggregates (movies.review_count, rating_sum, rating_histogram) are
+the exception: POST /movies/{id}/reviews adds the rating with one atomic
+$inc before it answers, so a client reads its own review in the average
+right away. The worker still follows new reviews, to refresh the cache
+and search ratings of every process; `--rebuild` repairs the aggregates.
+
+Other API processes of the same server (serve.py) run it as a follower:
+it reads the same new documents from "now" but writes nothing, only
+bringing that process's search index and cache in step. When polling, it
+reads each stamped batch up to the sequence in the checkpoint.
+"""
+import argparse
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure, PyMongoError
+
+from cache import invalidate_for_review, invalidate_for_watches
+from ratings import effective_rating
+from search_engine import search_engine
+from suggest import suggest_index
+from trending import bucket_updates
+
+# auto: change stream, or polling if the server has no change streams
+VIEWS_SOURCE = os.environ.get('VIEWS_SOURCE', 'auto')
+VIEWS_BATCH_SIZE = int(os.environ.get('VIEWS_BATCH_SIZE', 1000))
+VIEWS_POLL_INTERVAL_MS = int(os.environ.get('VIEWS_POLL_INTERVAL_MS', 500))
+VIEWS_RETRY_BACKOFF_MS = int(os.environ.get('VIEWS_RETRY_BACKOFF_MS', 1000))
+
+SOURCES = ("auto", "changestream", "polling", "off")
+
+# Collections whose inserts feed the views
+WATCHES = "watch_history"
+REVIEWS = "reviews"
+
+CHECKPOINT_ID = "views"
+# Batch number stamped on polled documents; 0 = there before the first poll
+SEQUENCE_FIELD = "view_seq"
+
+# MongoDB error code for "change streams need a replica set"
+CHANGE_STREAM_UNSUPPORTED = 40573
+
+
+def watch_count_updates(events):
+    """One $inc of movies.watch_count per movie in a batch of watch events"""
+    counts = Counter(event['movie_id'] for event in events)
+    return [
+        UpdateOne({"_id": movie_id}, {"$inc": {"watch_count": count}})
+        for movie_id, count in counts.items()
+    ]
+
+
+def rebuild_watch_counts(db):
+    """
+    Recompute every movie's watch_count from watch_history
+    (archived events are added by rebuild_views)
+    """
+    db.movies.update_many({}, {"$set": {"watch_count": 0}})
+    db.watch_history.aggregate([
+        {"$group": {"_id": "$movie_id", "watch_count": {"$sum": 1}}},
+        {"$merge": {"into": "movies", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}}
+    ])
+
+
+def rebuild_views(db):
+    """Recompute every view from scratch (one-off backfill)"""
+    from archive import iter_archived_events
+    from ratings import rebuild_review_stats
+    from trending import rebuild_buckets
+
+    # The rebuilt views include everything, so the worker starts over at "now"
+    db.view_checkpoints.delete_one({"_id": CHECKPOINT_ID})
+    rebuild_buckets(db)
+    rebuild_watch_counts(db)
+    # Archived events are compressed, so they are added in Python
+    for events in iter_archived_events(db):
+        db.movie_daily_watches.bulk_write(bucket_updates(events), ordered=False)
+        db.movies.bulk_write(watch_count_updates(events), ordered=False)
+    rebuild_review_stats(db)
+
+
+class ViewMaintainer:
+    """Background worker applying new watch events and reviews to the views"""
+
+    def __init__(self, db, source=VIEWS_SOURCE, batch_size=VIEWS_BATCH_SIZE,
+                 poll_interval_ms=VIEWS_POLL_INTERVAL_MS,
+                 retry_backoff_ms=VIEWS_RETRY_BACKOFF_MS, follower=False):
+        if source not in SOURCES:
+            raise ValueError(f"VIEWS_SOURCE must be one of {SOURCES}, got {source!r}")
+        self.db = db
+        self.source = source
+        # Followers only update this process (no view writes, no checkpoint)
+        self.follower = follower
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval_ms / 1000
+        self.retry_backoff = retry_backoff_ms / 1000
+        self.task = None
+
+        # Counters for /views/stats
+        self.mode = None
+        self.applied_watches = 0
+        self.applied_reviews = 0
+        self.last_applied = None
+        self.errors = 0
+
+    def start(self):
+        """Start the background worker"""
+        if self.source != "off":
+            self.task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """
+        Stop the worker
+        Why is cancelling safe? The checkpoint only moves after a batch is
+        applied, so an interrupted batch is read again on the next start
+        """
+        if self.task is None:
+            return
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+        self.task = None
+
+    async def _run(self):
+        while True:
+            try:
+                if self.source == "polling":
+                    await self._poll()
+                else:
+                    await self._tail_change_stream()
+            except OperationFailure as e:
+                if e.code == CHANGE_STREAM_UNSUPPORTED and self.source == "auto":
+                    print("Change streams need a replica set, polling for new documents instead")
+                    self.source = "polling"
+                    continue
+                self.errors += 1
+                print(f"View worker failed, retrying: {e}")
+            except PyMongoError as e:
+                self.errors += 1
+                print(f"View worker failed, retrying: {e}")
+            await asyncio.sleep(self.retry_backoff)
+
+    # ----- Checkpoint -----
+
+    async def _load_checkpoint(self):
+        if self.follower:
+            return {}  # Followers start at "now"
+        return await self.db.view_checkpoints.find_one({"_id": CHECKPOINT_ID}) or {}
+
+    async def _save_checkpoint(self, fields, session=None):
+        if self.follower:
+            return
+        fields = dict(fields, updated_at=datetime.now())
+        await self.db.view_checkpoints.update_one(
+            {"_id": CHECKPOINT_ID}, {"$set": fields}, upsert=True, session=session
+        )
+
+    # ----- Change stream (replica sets) -----
+
+    async def _tail_change_stream(self):
+        self.mode = "changestream"
+        checkpoint = await self._load_checkpoint()
+        pipeline = [{"$match": {
+            "operationType": "insert",
+            "ns.coll": {"$in": [WATCHES, REVIEWS]}
+        }}]
+        async with self.db.watch(pipeline, resume_after=checkpoint.get("resume_token")) as stream:
+            while True:
+                watches, reviews = [], []
+                # try_next waits briefly and returns None once nothing is left
+                while len(watches) + len(reviews) < self.batch_size:
+                    change = await stream.try_next()
+                    if change is None:
+                        break
+                    target = watches if change['ns']['coll'] == WATCHES else reviews
+                    target.append(change['fullDocument'])
+
+                if not watches and not reviews:
+                    # Why not save the token when idle? Saving is itself a
+                    # write that moves the token, so it would never go idle
+                    continue
+                token = stream.resume_token
+
+                # Why a transaction? Views and resume token move together, so
+                # a crash can't apply a change twice
+                if not self.follower:
+                    async with await self.db.client.start_session() as session:
+                        async with session.start_transaction():
+                            await self._apply(watches, reviews, session)
+                            await self._save_checkpoint({"resume_token": token}, session)
+                await self._after_apply(watches, reviews)
+
+    # ----- Polling (standalone servers) -----
+
+    async def _poll(self):
+        self.mode = "polling"
+        if self.follower:
+            await self._follow_stamps()
+            return
+
+        checkpoint = await self._load_checkpoint()
+        sequence = checkpoint.get("sequence")
+        if sequence is None:
+            # First start: documents already there count as applied, like
+            # the views. Upgrading from _id positions keeps the later ones
+            positions = checkpoint.get("positions") or {}
+            for name in (WATCHES, REVIEWS):
+                query = {SEQUENCE_FIELD: None}
+                if name in positions:
+                    query["_id"] = {"$lte": positions[name]}
+                await self.db[name].update_many(query, {"$set": {SEQUENCE_FIELD: 0}})
+            sequence = 0
+        # Stamped but stopped before saving the checkpoint: never reuse a number
+        for name in (WATCHES, REVIEWS):
+            last = await self.db[name].find_one(
+                {SEQUENCE_FIELD: {"$gt": sequence}}, {SEQUENCE_FIELD: 1}, sort=[(SEQUENCE_FIELD, -1)]
+            )
+            if last is not None:
+                sequence = last[SEQUENCE_FIELD]
+        await self._save_checkpoint({"sequence": sequence})
+
+        while True:
+            batches = {}
+            for name in (WATCHES, REVIEWS):
+                batches[name] = await self.db[name].find(
+                    {SEQUENCE_FIELD: None}
+                ).limit(self.batch_size).to_list(length=None)
+
+            watches, reviews = batches[WATCHES], batches[REVIEWS]
+            if watches or reviews:
+                sequence += 1
+                # Without transactions, a crash before the stamps are written
+                # applies the batch again on restart
+                await self._apply(watches, reviews)
+                for name, docs in batches.items():
+                    if docs:
+                        await self.db[name].update_many(
+                            {"_id": {"$in": [doc['_id'] for doc in docs]}},
+                            {"$set": {SEQUENCE_FIELD: sequence}}
+                        )
+                await self._save_checkpoint({"sequence": sequence})
+                await self._after_apply(watches, reviews)
+
+            # A full batch means more is waiting: read it right away
+            if max(len(watches), len(reviews)) < self.batch_size:
+                await asyncio.sleep(self.poll_interval)
+
+    async def _stamped_sequence(self):
+        """Last batch whose stamps are all written (saved after them)"""
+        checkpoint = await self.db.view_checkpoints.find_one({"_id": CHECKPOINT_ID}, {"sequence": 1})
+        return (checkpoint or {}).get("sequence", 0)
+
+    async def _follow_stamps(self):
+        """Followers: read each batch the polling worker stamps from now on"""
+        position = await self._stamped_sequence()
+        while True:
+            stamped = await self._stamped_sequence()
+            while position < stamped:
+                position += 1
+                watches, reviews = [
+                    await self.db[name].find({SEQUENCE_FIELD: position}).to_list(length=None)
+                    for name in (WATCHES, REVIEWS)
+                ]
+                if watches or reviews:
+                    await self._after_apply(watches, reviews)
+            await asyncio.sleep(self.poll_interval)
+
+    # ----- Applying changes -----
+
+    async def _apply(self, watches, reviews, session=None):
+        """Add a batch of new documents to every view"""
+        if self.follower:
+            return
+        if watches:
+            await self.db.movie_daily_watches.bulk_write(bucket_updates(watches), ordered=False, session=session)
+            await self.db.movies.bulk_write(watch_count_updates(watches), ordered=False, session=session)
+        # Reviews: already counted by the handler that inserted them
+
+    async def _after_apply(self, watches, reviews):
+        """Bring this process's cache and search index in step with the views"""
+        self.applied_watches += len(watches)
+        self.applied_reviews += len(reviews)
+        self.last_applied = datetime.now()
+
+        if watches:
+            await invalidate_for_watches(event['movie_id'] for event in watches)
+            search_engine.add_watches(event['movie_id'] for event in watches)
+            suggest_index.add_watches(event['movie_id'] for event in watches)
+        if reviews:
+            movie_ids = list({review['movie_id'] for review in reviews})
+            for movie_id in movie_ids:
+                await invalidate_for_review(str(movie_id))
+            if search_engine.loaded:
+                cursor = self.db.movies.find(
+                    {"_id": {"$in": movie_ids}},
+                    {"rating": 1, "review_count": 1, "rating_sum": 1}
+                )
+                async for movie in cursor:
+                    search_engine.set_rating(movie['_id'], effective_rating(movie))
+
+    def stats(self):
+        return {
+            "source": self.source,
+            "mode": self.mode,
+            "follower": self.follower,
+            "running": self.task is not None and not self.task.done(),
+            "applied_watches": self.applied_watches,
+            "applied_reviews": self.applied_reviews,
+            "last_applied": self.last_applied,
+            "errors": self.errors
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain the materialized views")
+    parser.add_argument("--rebuild", action="store_true", help="Recompute every view from raw data")
+    args = parser.parse_args()
+
+    if args.rebuild:
+        from database import create_indexes, get_db
+        # Why indexes first? $merge needs the unique (day, movie_id) index
+        create_indexes()
+        rebuild_views(get_db())
+        print("Materialized views rebuilt!")
+    else:
+        parser.print_help()